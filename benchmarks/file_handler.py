@@ -0,0 +1,89 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Compares the records/sec of 'logging.FileHandler', 'ecs_logging.BatchedFileHandler'
+and 'ecs_logging.GzipFileHandler' writing ECS documents to a file.
+
+    python benchmarks/file_handler.py [--records N] [--fsync POLICY]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import ecs_logging
+
+
+def run(handler, records):
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger = logging.getLogger(f"benchmark-{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("request %d handled", i, extra={"http.response.status_code": 200})
+    handler.close()
+    elapsed = time.perf_counter() - start
+
+    logger.removeHandler(handler)
+    return records / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument(
+        "--fsync", choices=("never", "always", "rotate"), default="never"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        handlers = {
+            "FileHandler": lambda: logging.FileHandler(
+                os.path.join(directory, "file_handler.ndjson")
+            ),
+            "BatchedFileHandler": lambda: ecs_logging.BatchedFileHandler(
+                os.path.join(directory, "batched_file_handler.ndjson"),
+                fsync=args.fsync,
+            ),
+            "GzipFileHandler": lambda: ecs_logging.GzipFileHandler(
+                os.path.join(directory, "gzip_file_handler.ndjson.gz"),
+                fsync=args.fsync,
+            ),
+        }
+        results = {}
+        for name, factory in handlers.items():
+            handler = factory()
+            results[name] = (
+                run(handler, args.records),
+                os.path.getsize(handler.baseFilename),
+            )
+
+    baseline = results["FileHandler"][0]
+    for name, (rate, size) in results.items():
+        print(
+            f"{name:<20} {rate:>12,.0f} records/sec  ({rate / baseline:.2f}x)"
+            f"  {size / 1024 / 1024:>8.1f} MiB written"
+        )
+
+
+if __name__ == "__main__":
+    main()
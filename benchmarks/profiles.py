@@ -0,0 +1,132 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Payload profiles shared by the benchmarks. Every profile is built the
+same way on every run so that results can be compared with a baseline.
+"""
+
+import logging
+import sys
+import traceback
+
+NON_ASCII_MESSAGE = "Zahlung für Bestellung %s fehlgeschlagen: 支付失败 ❌ (%s)"
+
+DEEP_EXTRA = {
+    "http": {
+        "request": {
+            "method": "POST",
+            "bytes": 1437,
+            "headers": {
+                "accept": "application/json",
+                "content-type": "application/json",
+                "user-agent": "Mozilla/5.0 (X11; Linux x86_64)",
+                "x-request-id": "5d1a6b2c-34a9-4c1e-9d0b-7f1e2a3b4c5d",
+            },
+        },
+        "response": {"status_code": 502, "bytes": 89, "mime_type": "text/plain"},
+        "version": "1.1",
+    },
+    "url": {
+        "path": "/api/v1/orders/1234/payments",
+        "query": "expand=items&currency=EUR",
+        "scheme": "https",
+        "domain": "shop.example.com",
+    },
+    "user": {"id": "u-42", "roles": ["customer", "beta"]},
+    "labels": {"tenant": "acme", "region": "eu-west-1", "shard": "7"},
+    "event.duration": 184000000,
+    "event.outcome": "failure",
+}
+
+APM_ATTRIBUTES = {
+    "elasticapm_transaction_id": "a1b2c3d4e5f60718",
+    "elasticapm_trace_id": "0af7651916cd43dd8448eb211c80319c",
+    "elasticapm_span_id": "b7ad6b7169203331",
+    "elasticapm_service_name": "checkout",
+    "elasticapm_service_environment": "production",
+    "elasticapm_labels": {"transaction.id": "a1b2c3d4e5f60718"},
+}
+
+GLOBAL_EXTRA = {
+    "service.name": "checkout",
+    "service.version": "3.14.1",
+    "service.environment": "production",
+    "host.name": "checkout-7d9f8b-x2k4q",
+    "cloud.provider": "aws",
+    "cloud.region": "eu-west-1",
+    "cloud.availability_zone": "eu-west-1b",
+    "orchestrator.cluster.name": "prod-eu-1",
+}
+
+
+def _raise_from_depth(depth):
+    if depth == 0:
+        raise ConnectionError("upstream payment service closed the connection")
+    _raise_from_depth(depth - 1)
+
+
+def long_traceback_exc_info(depth=40):
+    try:
+        _raise_from_depth(depth)
+    except ConnectionError:
+        return sys.exc_info()
+
+
+def make_record(profile):
+    """Returns a 'LogRecord' for one of the 'RECORD_PROFILES'"""
+    msg, args, exc_info, attributes = "order %s paid", ("1234",), None, {}
+    if profile == "deep_extra":
+        attributes = DEEP_EXTRA
+    elif profile == "apm":
+        attributes = APM_ATTRIBUTES
+    elif profile == "exception":
+        msg = "payment for order %s failed"
+        exc_info = long_traceback_exc_info()
+    elif profile == "non_ascii":
+        msg, args = NON_ASCII_MESSAGE, ("1234", "Zeitüberschreitung")
+
+    record = logging.LogRecord(
+        name="checkout.payments",
+        level=logging.ERROR if exc_info else logging.INFO,
+        pathname="/srv/checkout/payments.py",
+        lineno=87,
+        msg=msg,
+        args=args,
+        exc_info=exc_info,
+        func="charge",
+    )
+    record.__dict__.update(attributes)
+    return record
+
+
+def make_event_dict(profile):
+    """Returns a structlog event dict for one of the 'EVENT_PROFILES'"""
+    event_dict = {"event": "order 1234 paid", "logger": "checkout.payments"}
+    if profile == "deep_extra":
+        event_dict.update(DEEP_EXTRA)
+    elif profile == "exception":
+        event_dict["event"] = "payment for order 1234 failed"
+        event_dict["exception"] = "".join(
+            traceback.format_exception(*long_traceback_exc_info())
+        )
+    elif profile == "non_ascii":
+        event_dict["event"] = NON_ASCII_MESSAGE % ("1234", "Zeitüberschreitung")
+    return event_dict
+
+
+RECORD_PROFILES = ["plain", "deep_extra", "apm", "exception", "non_ascii"]
+EVENT_PROFILES = ["plain", "deep_extra", "exception", "non_ascii"]
@@ -0,0 +1,49 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import copy
+
+import ecs_logging
+
+from .profiles import GLOBAL_EXTRA
+
+
+def test_stdlib_format(benchmark, record):
+    formatter = ecs_logging.StdlibFormatter()
+    benchmark(formatter.format, record)
+
+
+def test_stdlib_format_global_extra(benchmark, record):
+    formatter = ecs_logging.StdlibFormatter(extra=GLOBAL_EXTRA)
+    benchmark(formatter.format, record)
+
+
+def test_stdlib_format_exclude_fields(benchmark, record):
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["process", "log.original", "http.request.headers.*"]
+    )
+    benchmark(formatter.format, record)
+
+
+def test_structlog_format(benchmark, event_dict):
+    formatter = ecs_logging.StructlogFormatter()
+    # The formatter changes the event dict, so every round gets a copy
+    benchmark.pedantic(
+        formatter,
+        setup=lambda: ((None, "info", copy.deepcopy(event_dict)), {}),
+        rounds=2000,
+    )
@@ -0,0 +1,46 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+import pytest
+
+import ecs_logging
+
+from .profiles import RECORD_PROFILES, make_record
+
+
+@pytest.fixture(scope="module")
+def path(tmp_path_factory):
+    formatter = ecs_logging.StdlibFormatter()
+    records = [make_record(profile) for profile in RECORD_PROFILES]
+    for i, record in enumerate(records):
+        record.levelno = logging.ERROR if i == 0 else logging.INFO
+        record.levelname = logging.getLevelName(record.levelno)
+    lines = "".join(formatter.format(record) + "\n" for record in records)
+    path = tmp_path_factory.mktemp("reader") / "app.ndjson"
+    path.write_text(lines * 1000, encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("json_backend", ["json", "orjson"])
+def test_read_events(benchmark, path, json_backend):
+    benchmark(lambda: list(ecs_logging.read_events(path, json_backend=json_backend)))
+
+
+def test_read_events_filtered(benchmark, path):
+    benchmark(lambda: list(ecs_logging.read_events(path, levels=["error"])))
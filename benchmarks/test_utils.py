@@ -0,0 +1,67 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import copy
+
+import pytest
+
+import ecs_logging
+from ecs_logging._utils import (
+    flatten_dict,
+    json_dumps,
+    merge_dicts,
+    normalize_dict,
+)
+
+from .profiles import (
+    DEEP_EXTRA,
+    GLOBAL_EXTRA,
+    RECORD_PROFILES,
+    make_record,
+)
+
+
+@pytest.fixture(params=RECORD_PROFILES)
+def ecs_dict(request):
+    return ecs_logging.StdlibFormatter().format_to_ecs(make_record(request.param))
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_json_dumps(benchmark, ecs_dict, ensure_ascii):
+    benchmark(json_dumps, ecs_dict, ensure_ascii=ensure_ascii)
+
+
+def test_normalize_dict(benchmark):
+    dotted = dict(flatten_dict(DEEP_EXTRA), **GLOBAL_EXTRA)
+    # 'normalize_dict()' changes its argument, so every round gets a copy
+    benchmark.pedantic(
+        normalize_dict, setup=lambda: ((copy.deepcopy(dotted),), {}), rounds=2000
+    )
+
+
+def test_flatten_dict(benchmark):
+    benchmark(flatten_dict, DEEP_EXTRA)
+
+
+def test_merge_dicts(benchmark):
+    from_ = normalize_dict(dict(GLOBAL_EXTRA))
+    # 'merge_dicts()' changes 'into', so every round gets a copy
+    benchmark.pedantic(
+        merge_dicts,
+        setup=lambda: ((from_, copy.deepcopy(DEEP_EXTRA)), {}),
+        rounds=2000,
+    )
@@ -0,0 +1,112 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Measures how the records/sec of a 'StdlibFormatter' and a 'StructlogFormatter'
+shared by 1 to N threads scale. With the GIL only one thread formats at a time,
+on free-threaded builds (3.13t, 3.14t) the throughput should grow close to
+linearly with the number of threads.
+
+    python benchmarks/thread_scaling.py [--records N] [--threads N]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import ecs_logging
+
+
+def stdlib_worker(formatter):
+    # Every thread logs its own records, like threads of an application do
+    record = logging.LogRecord(
+        "app", logging.INFO, __file__, 42, "request %d handled", (1,), None, "handle"
+    )
+    record.__dict__["http.response.status_code"] = 200
+
+    def run(records):
+        format = formatter.format
+        for _ in range(records):
+            format(record)
+
+    return run
+
+
+def structlog_worker(formatter):
+    event = {"event": "request handled", "http.response.status_code": 200}
+
+    def run(records):
+        for _ in range(records):
+            # The formatter changes the event dict
+            formatter(None, "info", dict(event))
+
+    return run
+
+
+def measure(make_worker, formatter, threads, records):
+    barrier = threading.Barrier(threads + 1)
+
+    def target():
+        run = make_worker(formatter)
+        barrier.wait()
+        run(records)
+
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return threads * records / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000, help="per thread")
+    parser.add_argument("--threads", type=int, default=min(os.cpu_count() or 1, 16))
+    args = parser.parse_args()
+
+    counts = [1]
+    while counts[-1] * 2 < args.threads:
+        counts.append(counts[-1] * 2)
+    if args.threads > 1:
+        counts.append(args.threads)
+
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"Python {sys.version.split()[0]} with the GIL "
+        f"{'enabled' if gil_enabled else 'disabled'}"
+    )
+    for name, make_worker, formatter in (
+        ("StdlibFormatter", stdlib_worker, ecs_logging.StdlibFormatter()),
+        ("StructlogFormatter", structlog_worker, ecs_logging.StructlogFormatter()),
+    ):
+        single = None
+        for threads in counts:
+            rate = measure(make_worker, formatter, threads, args.records)
+            single = single or rate
+            print(
+                f"{name:<20} {threads:>3} threads {rate:>12,.0f} records/sec"
+                f" {rate / single:>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
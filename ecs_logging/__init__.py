@@ -16,13 +16,79 @@
 # under the License.
 """Logging formatters for ECS (Elastic Common Schema) in Python"""
 
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+from ._context import bind, bound_fields, unbind
+from ._correlation import (
+    CorrelationProvider,
+    ElasticAPMCorrelation,
+    OpenTelemetryCorrelation,
+)
+from ._filters import DeduplicationFilter, DeduplicationProcessor
+from ._handlers import BatchedFileHandler, GzipFileHandler
 from ._meta import ECS_VERSION
+from ._profiling import FormatterProfiler, StageStats
+from ._queue import AsyncQueueHandler, QueueHandler, QueueListener
 from ._stdlib import StdlibFormatter
 from ._structlog import StructlogFormatter
 
+if TYPE_CHECKING:
+    from ._elasticsearch import ElasticsearchHandler
+    from ._reader import read_events
+    from ._shared_memory import (
+        SharedMemoryCollector,
+        SharedMemoryHandler,
+        SharedMemoryRing,
+    )
+
+# Names which are imported on first use, as their modules import
+# 'ssl', 'http.client', 'mmap' or 'multiprocessing.shared_memory',
+# which slow down importing 'ecs_logging' or aren't on all platforms.
+_LAZY_NAMES = {
+    "ElasticsearchHandler": "._elasticsearch",
+    "SharedMemoryCollector": "._shared_memory",
+    "SharedMemoryHandler": "._shared_memory",
+    "SharedMemoryRing": "._shared_memory",
+    "read_events": "._reader",
+}
+
 __version__ = "2.3.0"
 __all__ = [
+    "AsyncQueueHandler",
+    "BatchedFileHandler",
+    "CorrelationProvider",
+    "DeduplicationFilter",
+    "DeduplicationProcessor",
     "ECS_VERSION",
+    "ElasticAPMCorrelation",
+    "ElasticsearchHandler",
+    "FormatterProfiler",
+    "GzipFileHandler",
+    "OpenTelemetryCorrelation",
+    "QueueHandler",
+    "QueueListener",
+    "SharedMemoryCollector",
+    "SharedMemoryHandler",
+    "SharedMemoryRing",
+    "StageStats",
     "StdlibFormatter",
     "StructlogFormatter",
+    "bind",
+    "bound_fields",
+    "read_events",
+    "unbind",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY_NAMES))
@@ -0,0 +1,310 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Converts plain text or JSON logs to ECS NDJSON.
+
+Reads lines from files or stdin and writes an ECS document for each
+line to stdout, ie in a sidecar container:
+
+    legacy-app 2>&1 | python -m ecs_logging --map msg=message \\
+        --map level=log.level --extra service.name=legacy-app
+"""
+
+import argparse
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Any, BinaryIO, Dict, Iterator, List, Optional, Sequence
+
+from ._convert import LineConverter, convert_in_worker, init_worker
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = _parse_args(argv)
+    options: Dict[str, Any] = {
+        "mapping": args.map,
+        "pattern": args.pattern,
+        "extra": args.extra or None,
+        "exclude_fields": args.exclude_fields,
+        "level": args.level,
+        "keep_original": args.keep_original,
+        "ensure_ascii": args.ensure_ascii,
+        "json_backend": args.json_backend,
+        "max_bytes": args.max_bytes,
+        "max_field_length": args.max_field_length,
+    }
+    converter = LineConverter(**options)
+    output: BinaryIO = open(args.output, "ab") if args.output else sys.stdout.buffer
+    throughput = _Throughput(args.stats_interval if args.stats else None)
+    batches = _read_batches(args.files or ["-"], args.batch_size)
+    try:
+        if args.workers > 1:
+            _convert_in_workers(batches, output, throughput, options, args.workers)
+        else:
+            for lines in batches:
+                data = converter.convert_lines(lines)
+                output.write(data)
+                output.flush()
+                throughput.add(data.count(b"\n"))
+    except BrokenPipeError:
+        # The reading end went away, ie 'python -m ecs_logging | head'.
+        # Python flushes stdout at exit, which would raise again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if args.output:
+            output.close()
+    if args.stats:
+        throughput.report()
+    return 0
+
+
+def _parse_args(argv: Optional[Sequence[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m ecs_logging",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "files", nargs="*", help="files to read, '-' or none to read stdin"
+    )
+    parser.add_argument("-o", "--output", help="file to append to instead of stdout")
+    parser.add_argument(
+        "-m",
+        "--map",
+        action="append",
+        default=[],
+        metavar="SOURCE=FIELD",
+        help="rename a source field, nested fields are named with dots. "
+        "Fields mapped to nothing, ie 'password=', are dropped",
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        help="regular expression with named groups which splits text lines "
+        "into fields that --map renames too, ie '(?P<level>\\w+) (?P<message>.*)' "
+        "with '--map level=log.level'",
+    )
+    parser.add_argument(
+        "-e",
+        "--extra",
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="field to add to all documents, ie 'service.name=app'",
+    )
+    parser.add_argument(
+        "-x",
+        "--exclude-fields",
+        action="append",
+        default=[],
+        metavar="FIELDS",
+        help="comma separated fields to leave out, ie 'log.original,labels.*'",
+    )
+    parser.add_argument(
+        "--level", default="info", help="log.level of lines without a level"
+    )
+    parser.add_argument(
+        "--keep-original",
+        action="store_true",
+        help="add the whole line as log.original",
+    )
+    parser.add_argument(
+        "--no-ensure-ascii",
+        dest="ensure_ascii",
+        action="store_false",
+        help="write non-ASCII characters instead of escaping them",
+    )
+    parser.add_argument(
+        "--json-backend",
+        default="auto",
+        choices=["auto", "json", "orjson", "msgspec"],
+        help="library to decode and encode JSON with (default: %(default)s)",
+    )
+    parser.add_argument("--max-bytes", type=_positive_int)
+    parser.add_argument("--max-field-length", type=_positive_int)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=_positive_int,
+        default=1,
+        help="number of processes converting lines (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=_positive_int,
+        default=64 * 1024,
+        help="maximum number of bytes read at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="report the number of lines per second to stderr",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=10.0,
+        help="seconds between reports (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    mapping = {}
+    for item in args.map:
+        source, separator, field = item.partition("=")
+        if not separator or not source:
+            parser.error(f"argument --map: expected SOURCE=FIELD, got {item!r}")
+        mapping[source] = field
+    args.map = mapping
+    extra = {}
+    for item in args.extra:
+        field, separator, value = item.partition("=")
+        if not separator or not field:
+            parser.error(f"argument --extra: expected FIELD=VALUE, got {item!r}")
+        extra[field] = value
+    args.extra = extra
+    args.exclude_fields = [
+        field.strip()
+        for fields in args.exclude_fields
+        for field in fields.split(",")
+        if field.strip()
+    ]
+    if args.pattern is not None:
+        try:
+            re.compile(args.pattern)
+        except re.error as e:
+            parser.error(f"argument --pattern: {e}")
+    return args
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def _read_batches(filenames: Sequence[str], batch_size: int) -> Iterator[List[bytes]]:
+    """Yields the lines of the files in batches. A batch has the lines
+    which were available at once, up to 'batch_size' bytes, so lines are
+    converted right away when they trickle in and in batches under load.
+    """
+    for filename in filenames:
+        stream: IO[bytes] = (
+            sys.stdin.buffer if filename == "-" else open(filename, "rb")
+        )
+        try:
+            read = getattr(stream, "read1", stream.read)
+            pending = b""
+            while True:
+                data = read(batch_size)
+                if not data:
+                    break
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                if lines:
+                    yield lines
+            if pending:
+                yield [pending]
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+
+def _convert_in_workers(
+    batches: Iterator[List[bytes]],
+    output: BinaryIO,
+    throughput: "_Throughput",
+    options: Dict[str, Any],
+    workers: int,
+) -> None:
+    """Converts the batches in a pool of processes. A thread writes the
+    results in order as soon as they're done, while batches are read.
+    """
+    results: "queue.Queue[Optional[Future[bytes]]]" = queue.Queue(workers * 2)
+    errors: List[BaseException] = []
+
+    def write_results() -> None:
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            if errors:
+                continue
+            try:
+                data = result.result()
+                output.write(data)
+                output.flush()
+                throughput.add(data.count(b"\n"))
+            except BaseException as e:
+                errors.append(e)
+
+    with ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=(options,)
+    ) as pool:
+        writer = threading.Thread(target=write_results, daemon=True)
+        writer.start()
+        try:
+            for lines in batches:
+                if errors:
+                    break
+                results.put(pool.submit(convert_in_worker, lines))
+        finally:
+            results.put(None)
+            writer.join()
+    if errors:
+        raise errors[0]
+
+
+class _Throughput:
+    """Counts the converted lines and reports the lines per second to
+    stderr every 'interval' seconds, when it's given.
+    """
+
+    def __init__(self, interval: Optional[float]) -> None:
+        self.interval = interval
+        self.lines = 0
+        self.started = self._reported = time.monotonic()
+        self._reported_lines = 0
+
+    def add(self, lines: int) -> None:
+        self.lines += lines
+        if self.interval is not None:
+            now = time.monotonic()
+            if now - self._reported >= self.interval:
+                self._report(self.lines - self._reported_lines, now - self._reported)
+                self._reported = now
+                self._reported_lines = self.lines
+
+    def report(self) -> None:
+        self._report(self.lines, time.monotonic() - self.started, total=True)
+
+    def _report(self, lines: int, seconds: float, total: bool = False) -> None:
+        rate = lines / seconds if seconds > 0 else 0.0
+        sys.stderr.write(
+            f"ecs_logging: {'converted ' if total else ''}{lines:,} lines"
+            f" in {seconds:.1f}s, {rate:,.0f} lines/sec\n"
+        )
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import contextvars
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from ._utils import ContextFields, FieldPath, add_field_paths, nest_field_paths
+
+__all__ = [
+    "bind",
+    "bound_fields",
+    "unbind",
+]
+
+# Attribute of records which carries the fields that were bound when they
+# were logged, so that records formatted on another thread still get them.
+BOUND_FIELDS_ATTRIBUTE = "ecs_bound_fields"
+
+# Every change binds new 'ContextFields' so that the serialized fields
+# cached on them stay valid, and contexts copied from this one, ie by
+# asyncio tasks, aren't affected.
+_bound_fields: "contextvars.ContextVar[Optional[ContextFields]]" = (
+    contextvars.ContextVar("ecs_logging_bound_fields", default=None)
+)
+
+
+def bind(fields: Optional[Mapping[str, Any]] = None, **kwargs: Any) -> None:
+    """Binds fields to the current context, the ``StdlibFormatter`` adds them
+    to all records logged in it. Field names are expressed with dot notation
+    or nested mappings, ie ``bind({"http.request.method": "GET"})`` or
+    ``bind(user={"id": "42"})``. Fields which were bound before under the
+    same names are replaced. Fields given with ``extra``, either to the
+    logging call or to the formatter, take precedence.
+    """
+    items: List[Tuple[FieldPath, Any]] = []
+    for source in (fields or {}, kwargs):
+        for field, value in source.items():
+            add_field_paths(items, tuple(field.split(".")), value)
+    # Raises if the fields conflict with each other
+    nest_field_paths(items)
+
+    current = _bound_fields.get()
+    if current is not None:
+        paths = [path for path, _ in items]
+        items[:0] = [
+            item
+            for item in current.fields
+            if not any(_overlaps(item[0], path) for path in paths)
+        ]
+    _bound_fields.set(ContextFields(items) if items else None)
+
+
+def unbind(*names: str) -> None:
+    """Removes the bound fields with the given names and all fields within
+    them, ie ``unbind("http")`` removes all ``http.*`` fields. Without names
+    all fields are removed from the current context.
+    """
+    current = _bound_fields.get()
+    if current is None:
+        return
+    prefixes = [tuple(name.split(".")) for name in names]
+    items = [
+        item
+        for item in current.fields
+        if prefixes and not any(_within(item[0], prefix) for prefix in prefixes)
+    ]
+    _bound_fields.set(ContextFields(items) if items else None)
+
+
+def bound_fields() -> Dict[str, Any]:
+    """Returns the fields bound to the current context with dotted names"""
+    current = _bound_fields.get()
+    if current is None:
+        return {}
+    return {".".join(path): value for path, value in current.fields}
+
+
+def current_context_fields() -> Optional[ContextFields]:
+    return _bound_fields.get()
+
+
+def _overlaps(path: FieldPath, other: FieldPath) -> bool:
+    size = min(len(path), len(other))
+    return path[:size] == other[:size]
+
+
+def _within(path: FieldPath, prefix: FieldPath) -> bool:
+    size = len(prefix)
+    return path[:size] == prefix
@@ -0,0 +1,252 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import re
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from ._meta import ECS_VERSION
+from ._reader import _json_loads
+from ._stdlib import StdlibFormatter
+from ._utils import (
+    EncodedFields,
+    FieldPath,
+    add_field_paths,
+    flatten_dict,
+    format_unix_timestamp,
+)
+
+# Numeric timestamps above this are in milliseconds, as seconds
+# they would be thousands of years in the future.
+_MILLISECONDS_THRESHOLD = 1e11
+
+# Mapped field names of the lines seen so far, which repeat over and over
+# again in logs. It's cleared when it's full, as field names of JSON
+# logs can be unbounded, ie when they contain ids.
+_FIELD_PATHS_SIZE = 4096
+
+
+class LineConverter:
+    """Converts lines of plain text or JSON logs to ECS documents, which
+    are serialized by a ``StdlibFormatter`` the same way as records.
+
+    Lines which start with ``{`` and are JSON objects have their fields
+    renamed by 'mapping' and the fields which map to ``@timestamp``,
+    ``log.level`` and ``message`` fill these. Other lines are the message,
+    unless 'pattern' matches them, then its named groups are the fields.
+    """
+
+    def __init__(
+        self,
+        mapping: Optional[Mapping[str, str]] = None,
+        pattern: Optional[str] = None,
+        extra: Optional[Dict[str, Any]] = None,
+        exclude_fields: Sequence[str] = (),
+        level: Optional[str] = "info",
+        keep_original: bool = False,
+        ensure_ascii: bool = True,
+        json_backend: str = "json",
+        max_bytes: Optional[int] = None,
+        max_field_length: Optional[int] = None,
+    ) -> None:
+        """Initialize the converter.
+
+        :param Mapping[str, str] mapping:
+            Specifies the ECS field of source fields, ie ``{"msg": "message"}``.
+            Nested source fields are named with dots and mapping a name
+            renames all fields within it. Source fields mapped to ``""``
+            are dropped, the others keep their names.
+        :param str pattern:
+            Specifies a regular expression with named groups which splits
+            plain text lines into fields. Group names can't have dots, so
+            they're renamed by 'mapping' too, ie ``(?P<level>\\w+) (?P<message>.*)``
+            with ``{"level": "log.level"}``.
+        :param str level:
+            Specifies the ``log.level`` of lines which don't have one.
+        :param bool keep_original:
+            Specifies whether the whole line is added as ``log.original``.
+        See ``StdlibFormatter`` for the other parameters.
+        """
+        self._formatter = StdlibFormatter(
+            extra=extra,
+            exclude_fields=exclude_fields,
+            ensure_ascii=ensure_ascii,
+            json_backend=json_backend,
+            max_bytes=max_bytes,
+            max_field_length=max_field_length,
+        )
+        if mapping is not None and any(
+            not isinstance(source, str) or not isinstance(field, str)
+            for source, field in mapping.items()
+        ):
+            raise ValueError("'mapping' must map field names to field names")
+        self._mapping = dict(mapping or {})
+        self._pattern = re.compile(pattern) if pattern is not None else None
+        self._level = level.lower() if level is not None else None
+        self._loads = _json_loads(self._formatter.json_backend)
+        self._field_paths: Dict[str, Optional[FieldPath]] = {}
+
+        formatter = self._formatter
+        self._exclude = formatter._exclude
+        self._include_timestamp = not formatter._is_field_excluded("@timestamp")
+        self._include_level = not formatter._is_field_excluded("log.level")
+        self._include_message = formatter._include_message
+        self._include_original = keep_original and not formatter._is_field_excluded(
+            "log.original"
+        )
+        constant = list(formatter._extra_fields)
+        # Fields of lines don't replace the global extra
+        self._given = frozenset(path for path, _ in constant)
+        if not formatter._is_field_excluded("ecs.version"):
+            constant.append((("ecs.version",), ECS_VERSION))
+        self._encoded = EncodedFields(
+            constant, formatter.ensure_ascii, formatter.json_backend
+        )
+
+    def convert(self, line: str) -> str:
+        """Returns the ECS document of a line as JSON"""
+        try:
+            return self._dumps(self._parse(line), line)
+        except (TypeError, ValueError):
+            # Fields which conflict with each other, ie 'a' and 'a.b',
+            # are kept in the document as the message.
+            return self._dumps({"message": line}, line)
+
+    def convert_lines(self, lines: Iterable[bytes]) -> bytes:
+        """Returns the NDJSON of UTF-8 encoded lines, skipping empty lines"""
+        converted: List[str] = []
+        for data in lines:
+            line = data.decode("utf-8", "replace").rstrip("\r\n")
+            if line and not line.isspace():
+                converted.append(self.convert(line))
+                converted.append("\n")
+        return "".join(converted).encode("utf-8")
+
+    def _parse(self, line: str) -> Dict[str, Any]:
+        """Returns the fields of a line with dotted names"""
+        if line.startswith("{"):
+            try:
+                value = self._loads(line)
+            except ValueError:
+                value = None
+            if isinstance(value, dict):
+                return flatten_dict(value)
+        if self._pattern is not None:
+            match = self._pattern.match(line)
+            if match is not None:
+                return {
+                    name: value
+                    for name, value in match.groupdict().items()
+                    if value is not None
+                }
+        return {"message": line}
+
+    def _dumps(self, source: Dict[str, Any], line: str) -> str:
+        timestamp = level = message = None
+        items: List[Tuple[FieldPath, Any]] = []
+        for name, value in source.items():
+            path = self._field_path(name)
+            if path is None:
+                continue
+            elif path == ("@timestamp",):
+                timestamp = value
+            elif path == ("log", "level"):
+                level = value
+            elif path == ("message",):
+                message = value
+            elif path not in self._given:
+                add_field_paths(items, path, value, self._exclude)
+
+        fields: List[Tuple[FieldPath, Any]] = []
+        if self._include_timestamp:
+            fields.append((("@timestamp",), _format_timestamp(timestamp)))
+        if self._include_level:
+            level = str(level).lower() if level is not None else self._level
+            if level is not None:
+                fields.append((("log", "level"), level))
+        if self._include_message:
+            fields.append((("message",), "" if message is None else str(message)))
+        if self._include_original:
+            fields.append((("log", "original"), line))
+        fields.extend(items)
+        return self._formatter._json_dumps_paths(fields, self._encoded)
+
+    def _field_path(self, name: str) -> Optional[FieldPath]:
+        """Returns the path of the ECS field of a source field, or
+        ``None`` if it's dropped.
+        """
+        try:
+            return self._field_paths[name]
+        except KeyError:
+            pass
+        field = self._mapping.get(name)
+        if field is None:
+            field = name
+            # The longest mapped name that the field is within
+            position = name.rfind(".")
+            while position != -1:
+                prefix = name[:position]
+                if prefix in self._mapping:
+                    mapped = self._mapping[prefix]
+                    field = mapped + name[position:] if mapped else ""
+                    break
+                position = name.rfind(".", 0, position)
+        if len(self._field_paths) >= _FIELD_PATHS_SIZE:
+            self._field_paths.clear()
+        path = self._field_paths[name] = tuple(field.split(".")) if field else None
+        return path
+
+
+def _format_timestamp(value: Any) -> str:
+    """Formats the timestamp of a line, numbers are seconds or milliseconds
+    since the epoch and strings are ISO 8601. Without a timezone it's UTC.
+    Lines without a timestamp, or one which isn't understood, get the
+    current time.
+    """
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if value > _MILLISECONDS_THRESHOLD:
+                value /= 1000
+            return format_unix_timestamp(value)
+        if isinstance(value, str):
+            if value.endswith(("Z", "z")):
+                value = value[:-1] + "+00:00"
+            # Python's logging separates milliseconds with a comma
+            parsed = datetime.datetime.fromisoformat(value.replace(",", "."))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+            return format_unix_timestamp(parsed.timestamp())
+    except (ValueError, OverflowError, OSError):
+        # Timestamps out of the range of the platform's 'time.gmtime()',
+        # ie '1e30', 'inf' or 'nan', are treated like unparsable ones
+        pass
+    return format_unix_timestamp(time.time())
+
+
+# The converter of a worker process of 'python -m ecs_logging --workers'
+_worker_converter: Optional[LineConverter] = None
+
+
+def init_worker(options: Dict[str, Any]) -> None:
+    global _worker_converter
+    _worker_converter = LineConverter(**options)
+
+
+def convert_in_worker(lines: List[bytes]) -> bytes:
+    assert _worker_converter is not None
+    return _worker_converter.convert_lines(lines)
@@ -0,0 +1,169 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from typing import Any, Collection, Dict, Hashable, List, Optional, Tuple
+
+from ._utils import ContextFields, FieldMatcher, FieldPath, SharedCache
+
+__all__ = [
+    "CorrelationProvider",
+    "ElasticAPMCorrelation",
+    "OpenTelemetryCorrelation",
+]
+
+
+class CorrelationProvider:
+    """Base class of the providers which add the tracing fields of the
+    active span to records, read from the tracer's context variables.
+
+    Formatters call 'current_key()' for every record and only call
+    'fields()' the first time they see a key, the fields of a span
+    are serialized once and reused for all its records.
+    """
+
+    def current_key(self) -> Optional[Hashable]:
+        """Returns a key which identifies the active span, or ``None``
+        when there isn't one. This is called for every record.
+        """
+        raise NotImplementedError()
+
+    def fields(self) -> Dict[str, Any]:
+        """Returns the fields of the active span with dotted names,
+        ie ``{"trace.id": "0af7651916cd43dd8448eb211c80319c"}``.
+        """
+        raise NotImplementedError()
+
+
+class ElasticAPMCorrelation(CorrelationProvider):
+    """Adds ``trace.id``, ``transaction.id``, ``span.id``, ``service.name``
+    and ``service.environment`` of the Elastic APM agent's active
+    transaction and span.
+    """
+
+    def __init__(self) -> None:
+        try:
+            from elasticapm.traces import execution_context
+        except ImportError:
+            raise ImportError(
+                "'ElasticAPMCorrelation' requires the 'elastic-apm' "
+                "package to be installed"
+            ) from None
+        self._context = execution_context
+
+    def current_key(self) -> Optional[Hashable]:
+        transaction = self._context.get_transaction()
+        if transaction is None:
+            return None
+        span = self._context.get_span()
+        return transaction.id, (span.id if span is not None else None)
+
+    def fields(self) -> Dict[str, Any]:
+        from elasticapm import get_client
+
+        fields = {}
+        transaction = self._context.get_transaction()
+        if transaction is not None:
+            fields["transaction.id"] = transaction.id
+            if transaction.trace_parent is not None:
+                fields["trace.id"] = transaction.trace_parent.trace_id
+        span = self._context.get_span()
+        if span is not None:
+            fields["span.id"] = span.id
+        client = get_client()
+        if client is not None:
+            fields["service.name"] = client.config.service_name
+            fields["service.environment"] = client.config.environment
+        return fields
+
+
+class OpenTelemetryCorrelation(CorrelationProvider):
+    """Adds ``trace.id`` and ``span.id`` of the active OpenTelemetry span,
+    and ``service.name`` and ``service.environment`` from the resource
+    of spans recorded by the OpenTelemetry SDK.
+    """
+
+    def __init__(self) -> None:
+        try:
+            from opentelemetry.trace import get_current_span
+        except ImportError:
+            raise ImportError(
+                "'OpenTelemetryCorrelation' requires the 'opentelemetry-api' "
+                "package to be installed"
+            ) from None
+        self._get_current_span = get_current_span
+
+    def current_key(self) -> Optional[Hashable]:
+        context = self._get_current_span().get_span_context()
+        if not context.is_valid:
+            return None
+        return context.trace_id, context.span_id
+
+    def fields(self) -> Dict[str, Any]:
+        span = self._get_current_span()
+        context = span.get_span_context()
+        fields = {
+            "trace.id": format(context.trace_id, "032x"),
+            "span.id": format(context.span_id, "016x"),
+        }
+        # Only spans of the SDK have a resource
+        resource = getattr(span, "resource", None)
+        if resource is not None:
+            attributes = resource.attributes
+            fields["service.name"] = attributes.get("service.name")
+            fields["service.environment"] = attributes.get(
+                "deployment.environment.name", attributes.get("deployment.environment")
+            )
+        return fields
+
+
+class SpanFieldsCache:
+    """Looks up the correlation fields of the active span, the fields
+    of the most recently started spans are kept in a cache.
+    """
+
+    def __init__(
+        self,
+        provider: CorrelationProvider,
+        exclude: FieldMatcher,
+        given: Collection[FieldPath] = (),
+        maxsize: int = 256,
+    ) -> None:
+        if not isinstance(provider, CorrelationProvider):
+            raise TypeError("'correlation' must be a CorrelationProvider")
+        self.provider = provider
+        self._exclude = exclude
+        self._given = frozenset(given)
+        self._cache = SharedCache(maxsize)
+
+    def current(self) -> Optional[ContextFields]:
+        key = self.provider.current_key()
+        if key is None:
+            return None
+        span: Optional[ContextFields] = self._cache.get(key)
+        if span is None:
+            fields: List[Tuple[FieldPath, Any]] = []
+            for field, value in self.provider.fields().items():
+                path = tuple(field.split("."))
+                if (
+                    value is not None
+                    and path not in self._given
+                    and not self._exclude.matches(path)
+                ):
+                    fields.append((path, value))
+            span = ContextFields(fields)
+            self._cache.set(key, span)
+        return span
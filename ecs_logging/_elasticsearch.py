@@ -0,0 +1,357 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import base64
+import http.client
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import weakref
+import zlib
+from queue import Empty, Full, Queue
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from ._handlers import format_line
+
+__all__ = [
+    "ElasticsearchHandler",
+]
+
+# Responses to a whole request and statuses of single documents
+# in a '_bulk' response which are worth retrying later.
+_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# Stops the sender thread after everything before it was sent
+_STOP = object()
+
+# Handlers with a sender thread, which doesn't exist after a fork
+_SENDING_HANDLERS: "weakref.WeakSet[ElasticsearchHandler]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for handler in list(_SENDING_HANDLERS):
+        handler._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ElasticsearchHandler(logging.Handler):
+    """Handler which sends formatted records straight to Elasticsearch with
+    the ``_bulk`` API. Records are formatted on the logging thread and put
+    on a bounded queue, a background thread sends them in batches over a
+    single keep-alive connection.
+
+    A batch is sent once it has ``batch_size`` records or ``batch_bytes``
+    bytes, after ``flush_interval`` seconds, when ``flush()`` is called and
+    when the handler is closed, which ``logging.shutdown()`` does at exit.
+    Records are dropped and counted in ``dropped`` while the queue is full
+    and counted in ``failed`` when Elasticsearch rejects them or is still
+    unavailable after all retries.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        index: str = "logs-generic-default",
+        batch_size: int = 500,
+        batch_bytes: int = 5 * 1024 * 1024,
+        flush_interval: Optional[float] = 1.0,
+        maxsize: int = 10000,
+        compress: bool = True,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+        close_timeout: Optional[float] = 30.0,
+        api_key: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ) -> None:
+        """Initialize the Elasticsearch handler.
+
+        :param str url:
+            Specifies the URL of Elasticsearch, ie ``"https://localhost:9200"``.
+            A username and password in the URL are sent with basic auth.
+        :param str index:
+            Specifies the data stream or index which documents are created in.
+        :param int batch_size:
+            Specifies the maximum number of records sent in one request.
+        :param int batch_bytes:
+            Specifies the maximum uncompressed size of a request.
+        :param Optional[float] flush_interval:
+            Specifies the maximum number of seconds records wait before being
+            sent. ``None`` only sends full batches and on ``flush()``.
+        :param int maxsize:
+            Specifies the maximum number of records waiting to be sent.
+        :param bool compress:
+            Specifies whether request bodies are gzip compressed.
+        :param int max_retries:
+            Specifies how often a request is retried when Elasticsearch
+            can't be reached or is overloaded.
+        :param float backoff:
+            Specifies the seconds to wait before the first retry, the
+            time is doubled for every following retry.
+        :param float timeout:
+            Specifies the timeout of connecting and sending in seconds.
+        :param Optional[float] close_timeout:
+            Specifies the maximum number of seconds ``close()`` waits for the
+            remaining records to be sent. ``None`` waits until they were sent.
+        :param str api_key:
+            Specifies the encoded API key to authenticate with.
+        :param Dict[str, str] headers:
+            Specifies additional headers sent with every request.
+        :param ssl.SSLContext ssl_context:
+            Specifies the SSL context of ``https`` connections.
+        """
+        super().__init__()
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("'url' must be an http:// or https:// URL")
+        for name, value in (
+            ("batch_size", batch_size),
+            ("batch_bytes", batch_bytes),
+            ("maxsize", maxsize),
+        ):
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"'{name}' must be a positive integer")
+        if not isinstance(max_retries, int) or max_retries < 0:
+            raise ValueError("'max_retries' must be a non-negative integer")
+
+        self.url = url
+        self.index = index
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+        self.dropped = 0
+        self.failed = 0
+
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path.rstrip("/") + "/_bulk"
+        self._ssl_context = ssl_context
+        self._headers = {"Content-Type": "application/x-ndjson"}
+        if compress:
+            self._headers["Content-Encoding"] = "gzip"
+        if parts.username is not None:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+            self._headers["Authorization"] = f"Basic {token}"
+        if api_key is not None:
+            self._headers["Authorization"] = f"ApiKey {api_key}"
+        if headers:
+            self._headers.update(headers)
+
+        # The action line is the same for all documents
+        self._action = (
+            json.dumps({"create": {"_index": index}}, separators=(",", ":")) + "\n"
+        ).encode("utf-8")
+        self._maxsize = maxsize
+        self._queue: "Queue[Any]" = Queue(maxsize)
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._sender: Optional[threading.Thread] = None
+        self._closed = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._closed:
+            self.dropped += 1
+            return
+        try:
+            data = format_line(self, record)
+            if self._sender is None:
+                self._start_sender()
+            self._queue.put_nowait(data)
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """Waits until all records emitted before were sent"""
+        sender = self._sender
+        if sender is None or not sender.is_alive():
+            return
+        sent = threading.Event()
+        self._queue.put(sent)
+        while not sent.wait(0.1):
+            if not sender.is_alive():
+                break
+
+    def close(self) -> None:
+        with self.lock:  # type: ignore[union-attr]
+            closed, self._closed = self._closed, True
+        try:
+            sender = self._sender
+            if not closed and sender is not None and sender.is_alive():
+                if sender is threading.current_thread():
+                    # The sender can't wait for itself to take '_STOP'
+                    # off the queue, it stops once it gets there if it fits.
+                    self._queue.put_nowait(_STOP)
+                else:
+                    timeout = self.close_timeout
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    self._queue.put(_STOP, timeout=timeout)
+                    sender.join(
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+        except Full:
+            # The queue stayed full, the sender is a daemon thread
+            # which doesn't keep the process from exiting.
+            pass
+        finally:
+            super().close()
+
+    def _start_sender(self) -> None:
+        self._sender = threading.Thread(
+            target=self._send_batches, name="ecs-logging-elasticsearch", daemon=True
+        )
+        _SENDING_HANDLERS.add(self)
+        self._sender.start()
+
+    def _send_batches(self) -> None:
+        """Collects the queued records into batches and sends them until
+        the handler is closed, runs on the sender thread.
+        """
+        batch: List[bytes] = []
+        size = 0
+        deadline = 0.0
+        stop = False
+        while not stop:
+            timeout: Optional[float] = None
+            if batch and self.flush_interval is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            flushed: Optional[threading.Event] = None
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, threading.Event):
+                flushed = item
+            elif item is not None:
+                if not batch and self.flush_interval is not None:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                size += len(self._action) + len(item)
+                if len(batch) < self.batch_size and size < self.batch_bytes:
+                    continue
+
+            if batch:
+                try:
+                    self._send(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    self.handleError(None)  # type: ignore[arg-type]
+                batch = []
+                size = 0
+            if flushed is not None:
+                flushed.set()
+        self._close_connection()
+
+    def _send(self, documents: List[bytes]) -> None:
+        """Sends documents with retries, counting the ones which failed"""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                status, response = self._post(documents)
+            except (OSError, http.client.HTTPException):
+                self._close_connection()
+                continue
+            if status in _RETRY_STATUSES:
+                continue
+            if status >= 300:
+                break
+            documents = self._retryable_documents(documents, response)
+            if not documents:
+                return
+        self.failed += len(documents)
+
+    def _retryable_documents(
+        self, documents: List[bytes], response: bytes
+    ) -> List[bytes]:
+        """Returns the documents which were rejected temporarily
+        and counts the ones which were rejected for good.
+        """
+        result = json.loads(response)
+        if not result.get("errors"):
+            return []
+        retry = []
+        for document, item in zip(documents, result.get("items", ())):
+            # Every item has the action as its only key
+            status: int = next(iter(item.values())).get("status", 0)
+            if status in _RETRY_STATUSES:
+                retry.append(document)
+            elif status >= 300:
+                self.failed += 1
+        return retry
+
+    def _post(self, documents: List[bytes]) -> Tuple[int, bytes]:
+        body = b"".join(
+            [part for document in documents for part in (self._action, document)]
+        )
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = compressor.compress(body) + compressor.flush()
+
+        connection = self._connection
+        if connection is None:
+            connection = self._connection = self._connect()
+        connection.request("POST", self._path, body=body, headers=self._headers)
+        response = connection.getresponse()
+        # Reading the whole response keeps the connection usable
+        return response.status, response.read()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._scheme == "https":
+            return http.client.HTTPSConnection(
+                self._host,  # type: ignore[arg-type]
+                self._port,
+                timeout=self.timeout,
+                context=self._ssl_context,
+            )
+        return http.client.HTTPConnection(
+            self._host, self._port, timeout=self.timeout  # type: ignore[arg-type]
+        )
+
+    def _close_connection(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+
+    def _reset_after_fork(self) -> None:
+        # The parent process sends what was queued before the fork,
+        # the child gets its own queue, connection and sender.
+        self._queue = Queue(self._maxsize)
+        self._connection = None
+        self._sender = None
+
+    def __repr__(self) -> str:
+        level = logging.getLevelName(self.level)
+        return f"<{self.__class__.__name__} {self._host} {self.index} ({level})>"
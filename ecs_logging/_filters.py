@@ -0,0 +1,275 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from ._utils import LRUCache
+
+__all__ = [
+    "DeduplicationFilter",
+    "DeduplicationProcessor",
+]
+
+# Field which holds the number of suppressed duplicates
+REPEAT_FIELD = "log.repeat"
+
+
+class _RepeatCounter:
+    """Counts the occurrences of keys per time window, for at most
+    'maxsize' keys which are evicted when least recently seen.
+
+    With 'summarize' it also collects the number of occurrences that
+    were suppressed in windows which ended without another occurrence
+    of their key, and of keys which were evicted, for 'summaries()'.
+    """
+
+    def __init__(
+        self, limit: int, window: float, maxsize: int, summarize: bool = False
+    ) -> None:
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("'limit' must be a positive integer")
+        if window <= 0:
+            raise ValueError("'window' must be a positive number of seconds")
+        self.limit = limit
+        self.window = window
+        self.summarize = summarize
+        self._lock = threading.Lock()
+        # Maps keys to [window start, passed in window, suppressed, sample]
+        self._windows = LRUCache(maxsize)
+        # Heap of (window end, sequence, key) of windows with suppressed
+        # occurrences, the sequence keeps keys from being compared.
+        self._ends: List[Tuple[float, int, Hashable]] = []
+        self._sequence = itertools.count()
+        # (sample, suppressed) of evicted keys
+        self._evicted: List[Tuple[Any, int]] = []
+
+    def count(self, key: Hashable, now: float, sample: Any = None) -> Optional[int]:
+        """Returns ``None`` if the occurrence should be suppressed,
+        otherwise the number of occurrences suppressed before it.
+        'sample' is returned by 'summaries()' along with that number.
+        """
+        with self._lock:
+            state: Optional[List[Any]] = self._windows.get(key)
+            if state is None:
+                evicted = self._windows.set(key, [now, 1, 0, sample])
+                if evicted is not None and evicted[1][2] and self.summarize:
+                    self._evicted.append((evicted[1][3], evicted[1][2]))
+                return 0
+            if now - state[0] >= self.window:
+                state[0] = now
+                state[1] = 0
+            if state[1] < self.limit:
+                state[1] += 1
+                suppressed: int = state[2]
+                state[2] = 0
+                return suppressed
+            if state[2] == 0 and self.summarize:
+                end = state[0] + self.window
+                heapq.heappush(self._ends, (end, next(self._sequence), key))
+            state[2] += 1
+            return None
+
+    def summaries(self, now: float) -> List[Tuple[Any, int]]:
+        """Returns the samples and numbers of suppressed occurrences of the
+        windows which ended before 'now' and of the evicted keys. Each
+        suppressed occurrence is counted once, either here or by 'count()'.
+        """
+        ends = self._ends
+        if not self._evicted and (not ends or ends[0][0] > now):
+            return []
+        with self._lock:
+            summaries, self._evicted = self._evicted, []
+            while ends and ends[0][0] <= now:
+                end, _, key = heapq.heappop(ends)
+                # Skip keys which were counted, evicted or are in a new window
+                state = self._windows.get(key)
+                if state is not None and state[2] and state[0] + self.window == end:
+                    summaries.append((state[3], state[2]))
+                    state[2] = 0
+            return summaries
+
+
+class DeduplicationFilter(logging.Filter):
+    """Filter which lets the first 'limit' records of a call site and message
+    pass per 'window' seconds. Records are considered duplicates if they're
+    logged by the same logger on the same line, with the same message template
+    and exception type. The next record which passes after duplicates were
+    suppressed has their number in the ``log.repeat`` field.
+
+    When no record passes for a call site until its window ended, or the
+    call site is forgotten, a record with the message
+    ``"<template> (N repeats suppressed)"`` and ``log.repeat`` is logged
+    instead. It's only emitted by the handlers the filter is attached to,
+    or by the logger of the duplicates if the filter is attached to it or
+    to handlers that logger doesn't reach, like those of a ``QueueListener``.
+    Ended windows are noticed when the next record passes through the filter.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        limit: int = 10,
+        window: float = 60.0,
+        maxsize: int = 10000,
+    ) -> None:
+        """Initialize the deduplication filter.
+
+        :param str name:
+            Specifies the logger whose records are filtered, like for
+            ``logging.Filter``. Defaults to all records.
+        :param int limit:
+            Specifies how many duplicates pass per window.
+        :param float window:
+            Specifies the length of a window in seconds.
+        :param int maxsize:
+            Specifies how many call sites are tracked, the least recently
+            logged ones are forgotten first.
+        """
+        super().__init__(name)
+        self._counter = _RepeatCounter(limit, window, maxsize, summarize=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not super().filter(record):
+            return False
+        if REPEAT_FIELD in record.__dict__:
+            # Summaries of suppressed records are never suppressed
+            return True
+        msg = record.msg
+        msg = msg if isinstance(msg, str) else str(msg)
+        exc_info = record.exc_info
+        key = (
+            record.name,
+            record.lineno,
+            msg,
+            exc_info[0] if isinstance(exc_info, tuple) else None,
+        )
+        # Only what's needed for the summary is kept, not the record
+        # which would keep its arguments and traceback alive
+        sample = (
+            record.name,
+            record.levelno,
+            record.pathname,
+            record.lineno,
+            record.funcName,
+            msg,
+        )
+        suppressed = self._counter.count(key, record.created, sample)
+        for summary in self._counter.summaries(record.created):
+            self._log_summary(*summary)
+        if suppressed is None:
+            return False
+        if suppressed:
+            record.__dict__[REPEAT_FIELD] = suppressed
+        return True
+
+    def _log_summary(self, sample: Tuple[Any, ...], suppressed: int) -> None:
+        name, level, pathname, lineno, func, msg = sample
+        record = logging.LogRecord(
+            name,
+            level,
+            pathname,
+            lineno,
+            "%s (%d repeats suppressed)",
+            (msg, suppressed),
+            None,
+            func,
+        )
+        record.__dict__[REPEAT_FIELD] = suppressed
+        logger = logging.getLogger(name)
+        if self not in logger.filters:
+            # Only the handlers which suppressed the duplicates get
+            # the summary, not the others and those of the ancestors.
+            handlers = _handlers_with_filter(logger, self)
+            if handlers:
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                return
+        logger.handle(record)
+
+
+class DeduplicationProcessor:
+    """``structlog`` processor which drops duplicate events like the
+    :class:`DeduplicationFilter` does for records. Events are duplicates
+    if they have the same event, logger name, line number, exception
+    and log level. It has to come before the ``StructlogFormatter``.
+    """
+
+    def __init__(
+        self, limit: int = 10, window: float = 60.0, maxsize: int = 10000
+    ) -> None:
+        """Initialize the deduplication processor.
+
+        :param int limit:
+            Specifies how many duplicates pass per window.
+        :param float window:
+            Specifies the length of a window in seconds.
+        :param int maxsize:
+            Specifies how many distinct events are tracked, the least
+            recently logged ones are forgotten first.
+        """
+        self._counter = _RepeatCounter(limit, window, maxsize)
+
+    def __call__(
+        self, _: Any, method_name: str, event_dict: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        event = event_dict.get("event")
+        exception = event_dict.get("exc_info", event_dict.get("exception"))
+        key = (
+            method_name,
+            event if isinstance(event, str) else str(event),
+            str(event_dict.get("logger", event_dict.get("log.logger"))),
+            event_dict.get("lineno"),
+            _exception_key(exception),
+        )
+        suppressed = self._counter.count(key, time.time())
+        if suppressed is None:
+            from structlog import DropEvent
+
+            raise DropEvent
+        if suppressed:
+            event_dict[REPEAT_FIELD] = suppressed
+        return event_dict
+
+
+def _handlers_with_filter(
+    logger: logging.Logger, dedup: logging.Filter
+) -> List[logging.Handler]:
+    """Returns the handlers which records of 'logger' reach and have 'dedup'"""
+    handlers: List[logging.Handler] = []
+    current: Optional[logging.Logger] = logger
+    while current is not None:
+        handlers.extend(h for h in current.handlers if dedup in h.filters)
+        current = current.parent if current.propagate else None
+    return handlers
+
+
+def _exception_key(exception: Any) -> Any:
+    if isinstance(exception, BaseException):
+        return type(exception)
+    if isinstance(exception, tuple) and exception:
+        return exception[0]
+    if isinstance(exception, str):
+        # Already rendered by 'format_exc_info', the last
+        # line starts with the exception's type and message.
+        return exception.rstrip().rpartition("\n")[2]
+    return None
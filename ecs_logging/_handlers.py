@@ -0,0 +1,342 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+import threading
+import time
+import weakref
+import zlib
+from typing import List, Optional, Union
+
+try:
+    from typing import Literal  # type: ignore
+except ImportError:
+    from typing_extensions import Literal  # type: ignore
+
+__all__ = [
+    "BatchedFileHandler",
+    "GzipFileHandler",
+]
+
+# Maximum number of buffers for a single 'os.writev()' call,
+# 'sysconf()' returns -1 when the limit is indeterminate.
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = -1
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+FsyncPolicy = Union[Literal["never"], Literal["always"], Literal["rotate"]]
+
+# Seconds the flusher waits for the lock before checking if it's stopped
+_LOCK_TIMEOUT = 0.1
+
+# Handlers with a flusher thread, which doesn't exist after a fork
+_FLUSHING_HANDLERS: "weakref.WeakSet[BatchedFileHandler]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for handler in list(_FLUSHING_HANDLERS):
+        handler._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class BatchedFileHandler(logging.Handler):
+    """Handler which appends formatted records as lines to a file in
+    batches, using a single ``os.writev()`` call per batch instead of a
+    ``write()`` and ``flush()`` for every record.
+
+    A batch is written once it reaches ``batch_size`` bytes, after
+    ``flush_interval`` seconds, when ``flush()`` is called and when the
+    handler is closed, which ``logging.shutdown()`` does at exit.
+    """
+
+    def __init__(
+        self,
+        filename: Union[str, "os.PathLike[str]"],
+        batch_size: int = 64 * 1024,
+        flush_interval: Optional[float] = 1.0,
+        max_bytes: int = 0,
+        backup_count: int = 0,
+        rotate_interval: Optional[float] = None,
+        fsync: FsyncPolicy = "never",
+    ) -> None:
+        """Initialize the batched file handler.
+
+        :param str filename:
+            Specifies the file which records are appended to.
+        :param int batch_size:
+            Specifies the number of buffered bytes which are written at once.
+        :param Optional[float] flush_interval:
+            Specifies the maximum number of seconds records are buffered
+            for. ``None`` only writes full batches and on ``flush()``.
+        :param int max_bytes:
+            Specifies the size after which the file is rotated, ``0``
+            disables rotating by size. Like ``RotatingFileHandler``
+            rotated files are renamed to ``filename.1``, ``filename.2``...
+        :param int backup_count:
+            Specifies the number of rotated files to keep. Like for
+            ``RotatingFileHandler`` the file is never rotated with ``0``.
+        :param Optional[float] rotate_interval:
+            Specifies the number of seconds after which the file is rotated.
+        :param str fsync:
+            Specifies when data is synced to disk with ``os.fsync()``:
+            ``"never"`` (the default), ``"always"`` after every batch or
+            ``"rotate"`` when the file is rotated or closed.
+        """
+        super().__init__()
+        if fsync not in ("never", "always", "rotate"):
+            raise ValueError("'fsync' must be one of: 'never', 'always', 'rotate'")
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be a positive integer")
+
+        self.baseFilename = os.path.abspath(os.fspath(filename))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval
+        self.fsync = fsync
+
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._fd: Optional[int] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._closed = False
+        self._flusher: Optional[threading.Thread] = None
+        self._stop_flusher = threading.Event()
+        self._open()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = format_line(self, record)
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.batch_size:
+                self._write_buffer()
+            elif self._flusher is None and self.flush_interval is not None:
+                self._start_flusher()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        with self.lock:  # type: ignore[union-attr]
+            if self._buffer and not self._closed:
+                self._write_buffer()
+
+    def close(self) -> None:
+        self._stop_flusher.set()
+        flusher = self._flusher
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        with self.lock:  # type: ignore[union-attr]
+            try:
+                if not self._closed:
+                    if self._buffer:
+                        self._write_buffer()
+                    self._close_file()
+                    self._closed = True
+            finally:
+                super().close()
+
+    def _write_buffer(self) -> None:
+        """Writes all buffered records, must be called with the lock held"""
+        chunks, self._buffer = self._buffer, []
+        size, self._buffered = self._buffered, 0
+        self._write_chunks(chunks, size)
+
+    def _write_chunks(self, chunks: List[bytes], size: int) -> None:
+        """Writes 'size' bytes of chunks to the file, rotating it before"""
+        if self._should_rotate(size):
+            self._rotate()
+        _writev(self._fd, chunks)  # type: ignore[arg-type]
+        self._size += size
+        if self.fsync == "always":
+            os.fsync(self._fd)  # type: ignore[arg-type]
+
+    def _should_rotate(self, size: int) -> bool:
+        # Without backups rotating would delete all records in the file
+        if self._size == 0 or self.backup_count <= 0:
+            return False
+        if self.max_bytes > 0 and self._size + size > self.max_bytes:
+            return True
+        return (
+            self.rotate_interval is not None
+            and time.monotonic() - self._opened_at >= self.rotate_interval
+        )
+
+    def _rotate(self) -> None:
+        self._close_file()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self._backup_filename(i)
+            if os.path.exists(source):
+                os.replace(source, self._backup_filename(i + 1))
+        os.replace(self.baseFilename, self._backup_filename(1))
+        self._open()
+
+    def _backup_filename(self, index: int) -> str:
+        return f"{self.baseFilename}.{index}"
+
+    def _open(self) -> None:
+        self._fd = os.open(
+            self.baseFilename,
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0),
+            0o644,
+        )
+        self._size = os.fstat(self._fd).st_size
+        self._opened_at = time.monotonic()
+
+    def _close_file(self) -> None:
+        if self._fd is not None:
+            # With 'always' every batch has been synced already
+            if self.fsync == "rotate":
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _start_flusher(self) -> None:
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="ecs-logging-flusher", daemon=True
+        )
+        _FLUSHING_HANDLERS.add(self)
+        self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        lock = self.lock
+        while not self._stop_flusher.wait(self.flush_interval):
+            # 'logging.shutdown()' holds the lock while it closes the
+            # handler, which waits for this thread, so it must not block
+            # on the lock once it's stopped.
+            while not lock.acquire(timeout=_LOCK_TIMEOUT):  # type: ignore[union-attr]
+                if self._stop_flusher.is_set():
+                    return
+            try:
+                if self._buffer and not self._closed:
+                    self._write_buffer()
+            except Exception:
+                self.handleError(None)  # type: ignore[arg-type]
+            finally:
+                lock.release()  # type: ignore[union-attr]
+
+    def _reset_after_fork(self) -> None:
+        # The parent process writes what was buffered
+        # before the fork, the child only needs a flusher.
+        self._buffer = []
+        self._buffered = 0
+        self._flusher = None
+
+    def __repr__(self) -> str:
+        level = logging.getLevelName(self.level)
+        return f"<{self.__class__.__name__} {self.baseFilename} ({level})>"
+
+
+class GzipFileHandler(BatchedFileHandler):
+    """Handler which appends gzip compressed records to a file. Every batch
+    is compressed as a separate gzip member, so a crash only loses the
+    records which were buffered. Files with many members are still a single
+    valid gzip stream which ``zcat``, ``gzip.open()`` and Filebeat can read,
+    and appending to an existing file adds to it.
+
+    ``batch_size`` is the number of uncompressed bytes per member, larger
+    batches compress better. ``max_bytes`` is the compressed size of the
+    file. Rotated files keep the ``.gz`` extension of 'filename', ie
+    ``app.ndjson.gz`` is rotated to ``app.ndjson.1.gz``.
+    """
+
+    def __init__(
+        self,
+        filename: Union[str, "os.PathLike[str]"],
+        batch_size: int = 64 * 1024,
+        flush_interval: Optional[float] = 1.0,
+        max_bytes: int = 0,
+        backup_count: int = 0,
+        rotate_interval: Optional[float] = None,
+        fsync: FsyncPolicy = "never",
+        compresslevel: int = 6,
+    ) -> None:
+        """Initialize the gzip file handler.
+
+        :param int compresslevel:
+            Specifies the compression level from ``0`` (no compression) to
+            ``9`` (smallest output, most CPU). See ``BatchedFileHandler``
+            for the other parameters.
+        """
+        if not isinstance(compresslevel, int) or not 0 <= compresslevel <= 9:
+            raise ValueError("'compresslevel' must be an integer from 0 to 9")
+        self.compresslevel = compresslevel
+        super().__init__(
+            filename,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_bytes=max_bytes,
+            backup_count=backup_count,
+            rotate_interval=rotate_interval,
+            fsync=fsync,
+        )
+
+    def _write_buffer(self) -> None:
+        chunks, self._buffer = self._buffer, []
+        self._buffered = 0
+        # 'wbits=31' writes the gzip header and trailer around the data
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+        member = [compressor.compress(chunk) for chunk in chunks]
+        member.append(compressor.flush())
+        data = b"".join(member)
+        self._write_chunks([data], len(data))
+
+    def _backup_filename(self, index: int) -> str:
+        root, extension = os.path.splitext(self.baseFilename)
+        if extension == ".gz":
+            return f"{root}.{index}{extension}"
+        return super()._backup_filename(index)
+
+
+def format_line(handler: logging.Handler, record: logging.LogRecord) -> bytes:
+    """Formats a record as a newline-terminated line of UTF-8, using
+    ``format_bytes()`` when the handler's formatter has it.
+    """
+    format_bytes = getattr(handler.formatter, "format_bytes", None)
+    if format_bytes is not None:
+        return format_bytes(record) + b"\n"  # type: ignore[no-any-return]
+    return (handler.format(record) + "\n").encode("utf-8")
+
+
+def _writev(fd: int, chunks: List[bytes]) -> None:
+    """Writes all chunks to a file descriptor, retrying partial writes"""
+    if not hasattr(os, "writev"):
+        _write_all(fd, b"".join(chunks))
+        return
+
+    for start in range(0, len(chunks), _IOV_MAX):
+        end = start + _IOV_MAX
+        batch = chunks[start:end]
+        written = os.writev(fd, batch)
+        if written < sum(map(len, batch)):
+            _write_all(fd, b"".join(batch)[written:])
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
@@ -0,0 +1,120 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+__all__ = [
+    "FormatterProfiler",
+    "StageStats",
+]
+
+
+class StageStats(NamedTuple):
+    """How often a formatting stage ran and the nanoseconds it took in total"""
+
+    calls: int
+    total_ns: int
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.calls if self.calls else 0.0
+
+
+class FormatterProfiler:
+    """Collects the time spent in each stage of formatting a record, measured
+    with ``time.perf_counter_ns()``. Formatters only measure their stages
+    while a profiler is set as their ``profiler`` attribute.
+
+    The stages of the ``StdlibFormatter`` are ``message``, ``extract``,
+    ``stack_trace``, ``extras``, ``apm`` and ``encode``, or ``format_to_ecs``
+    and ``encode`` when ``format_to_ecs()`` is overridden. The stages of the
+    ``StructlogFormatter`` are ``normalize``, ``format_to_ecs``, ``exclude``
+    and ``encode``. Stages which aren't needed for a record don't run.
+    """
+
+    def __init__(self, callback: Optional[Callable[[Dict[str, int]], None]] = None):
+        """Initialize the profiler.
+
+        :param callback:
+            Specifies a function which is called with the nanoseconds spent
+            in each stage after every formatted record, ie to add them to
+            a histogram.
+        """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = {}
+        self._total_ns: Dict[str, int] = {}
+
+    def add(self, stages: Dict[str, int]) -> None:
+        """Adds the nanoseconds spent in each stage for one record"""
+        with self._lock:
+            calls = self._calls
+            total_ns = self._total_ns
+            for stage, elapsed_ns in stages.items():
+                calls[stage] = calls.get(stage, 0) + 1
+                total_ns[stage] = total_ns.get(stage, 0) + elapsed_ns
+        if self.callback is not None:
+            self.callback(stages)
+
+    def snapshot(self) -> Dict[str, StageStats]:
+        """Returns the cumulative statistics of every stage"""
+        with self._lock:
+            return {
+                stage: StageStats(calls, self._total_ns[stage])
+                for stage, calls in self._calls.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._calls.clear()
+            self._total_ns.clear()
+
+
+class StageTimer:
+    """Measures the stages of formatting a single record. Each stage lasts
+    from the previous mark until its own, a stage which is marked again
+    adds to its time.
+    """
+
+    __slots__ = ("stages", "_last")
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, int] = {}
+        self._last = time.perf_counter_ns()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter_ns()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self._last
+        self._last = now
+
+    def timed(
+        self, func: Callable[..., Any], before: str, stage: str
+    ) -> Callable[..., Any]:
+        """Returns 'func' measured as a stage of its own,
+        the time until it's called is added to 'before'.
+        """
+
+        def timed(*args: Any) -> Any:
+            self.mark(before)
+            try:
+                return func(*args)
+            finally:
+                self.mark(stage)
+
+        return timed
@@ -0,0 +1,277 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import logging.handlers
+import sys
+import threading
+from queue import Full, Queue
+from typing import Any, Dict, Optional
+
+from ._context import BOUND_FIELDS_ATTRIBUTE, current_context_fields
+from ._utils import ContextFields
+
+__all__ = [
+    "AsyncQueueHandler",
+    "RecordSnapshot",
+    "QueueHandler",
+    "QueueListener",
+]
+
+
+class RecordSnapshot:
+    """Compact copy of a ``LogRecord`` which is safe to format on another
+    thread. The message is rendered, ``exc_info`` is resolved and the fields
+    bound with ``bind()`` are kept when the snapshot is taken, everything
+    else is left to the formatter. Messages which are ``structlog`` event
+    dictionaries are copied instead, for the ``ProcessorFormatter`` of
+    ``structlog`` which formats them.
+
+    The copies are shallow: the extra attributes and event dictionaries
+    are copied, but their values aren't, so a value which is changed
+    after logging is formatted with its changes.
+    """
+
+    # Attributes of 'LogRecord' which are copied as-is
+    _ATTRIBUTES = (
+        "name",
+        "levelname",
+        "levelno",
+        "pathname",
+        "filename",
+        "module",
+        "stack_info",
+        "lineno",
+        "funcName",
+        "created",
+        "msecs",
+        "relativeCreated",
+        "thread",
+        "threadName",
+        "processName",
+        "process",
+    )
+    # Attributes of 'LogRecord' which are replaced by 'message' and 'exc_info'
+    _RENDERED = frozenset(
+        {"msg", "args", "message", "exc_info", "exc_text", BOUND_FIELDS_ATTRIBUTE}
+    )
+
+    __slots__ = _ATTRIBUTES + ("message", "exc_info", "bound_fields", "extra")
+
+    name: str
+    levelname: str
+    levelno: int
+    pathname: str
+    filename: str
+    module: str
+    stack_info: Optional[str]
+    lineno: int
+    funcName: str
+    created: float
+    msecs: float
+    relativeCreated: float
+    thread: Optional[int]
+    threadName: Optional[str]
+    processName: Optional[str]
+    process: Optional[int]
+    message: Any
+    exc_info: Any
+    bound_fields: Optional[ContextFields]
+    extra: Optional[Dict[str, Any]]
+
+    def __init__(self, record: logging.LogRecord) -> None:
+        available = record.__dict__
+        for attribute in self._ATTRIBUTES:
+            setattr(self, attribute, available.get(attribute))
+        msg = record.msg
+        if isinstance(msg, dict) and not record.args:
+            self.message = dict(msg)
+        else:
+            self.message = record.getMessage()
+
+        # 'exc_info=True' refers to the exception being handled
+        # by the logging thread, so it has to be resolved here.
+        exc_info = record.exc_info
+        if exc_info and isinstance(exc_info, bool):
+            exc_info = sys.exc_info()
+        self.exc_info = exc_info
+        # The context of the logging thread isn't available to the listener
+        if BOUND_FIELDS_ATTRIBUTE in available:
+            self.bound_fields = available[BOUND_FIELDS_ATTRIBUTE]
+        else:
+            self.bound_fields = current_context_fields()
+
+        extra = None
+        for key, value in available.items():
+            if key not in self._RENDERED and key not in self._ATTRIBUTES:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self.extra = extra
+
+    def to_record(self) -> logging.LogRecord:
+        """Creates a ``LogRecord`` from the snapshot. The record factory isn't
+        used as it would add information about the current thread.
+        """
+        record = logging.LogRecord.__new__(logging.LogRecord)
+        available = record.__dict__
+        for attribute in self._ATTRIBUTES:
+            available[attribute] = getattr(self, attribute)
+        available["msg"] = self.message
+        available["args"] = None
+        available["exc_info"] = self.exc_info
+        available["exc_text"] = None
+        available[BOUND_FIELDS_ATTRIBUTE] = self.bound_fields
+        if self.extra is not None:
+            available.update(self.extra)
+        return record
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Handler which puts a :class:`RecordSnapshot` of every record on a
+    bounded queue instead of formatting it on the logging thread.
+
+    When handlers are given a :class:`QueueListener` is started which
+    formats and emits the records to them on a background thread. Closing
+    the handler, which ``logging.shutdown()`` does at exit, stops the
+    listener after all queued records have been handled.
+    """
+
+    listener: Optional["QueueListener"]
+
+    def __init__(
+        self,
+        *handlers: logging.Handler,
+        maxsize: int = 10000,
+        respect_handler_level: bool = True,
+        queue: "Optional[Queue[Any]]" = None,
+    ) -> None:
+        """Initialize the queue handler.
+
+        :param logging.Handler handlers:
+            Specifies the handlers which the background listener emits to.
+        :param int maxsize:
+            Specifies the maximum number of records waiting on the queue.
+            Records are dropped and counted in ``dropped`` while it's full.
+        :param bool respect_handler_level:
+            Specifies whether the listener checks the level of each handler.
+        :param queue.Queue queue:
+            Specifies the queue to use instead of creating one.
+        """
+        super().__init__(queue if queue is not None else Queue(maxsize))
+        self.dropped = 0
+        self.listener = None
+        if handlers:
+            self.listener = QueueListener(
+                self.queue, *handlers, respect_handler_level=respect_handler_level
+            )
+            self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> Any:
+        return RecordSnapshot(record)
+
+    def enqueue(self, record: Any) -> None:
+        # Never block the logging thread, 'emit()' is
+        # called with the handler lock held so this is safe.
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        listener = self.listener
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+        super().close()
+
+
+class AsyncQueueHandler(QueueHandler):
+    """:class:`QueueHandler` for ``asyncio`` applications. Logging only takes a
+    snapshot of the record on the event loop and never blocks it, records are
+    formatted and emitted to the handlers on the listener's thread.
+
+    ``await handler.aflush()`` waits until the queued records were emitted and
+    ``await handler.aclose()`` stops the listener after emitting them, both
+    without blocking the event loop.
+    """
+
+    listener: "QueueListener"
+
+    def __init__(
+        self,
+        *handlers: logging.Handler,
+        maxsize: int = 10000,
+        respect_handler_level: bool = True,
+    ) -> None:
+        """Initialize the asyncio queue handler.
+
+        :param logging.Handler handlers:
+            Specifies the handlers which the background listener emits to.
+        :param int maxsize:
+            Specifies the maximum number of records waiting on the queue.
+            Records are dropped and counted in ``dropped`` while it's full.
+        :param bool respect_handler_level:
+            Specifies whether the listener checks the level of each handler.
+        """
+        if not handlers:
+            raise ValueError("At least one handler is required")
+        super().__init__(
+            *handlers, maxsize=maxsize, respect_handler_level=respect_handler_level
+        )
+
+    def flush(self) -> None:
+        """Waits until all records queued before were emitted"""
+        if self.listener._thread is None:  # type: ignore[attr-defined]
+            return
+        emitted = threading.Event()
+        # Waits for room like 'enqueue_sentinel()', records are never dropped
+        self.queue.put(emitted)  # type: ignore[attr-defined]
+        emitted.wait()
+
+    async def aflush(self) -> None:
+        """Same as 'flush()' but waits without blocking the event loop"""
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def aclose(self) -> None:
+        """Same as 'close()' but waits without blocking the event loop"""
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """Listener which turns the snapshots put on a queue by
+    :class:`QueueHandler` back into records for its handlers.
+    """
+
+    def handle(self, record: Any) -> None:
+        if isinstance(record, threading.Event):
+            # Everything put on the queue before was emitted
+            record.set()
+        else:
+            super().handle(record)
+
+    def prepare(self, record: Any) -> Any:
+        if isinstance(record, RecordSnapshot):
+            return record.to_record()
+        return record
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room on a bounded queue instead of failing to stop.
+        self.queue.put(self._sentinel)  # type: ignore[attr-defined]
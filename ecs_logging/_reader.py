@@ -0,0 +1,271 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import gzip
+import json
+import mmap
+import os
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from ._utils import (
+    FieldMatcher,
+    flatten_dict,
+    format_unix_timestamp,
+    normalize_dict,
+    resolve_json_backend,
+)
+
+try:
+    from typing import Literal  # type: ignore
+except ImportError:
+    from typing_extensions import Literal  # type: ignore
+
+__all__ = ["read_events"]
+
+Layout = Union[Literal["raw"], Literal["nested"], Literal["flat"]]
+Bound = Union[str, datetime.datetime]
+
+# The formatters write '@timestamp' and 'log.level' first, so filters
+# can read them from the start of a line without decoding it.
+_TIMESTAMP_PREFIX = b'{"@timestamp":"'
+_LEVEL_SEPARATOR = b'","log.level":"'
+
+# Pages of the file which were read are released every this many bytes,
+# so that scanning large files doesn't grow the resident memory.
+_RELEASE_SIZE = 64 * 1024 * 1024
+
+
+def read_events(
+    filename: Union[str, "os.PathLike[str]"],
+    fields: Optional[Iterable[str]] = None,
+    levels: Optional[Collection[str]] = None,
+    start: Optional[Bound] = None,
+    end: Optional[Bound] = None,
+    layout: Layout = "raw",
+    json_backend: str = "json",
+) -> Iterator[Dict[str, Any]]:
+    """Reads the events of an NDJSON file written by the ECS formatters,
+    plain or gzip compressed. The file is memory mapped and events are
+    decoded one at a time while iterating, so files of any size are
+    read with constant memory. Lines which the filters reject are
+    skipped before they're decoded whenever possible.
+
+    :param str filename:
+        Specifies the file to read. Gzip files are recognized by their
+        content, files with many gzip members are read completely.
+    :param Iterable[str] fields:
+        Specifies the fields to keep, expressed with dot notation and
+        ``*`` wildcards like ``exclude_fields`` of the formatters.
+        Defaults to all fields.
+    :param Collection[str] levels:
+        Specifies the names of the levels to keep, ie ``["error", "critical"]``.
+        Defaults to all levels.
+    :param str|datetime start:
+        Specifies the earliest ``@timestamp`` to keep, either a datetime
+        or an ISO 8601 string in UTC like the formatters write. Strings
+        are compared as text, so ``"2024-05-01"`` keeps events from the
+        beginning of that day on. Naive datetimes are in local time like
+        for ``datetime.timestamp()``.
+    :param str|datetime end:
+        Specifies the ``@timestamp`` from which events are skipped, in
+        the same form as 'start'.
+    :param str layout:
+        Specifies the layout of the events. ``"raw"`` keeps them as they
+        were written, ``"nested"`` expands all dotted names to nested
+        objects and ``"flat"`` joins all nested names with dots.
+    :param str json_backend:
+        Specifies the library decoding the lines, one of ``"json"``,
+        ``"orjson"``, ``"msgspec"`` or ``"auto"`` for the fastest one
+        that is installed.
+    """
+    if layout not in ("raw", "nested", "flat"):
+        raise ValueError("'layout' must be one of: 'raw', 'nested', 'flat'")
+    if isinstance(levels, str):
+        raise ValueError("'levels' must be a collection of level names")
+    loads = _json_loads(resolve_json_backend(json_backend))
+    return _read_events(
+        os.fspath(filename),
+        loads,
+        FieldMatcher(fields) if fields is not None else None,
+        frozenset(level.lower() for level in levels) if levels is not None else None,
+        _format_bound("start", start),
+        _format_bound("end", end),
+        layout,
+    )
+
+
+def _read_events(
+    filename: str,
+    loads: Callable[[Union[bytes, str]], Any],
+    matcher: Optional[FieldMatcher],
+    levels: Optional[Collection[str]],
+    start: Optional[str],
+    end: Optional[str],
+    layout: Layout,
+) -> Iterator[Dict[str, Any]]:
+    filtered = levels is not None or start is not None or end is not None
+
+    def accepts(timestamp: Optional[str], level: Optional[str]) -> bool:
+        if start is not None or end is not None:
+            if not isinstance(timestamp, str):
+                return False
+            if start is not None and timestamp < start:
+                return False
+            if end is not None and timestamp >= end:
+                return False
+        if levels is not None:
+            return isinstance(level, str) and level.lower() in levels
+        return True
+
+    for line in _read_lines(filename):
+        if not line or line.isspace():
+            continue
+        if filtered:
+            prefix = _prefix_fields(line)
+            if prefix is not None and (levels is None or prefix[1] is not None):
+                if not accepts(*prefix):
+                    continue
+                event = loads(line)
+            else:
+                event = loads(line)
+                if not isinstance(event, dict) or not accepts(
+                    event.get("@timestamp"), _event_level(event)
+                ):
+                    continue
+        else:
+            event = loads(line)
+
+        if matcher is not None:
+            event = matcher.select(event)
+        if layout == "nested":
+            event = normalize_dict(event)
+        elif layout == "flat":
+            event = flatten_dict(event)
+        yield event
+
+
+def _read_lines(filename: str) -> Iterator[bytes]:
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files can't be mapped
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            if data[:2] == b"\x1f\x8b":
+                yield from _read_gzip_lines(data)
+            else:
+                yield from _read_plain_lines(data)
+
+
+def _read_plain_lines(data: mmap.mmap) -> Iterator[bytes]:
+    size = len(data)
+    released = position = 0
+    while position < size:
+        newline = data.find(b"\n", position)
+        if newline == -1:
+            newline = size
+        yield data[position:newline]
+        position = newline + 1
+        if position - released >= _RELEASE_SIZE:
+            released = _release_pages(data, released, position)
+
+
+def _read_gzip_lines(data: mmap.mmap) -> Iterator[bytes]:
+    released = 0
+    # 'GzipFile' reads all members of the stream, as the 'GzipFileHandler'
+    # writes every batch as its own member
+    with gzip.GzipFile(fileobj=data, mode="rb") as file:
+        for line in file:
+            yield line
+            position = data.tell()
+            if position - released >= _RELEASE_SIZE:
+                released = _release_pages(data, released, position)
+
+
+def _release_pages(data: mmap.mmap, start: int, end: int) -> int:
+    """Drops the pages which were read from the mapping and returns
+    where the next release starts. They're read from the file again
+    if they're used again.
+    """
+    end -= end % mmap.PAGESIZE
+    if hasattr(mmap, "MADV_DONTNEED") and end > start:
+        data.madvise(mmap.MADV_DONTNEED, start, end - start)
+    return end
+
+
+def _prefix_fields(line: bytes) -> Optional[Tuple[str, Optional[str]]]:
+    """Returns '@timestamp' and 'log.level' from the start of a line, or
+    ``None`` if it doesn't start like the formatters write. The level is
+    ``None`` if it isn't the second field.
+    """
+    if not line.startswith(_TIMESTAMP_PREFIX):
+        return None
+    offset = len(_TIMESTAMP_PREFIX)
+    quote = line.find(b'"', offset)
+    timestamp = line[offset:quote]
+    if quote == -1 or b"\\" in timestamp:
+        return None
+    if not line.startswith(_LEVEL_SEPARATOR, quote):
+        return timestamp.decode("ascii", "replace"), None
+    offset = quote + len(_LEVEL_SEPARATOR)
+    quote = line.find(b'"', offset)
+    level = line[offset:quote]
+    if quote == -1 or b"\\" in level:
+        return timestamp.decode("ascii", "replace"), None
+    return timestamp.decode("ascii", "replace"), level.decode("utf-8", "replace")
+
+
+def _event_level(event: Dict[str, Any]) -> Any:
+    level = event.get("log.level")
+    if level is None:
+        log = event.get("log")
+        if isinstance(log, dict):
+            level = log.get("level")
+    return level
+
+
+def _format_bound(name: str, value: Optional[Bound]) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime.datetime):
+        return format_unix_timestamp(value.timestamp())
+    raise ValueError(f"'{name}' must be a datetime or a string")
+
+
+def _json_loads(json_backend: str) -> Callable[[Union[bytes, str]], Any]:
+    """Returns the function of a backend that decodes a line"""
+    if json_backend == "orjson":
+        import orjson
+
+        return orjson.loads  # type: ignore[no-any-return]
+    elif json_backend == "msgspec":
+        import msgspec
+
+        return msgspec.json.Decoder().decode  # type: ignore[no-any-return]
+    return json.loads
@@ -0,0 +1,258 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
+from typing import IO, Any, List, Optional, Tuple, Union, cast
+
+from ._handlers import format_line
+
+__all__ = [
+    "SharedMemoryRing",
+    "SharedMemoryHandler",
+    "SharedMemoryCollector",
+]
+
+# The header holds the total number of bytes ever written ('head'), read
+# ('tail') and the number of dropped records. Offsets into the data
+# region are the positions modulo its capacity.
+_HEADER = struct.Struct("<QQQ")
+_LENGTH = struct.Struct("<I")
+_DROPPED = struct.Struct("<Q")
+_DATA_OFFSET = _HEADER.size
+
+
+class SharedMemoryRing:
+    """Ring buffer of length-prefixed byte strings in a
+    ``multiprocessing.shared_memory`` block, written to by many processes
+    and read by one.
+
+    The ring has to be created before worker processes are forked (or
+    passed to them as an argument of ``multiprocessing.Process``) so that
+    they share its lock. When there isn't enough room for a record it's
+    dropped and counted in ``dropped``, records already in the ring are
+    never overwritten.
+    """
+
+    def __init__(
+        self,
+        size: int = 4 * 1024 * 1024,
+        lock_timeout: float = 0.1,
+        context: Optional[BaseContext] = None,
+    ) -> None:
+        """Initialize the shared memory ring.
+
+        :param int size:
+            Specifies the size in bytes of the shared memory block.
+        :param float lock_timeout:
+            Specifies how many seconds writers wait for the lock before
+            dropping a record, which only happens when a process died
+            while it was holding the lock.
+        :param multiprocessing.context.BaseContext context:
+            Specifies the multiprocessing context which worker processes are
+            started with, when it's not the default ``multiprocessing``.
+        """
+        if size <= _HEADER.size + _LENGTH.size:
+            raise ValueError(
+                f"'size' must be larger than {_HEADER.size + _LENGTH.size}"
+            )
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.context = context if context is not None else multiprocessing.get_context()
+        self._lock = self.context.Lock()
+        self._owner = os.getpid()
+        self.lock_timeout = lock_timeout
+        self._attach()
+        _HEADER.pack_into(self._buf, 0, 0, 0, 0)
+
+    def _attach(self) -> None:
+        self._buf = cast(memoryview, self._shm.buf)
+        self._data = self._buf[_DATA_OFFSET:]
+        self.capacity = len(self._data)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def dropped(self) -> int:
+        """Number of records dropped because the ring was full"""
+        return _HEADER.unpack_from(self._buf)[2]  # type: ignore[no-any-return]
+
+    def put(self, data: bytes) -> bool:
+        """Appends a record to the ring, returns ``False`` if it was dropped"""
+        needed = _LENGTH.size + len(data)
+        if not self._lock.acquire(timeout=self.lock_timeout):
+            # Counted without the lock, so this count may be off
+            self._count_dropped()
+            return False
+        try:
+            head, tail, dropped = _HEADER.unpack_from(self._buf)
+            if self.capacity - (head - tail) < needed:
+                _HEADER.pack_into(self._buf, 0, head, tail, dropped + 1)
+                return False
+            self._write(head, _LENGTH.pack(len(data)))
+            self._write(head + _LENGTH.size, data)
+            _HEADER.pack_into(self._buf, 0, head + needed, tail, dropped)
+            return True
+        finally:
+            self._lock.release()
+
+    def get_all(self) -> List[bytes]:
+        """Removes and returns all records in the ring. Only one
+        process may read from the ring.
+        """
+        with self._lock:
+            head, tail, dropped = _HEADER.unpack_from(self._buf)
+            data = self._read(tail, head - tail)
+            _HEADER.pack_into(self._buf, 0, head, head, dropped)
+
+        records = []
+        offset = 0
+        while offset < len(data):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            start = offset + _LENGTH.size
+            offset = start + length
+            records.append(data[start:offset])
+        return records
+
+    def close(self) -> None:
+        """Closes the shared memory block, and removes it if
+        it was created by the current process.
+        """
+        self._data.release()
+        self._buf = None  # type: ignore[assignment]
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+    def _write(self, position: int, data: bytes) -> None:
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        end = offset + first
+        self._data[offset:end] = data[:first]
+        if first < len(data):
+            self._data[: len(data) - first] = data[first:]
+
+    def _read(self, position: int, length: int) -> bytes:
+        offset = position % self.capacity
+        first = min(length, self.capacity - offset)
+        end = offset + first
+        data = bytes(self._data[offset:end])
+        if first < length:
+            data += bytes(self._data[: length - first])
+        return data
+
+    def _count_dropped(self) -> None:
+        _DROPPED.pack_into(self._buf, _DATA_OFFSET - _DROPPED.size, self.dropped + 1)
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        # Only for passing the ring to a new 'multiprocessing.Process'
+        return self._shm, self._lock, self._owner, self.lock_timeout, self.context
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        self._shm, self._lock, self._owner, self.lock_timeout, self.context = state
+        self._attach()
+
+
+class SharedMemoryHandler(logging.Handler):
+    """Handler which puts the formatted bytes of every record into a
+    :class:`SharedMemoryRing` instead of writing them. Records never
+    leave the process as pickles, and the handler never waits for I/O.
+    """
+
+    def __init__(self, ring: SharedMemoryRing) -> None:
+        super().__init__()
+        self.ring = ring
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.ring.put(format_line(self, record))
+        except Exception:
+            self.handleError(record)
+
+
+class SharedMemoryCollector:
+    """Drains the records of a :class:`SharedMemoryRing` to a file, either
+    on demand with :meth:`drain` or from a process started by :meth:`start`.
+    """
+
+    def __init__(
+        self,
+        ring: SharedMemoryRing,
+        sink: Union[str, "os.PathLike[str]", IO[bytes]],
+        interval: float = 0.1,
+    ) -> None:
+        """Initialize the collector.
+
+        :param SharedMemoryRing ring:
+            Specifies the ring which records are read from.
+        :param sink:
+            Specifies the filename records are appended to,
+            or a binary file object to write them to.
+        :param float interval:
+            Specifies how many seconds the collector process
+            waits between draining the ring.
+        """
+        self.ring = ring
+        self.sink = sink
+        self.interval = interval
+        self._stop = ring.context.Event()
+        self._process: Optional[BaseProcess] = None
+
+    def drain(self, stream: IO[bytes]) -> int:
+        """Writes all records in the ring to a stream as they were put,
+        :class:`SharedMemoryHandler` puts newline-terminated documents.
+        Returns the number of records written.
+        """
+        records = self.ring.get_all()
+        if records:
+            stream.write(b"".join(records))
+            stream.flush()
+        return len(records)
+
+    def run(self) -> None:
+        """Drains the ring until :meth:`stop` is called"""
+        if isinstance(self.sink, (str, os.PathLike)):
+            with open(self.sink, "ab") as stream:
+                self._run(stream)
+        else:
+            self._run(self.sink)
+
+    def _run(self, stream: IO[bytes]) -> None:
+        while not self._stop.wait(self.interval):
+            self.drain(stream)
+        self.drain(stream)
+
+    def start(self) -> None:
+        """Starts a process running :meth:`run`"""
+        self._stop.clear()
+        self._process = self.ring.context.Process(  # type: ignore[attr-defined]
+            target=self.run, name="ecs-logging-collector", daemon=True
+        )
+        self._process.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the collector process after draining the ring once more"""
+        self._stop.set()
+        if self._process is not None:
+            self._process.join(timeout)
+            self._process = None
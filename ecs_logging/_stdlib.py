@@ -17,20 +17,49 @@
 
 import collections.abc
 import logging
+import math
+import os
 import sys
 import time
-from functools import lru_cache
+import weakref
 from traceback import format_tb
+from types import TracebackType
 
+from ._context import BOUND_FIELDS_ATTRIBUTE, current_context_fields
+from ._correlation import CorrelationProvider, SpanFieldsCache
 from ._meta import ECS_VERSION
+from ._profiling import FormatterProfiler, StageTimer
 from ._utils import (
-    de_dot,
-    flatten_dict,
+    ContextFields,
+    EncodedFields,
+    FieldLimits,
+    FieldMatcher,
+    FieldPath,
+    RawJSON,
+    SharedCache,
+    _value_encoder,
+    add_field_paths,
+    dict_field_paths,
+    format_timestamp,
     json_dumps,
-    merge_dicts,
+    json_dumps_bytes,
+    json_dumps_paths,
+    nest_field_paths,
+    resolve_json_backend,
+    write_into,
 )
 
-from typing import Any, Callable, Dict, Optional, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 try:
     from typing import Literal  # type: ignore
@@ -45,34 +74,83 @@ try:
 except Exception:  # LogRecord signature changed?
     _LOGRECORD_DIR = set()
 
+# Attributes added by the Elastic APM agent for log
+# correlation and their standard tracing ECS fields.
+_ELASTICAPM_FIELDS: Dict[str, FieldPath] = {
+    "elasticapm_span_id": ("span", "id"),
+    "elasticapm_transaction_id": ("transaction", "id"),
+    "elasticapm_trace_id": ("trace", "id"),
+    "elasticapm_service_name": ("service", "name"),
+    "elasticapm_service_environment": ("service", "environment"),
+}
+
+_STACK_TRACE_PATH = ("error", "stack_trace")
+
+# Fields which are the same for all records of a process
+_PROCESS_FIELDS = frozenset({("process", "pid"), ("process", "name")})
+
+# Fields which are the same for all records logged from a call site,
+# 'log.origin' is serialized once for each call site along with them.
+_CALL_SITE_FIELDS = frozenset(
+    {
+        ("log", "origin", "function"),
+        ("log", "origin", "file", "line"),
+        ("log", "origin", "file", "name"),
+        ("log", "logger"),
+    }
+)
+_ORIGIN_PATH = ("log", "origin")
+
+# Formatters with serialized process fields, which are reset after a fork
+_ENCODING_FORMATTERS: "weakref.WeakSet[StdlibFormatter]" = weakref.WeakSet()
+
+
+def _within_origin(items: Iterable[Tuple[FieldPath, Any]]) -> bool:
+    """Returns whether any of the fields are 'log.origin' or within it"""
+    size = len(_ORIGIN_PATH)
+    return any(path[:size] == _ORIGIN_PATH for path, _ in items)
+
+
+def _after_fork_in_child() -> None:
+    for formatter in list(_ENCODING_FORMATTERS):
+        formatter._encoded = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
 
 class StdlibFormatter(logging.Formatter):
     """ECS Formatter for the standard library ``logging`` module"""
 
-    _LOGRECORD_DICT = {
-        "name",
-        "msg",
-        "args",
-        "asctime",
-        "levelname",
-        "levelno",
-        "pathname",
-        "filename",
-        "module",
-        "exc_info",
-        "exc_text",
-        "stack_info",
-        "lineno",
-        "funcName",
-        "created",
-        "msecs",
-        "relativeCreated",
-        "thread",
-        "threadName",
-        "processName",
-        "process",
-        "message",
-    } | _LOGRECORD_DIR
+    _LOGRECORD_DICT = frozenset(
+        {
+            "name",
+            "msg",
+            "args",
+            "asctime",
+            "levelname",
+            "levelno",
+            "pathname",
+            "filename",
+            "module",
+            "exc_info",
+            "exc_text",
+            "stack_info",
+            "lineno",
+            "funcName",
+            "created",
+            "msecs",
+            "relativeCreated",
+            "thread",
+            "threadName",
+            "processName",
+            "process",
+            "message",
+            BOUND_FIELDS_ATTRIBUTE,
+        }
+        | _LOGRECORD_DIR
+    )
     converter: Callable[[Optional[float]], time.struct_time] = staticmethod(time.gmtime)
 
     def __init__(
@@ -85,6 +163,14 @@ class StdlibFormatter(logging.Formatter):
         extra: Optional[Dict[str, Any]] = None,
         exclude_fields: Sequence[str] = (),
         ensure_ascii: bool = True,
+        json_backend: str = "json",
+        stack_trace_cache_size: int = 256,
+        profiler: Optional[FormatterProfiler] = None,
+        max_bytes: Optional[int] = None,
+        max_field_length: Optional[int] = None,
+        omit_duplicate_original: bool = False,
+        correlation: Optional[CorrelationProvider] = None,
+        call_site_cache_size: int = 1024,
     ) -> None:
         """Initialize the ECS formatter.
 
@@ -107,6 +193,57 @@ class StdlibFormatter(logging.Formatter):
             You can also use field prefixes to exclude whole groups of fields::
 
                 exclude_keys=["error"]
+
+            And ``*`` wildcards to match any part of a field name::
+
+                exclude_keys=["http.request.headers.*"]
+
+            Fields of the global 'extra' are only left out when their
+            top-level name is excluded, ie ``"service"`` but not
+            ``"service.name"``.
+        :param bool ensure_ascii:
+            Specifies whether non-ASCII characters are escaped in the output.
+        :param str json_backend:
+            Specifies the library used to serialize values to JSON, one of
+            ``"json"`` (the default), ``"orjson"``, ``"msgspec"`` or ``"auto"``
+            which picks the fastest installed library and falls back
+            to ``"json"``. The output is the same with every backend, values
+            the library would write differently are serialized by ``json``.
+        :param int stack_trace_cache_size:
+            Specifies how many rendered stack traces are cached, so that an
+            exception raised from the same frames over and over again is
+            only rendered once. Setting this to zero disables the cache.
+        :param FormatterProfiler profiler:
+            Specifies a profiler which measures the time spent in each stage
+            of formatting records. It can also be set or removed later with
+            the ``profiler`` attribute.
+        :param int max_bytes:
+            Specifies the maximum size of a UTF-8 encoded record. Records which
+            are larger get their longest string fields truncated until they
+            fit, then their largest fields dropped. The global extra and
+            the fields ``@timestamp``, ``log.level`` and ``ecs.version``
+            are never truncated. Defaults to ``None`` for no limit.
+        :param int max_field_length:
+            Specifies the maximum number of characters of string fields,
+            longer strings are cut and end with ``...``. Objects which are
+            serialized with their ``repr()`` count as strings. The names of
+            truncated fields are listed in the ``log.truncated`` field.
+            Defaults to ``None`` for no limit.
+        :param bool omit_duplicate_original:
+            Specifies whether ``log.original`` is left out of records when
+            it's the same as ``message``.
+        :param CorrelationProvider correlation:
+            Specifies a provider which adds the tracing fields of the active
+            span, ie ``ElasticAPMCorrelation()`` or ``OpenTelemetryCorrelation()``.
+            The fields of a span are serialized once for all its records.
+            Records formatted without an active span, ie on the thread of
+            a ``QueueListener``, use the Elastic APM agent's record
+            attributes instead if there are any.
+        :param int call_site_cache_size:
+            Specifies for how many call sites the serialized ``log.origin``
+            and ``log.logger`` fields are cached, so that they're only
+            serialized once for records logged from the same line. Setting
+            this to zero disables the cache.
         """
         _kwargs = {}
         if validate is not None:
@@ -128,9 +265,142 @@ class StdlibFormatter(logging.Formatter):
             raise TypeError("'exclude_fields' must be a sequence of strings")
 
         self._extra = extra
-        self._exclude_fields = frozenset(exclude_fields)
+        self._exclude = FieldMatcher(exclude_fields)
+        if not isinstance(stack_trace_cache_size, int) or stack_trace_cache_size < 0:
+            raise TypeError("'stack_trace_cache_size' must be a non-negative integer")
+        if not isinstance(call_site_cache_size, int) or call_site_cache_size < 0:
+            raise TypeError("'call_site_cache_size' must be a non-negative integer")
+        for name, limit in (
+            ("max_bytes", max_bytes),
+            ("max_field_length", max_field_length),
+        ):
+            if limit is not None and (not isinstance(limit, int) or limit < 1):
+                raise TypeError(f"'{name}' must be None or a positive integer")
+
         self._stack_trace_limit = stack_trace_limit
+        self._stack_trace_cache = (
+            SharedCache(stack_trace_cache_size) if stack_trace_cache_size else None
+        )
         self.ensure_ascii = ensure_ascii
+        self.json_backend = resolve_json_backend(json_backend)
+        self.profiler = profiler
+
+        # Everything that only depends on the configuration is resolved
+        # once here so that 'format_to_ecs()' doesn't need to rebuild
+        # the extractors and re-check exclusions for every record.
+        self._extractors = self._compile_extractors()
+        # 'process.pid' and 'process.name' are the same for all records of
+        # a process, they're serialized once along with the global extra.
+        self._process_extractors = tuple(
+            (path, extractor)
+            for path, extractor in self._extractors
+            if path in _PROCESS_FIELDS
+        )
+        self._record_extractors = tuple(
+            (path, extractor)
+            for path, extractor in self._extractors
+            if path not in _PROCESS_FIELDS
+        )
+        self._call_site_extractors = tuple(
+            (path, extractor)
+            for path, extractor in self._extractors
+            if path in _CALL_SITE_FIELDS
+        )
+        self._encoded: Optional[Tuple[Any, Any, EncodedFields]] = None
+        extra_fields: List[Tuple[FieldPath, Any]] = []
+        if extra is not None:
+            for field, value in extra.items():
+                path = tuple(field.split("."))
+                # Fields of the global extra are set on purpose, they're
+                # only excluded together with their top-level name.
+                if value is None or self._exclude.matches(path[:1]):
+                    continue
+                # Only the names of the global extra are dotted, dotted
+                # keys within their values are kept as they are.
+                extra_fields.extend(dict_field_paths({path[-1]: value}, path[:-1]))
+        self._extra_fields = tuple(extra_fields)
+        # The global extra is left as is, also when it's not serialized
+        # once, ie for records of other processes.
+        self._limits = (
+            FieldLimits(
+                max_bytes,
+                max_field_length,
+                mark=not self._is_field_excluded("log.truncated"),
+                unlimited=[path for path, _ in self._extra_fields],
+            )
+            if max_bytes is not None or max_field_length is not None
+            else None
+        )
+        # The global extra takes precedence over the rendered message
+        self._include_message = not self._is_field_excluded("message") and not any(
+            path[0] == "message" for path, _ in self._extra_fields
+        )
+        # 'log.original' and 'message' are both the rendered message
+        self._include_log_original = not self._is_field_excluded(
+            "log.original"
+        ) and not (omit_duplicate_original and self._include_message)
+        # The serialized call site fields can't be truncated by the limits
+        # and fields within 'log.origin' have to be merged with them.
+        self._call_sites = (
+            SharedCache(call_site_cache_size)
+            if call_site_cache_size
+            and self._call_site_extractors
+            and self._limits is None
+            and not _within_origin(self._extra_fields)
+            else None
+        )
+        # The extractors when the call site fields come from the cache
+        self._site_extractors = tuple(
+            item for item in self._extractors if item[0] not in _CALL_SITE_FIELDS
+        )
+        self._site_record_extractors = tuple(
+            item for item in self._record_extractors if item[0] not in _CALL_SITE_FIELDS
+        )
+        self._correlation = (
+            SpanFieldsCache(
+                correlation,
+                self._exclude,
+                given=[path for path, _ in self._extra_fields],
+            )
+            if correlation is not None
+            else None
+        )
+        # Timestamps are rendered with a per-second cache as long
+        # as they're rendered the way 'formatTime()' would do it.
+        self._cache_timestamps = type(self).formatTime is logging.Formatter.formatTime
+        self._format_to_ecs_overridden = (
+            type(self).format_to_ecs is not StdlibFormatter.format_to_ecs
+        )
+
+    def _compile_extractors(
+        self,
+    ) -> Tuple[Tuple[Tuple[str, ...], Callable[[logging.LogRecord], Any]], ...]:
+        """Returns the ``(path, extractor)`` pairs for all fields that aren't
+        excluded. 'log.original' is rendered together with 'message' in
+        'format_to_ecs()' so it isn't part of the extractors.
+        """
+        extractors: Dict[str, Callable[[logging.LogRecord], Any]] = {
+            "@timestamp": self._record_timestamp,
+            "ecs.version": lambda _: ECS_VERSION,
+            "log.level": lambda r: (r.levelname.lower() if r.levelname else None),
+            "log.origin.function": self._record_attribute("funcName"),
+            "log.origin.file.line": self._record_attribute("lineno"),
+            "log.origin.file.name": self._record_attribute("filename"),
+            "log.logger": self._record_attribute("name"),
+            "process.pid": self._record_attribute("process"),
+            "process.name": self._record_attribute("processName"),
+            "process.thread.id": self._record_attribute("thread"),
+            "process.thread.name": self._record_attribute("threadName"),
+            "error.type": self._record_error_type,
+            "error.message": self._record_error_message,
+            "error.stack_trace": self._record_error_stack_trace,
+        }
+        return tuple(
+            # special case ecs.version that should not be de-dotted
+            ((field,) if field == "ecs.version" else tuple(field.split(".")), extractor)
+            for field, extractor in extractors.items()
+            if not self._is_field_excluded(field)
+        )
 
     def _record_error_type(self, record: logging.LogRecord) -> Optional[str]:
         exc_info = record.exc_info
@@ -159,8 +429,40 @@ class StdlibFormatter(logging.Formatter):
         return None
 
     def format(self, record: logging.LogRecord) -> str:
-        result = self.format_to_ecs(record)
-        return json_dumps(result, ensure_ascii=self.ensure_ascii)
+        if self.profiler is not None:
+            return self._format_profiled(record, self.profiler)
+        if self._format_to_ecs_overridden:
+            return self._json_dumps_ecs(self.format_to_ecs(record))
+        return self._json_dumps_fields(record)
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """Same as 'format()' but returns UTF-8 encoded bytes, for handlers
+        which write to binary streams or sockets. Only the result of an
+        overridden 'format_to_ecs()' is serialized to bytes directly, by
+        orjson or msgspec when it only holds plain JSON values. Other
+        records are formatted to a string which is then encoded.
+        """
+        if self.profiler is not None:
+            return self._format_profiled(record, self.profiler).encode("utf-8")
+        if self._format_to_ecs_overridden:
+            if self._limits is not None:
+                return self._json_dumps_ecs(self.format_to_ecs(record)).encode("utf-8")
+            return json_dumps_bytes(
+                self.format_to_ecs(record),
+                ensure_ascii=self.ensure_ascii,
+                json_backend=self.json_backend,
+            )
+        return self._json_dumps_fields(record).encode("utf-8")
+
+    def format_into(
+        self, record: logging.LogRecord, buffer: Union[bytearray, memoryview]
+    ) -> int:
+        """Writes the UTF-8 encoded record into a caller-owned buffer and
+        returns the number of bytes written. A ``bytearray`` is extended,
+        a writable ``memoryview`` is filled from its start. The record is
+        formatted by 'format_bytes()' and then copied into the buffer.
+        """
+        return write_into(buffer, self.format_bytes(record))
 
     def format_to_ecs(self, record: logging.LogRecord) -> Dict[str, Any]:
         """Function that can be overridden to add additional fields to
@@ -175,93 +477,339 @@ class StdlibFormatter(logging.Formatter):
                   result["my_field"] = "my_value" # add custom field
                   return result
         """
+        return nest_field_paths(
+            self._record_fields(
+                record, span=self._span_fields(), bound=self._bound_fields(record)
+            )
+        )
 
-        extractors: Dict[str, Callable[[logging.LogRecord], Any]] = {
-            "@timestamp": self._record_timestamp,
-            "ecs.version": lambda _: ECS_VERSION,
-            "log.level": lambda r: (r.levelname.lower() if r.levelname else None),
-            "log.origin.function": self._record_attribute("funcName"),
-            "log.origin.file.line": self._record_attribute("lineno"),
-            "log.origin.file.name": self._record_attribute("filename"),
-            "log.original": lambda r: r.getMessage(),
-            "log.logger": self._record_attribute("name"),
-            "process.pid": self._record_attribute("process"),
-            "process.name": self._record_attribute("processName"),
-            "process.thread.id": self._record_attribute("thread"),
-            "process.thread.name": self._record_attribute("threadName"),
-            "error.type": self._record_error_type,
-            "error.message": self._record_error_message,
-            "error.stack_trace": self._record_error_stack_trace,
-        }
+    def _json_dumps_fields(
+        self, record: logging.LogRecord, timer: Optional[StageTimer] = None
+    ) -> str:
+        # Without a custom 'format_to_ecs()' the fields can be
+        # serialized directly, without nesting them first.
+        encoded = self._encoded_fields(record)
+        if timer is not None:
+            timer.mark("encode")
+        span = self._span_fields()
+        bound = self._bound_fields(record)
+        fields = self._record_fields(
+            record,
+            include_constant=encoded is None,
+            span=span,
+            bound=bound,
+            encoding=True,
+            timer=timer,
+        )
+        if encoded is not None and (span is not None or bound is not None):
+            encoded = self._add_context_fields(fields, encoded, span, bound)
+        output = self._json_dumps_paths(fields, encoded)
+        if timer is not None:
+            timer.mark("encode")
+        return output
+
+    def _span_fields(self) -> Optional[ContextFields]:
+        correlation = self._correlation
+        return correlation.current() if correlation is not None else None
+
+    def _bound_fields(self, record: logging.LogRecord) -> Optional[ContextFields]:
+        """Returns the fields which were bound when the record was logged"""
+        available = record.__dict__
+        if BOUND_FIELDS_ATTRIBUTE in available:
+            bound: Optional[ContextFields] = available[BOUND_FIELDS_ATTRIBUTE]
+        else:
+            bound = current_context_fields()
+        if bound is None:
+            return None
+        bound = bound.filtered(self._exclude)
+        return bound if bound.fields else None
 
-        result: Dict[str, Any] = {}
-        for field in set(extractors.keys()).difference(self._exclude_fields):
-            if self._is_field_excluded(field):
-                continue
-            value = extractors[field](record)
+    def _add_context_fields(
+        self,
+        fields: List[Tuple[FieldPath, Any]],
+        encoded: EncodedFields,
+        span: Optional[ContextFields],
+        bound: Optional[ContextFields],
+    ) -> EncodedFields:
+        """Returns the encoded fields along with the bound and span fields.
+        When the record gives some of them, the others are added to 'fields'
+        instead. Like in 'format_to_ecs()' the fields of the record take
+        precedence over the encoded fields, which take precedence over the
+        bound fields, which take precedence over the span fields.
+        """
+        if bound is not None:
+            if bound.overlaps(fields):
+                bound.add_missing(fields, encoded.paths)
+            else:
+                encoded = bound.encoded(encoded)
+        if span is not None:
+            if bound is not None and span.overlaps(bound.fields):
+                span.add_missing(fields, bound.paths | encoded.paths)
+            elif span.overlaps(fields):
+                span.add_missing(fields, encoded.paths)
+            else:
+                encoded = span.encoded(encoded)
+        return encoded
+
+    def _json_dumps_paths(
+        self, fields: List[Tuple[FieldPath, Any]], encoded: Optional[EncodedFields]
+    ) -> str:
+        def dumps(items: List[Tuple[FieldPath, Any]]) -> str:
+            return json_dumps_paths(
+                items,
+                ensure_ascii=self.ensure_ascii,
+                json_backend=self.json_backend,
+                encoded=encoded,
+            )
+
+        if self._limits is None:
+            return dumps(fields)
+        return self._limits.dumps(fields, dumps, self.ensure_ascii)
+
+    def _json_dumps_ecs(self, result: Dict[str, Any]) -> str:
+        if self._limits is not None:
+            return self._json_dumps_paths(dict_field_paths(result), None)
+        return json_dumps(
+            result, ensure_ascii=self.ensure_ascii, json_backend=self.json_backend
+        )
+
+    def _encoded_fields(self, record: logging.LogRecord) -> Optional[EncodedFields]:
+        """Returns the serialized global extra and process fields, which are
+        cached until the process, its name or the serialization changes.
+        """
+        cached = self._encoded
+        if cached is not None:
+            pid, process_name, encoded = cached
+            if (
+                pid == record.process
+                and process_name == record.processName
+                and encoded.ensure_ascii == self.ensure_ascii
+                and encoded.json_backend == self.json_backend
+            ):
+                return encoded
+
+        # Records of other processes, ie received through
+        # a queue or socket, are serialized field by field.
+        if record.process != os.getpid():
+            return None
+        fields = list(self._extra_fields)
+        for path, extractor in self._process_extractors:
+            value = extractor(record)
             if value is not None:
-                # special case ecs.version that should not be de-dotted
-                if field == "ecs.version":
-                    field_dict = {field: value}
-                else:
-                    field_dict = de_dot(field, value)
-                merge_dicts(field_dict, result)
+                fields.append((path, value))
+        encoded = EncodedFields(fields, self.ensure_ascii, self.json_backend)
+        self._encoded = (record.process, record.processName, encoded)
+        _ENCODING_FORMATTERS.add(self)
+        return encoded
 
-        available = record.__dict__
+    def _record_fields(
+        self,
+        record: logging.LogRecord,
+        include_constant: bool = True,
+        span: Optional[ContextFields] = None,
+        bound: Optional[ContextFields] = None,
+        encoding: bool = False,
+        timer: Optional[StageTimer] = None,
+    ) -> List[Tuple[FieldPath, Any]]:
+        """Returns the ``(path, value)`` pairs for all fields of the record,
+        without the global extra, process, 'span' and 'bound' fields if not
+        'include_constant'. The fields of the Elastic APM agent's record
+        attributes are only added without a 'span'. When 'encoding' for
+        '_json_dumps_paths()' the call site fields come serialized from a cache.
+        The stages are marked on the 'timer' of a profiled record.
+        """
 
-        # This is cleverness because 'message' is NOT a member
-        # key of ``record.__dict__`` the ``getMessage()`` method
-        # is effectively ``msg % args`` (actual keys) By manually
-        # adding 'message' to ``available``, it simplifies the code
-        available["message"] = record.getMessage()
+        # 'getMessage()' is effectively ``msg % args`` so it's
+        # only rendered once for both 'log.original' and 'message'.
+        message = record.getMessage()
+        if timer is not None:
+            timer.mark("message")
+
+        fields: List[Tuple[FieldPath, Any]] = []
+        call_sites = self._call_sites if encoding else None
+        extractors = self._select_extractors(include_constant, call_sites)
+        if timer is not None and record.exc_info:
+            extractors = tuple(
+                (
+                    (path, timer.timed(extractor, "extract", "stack_trace"))
+                    if path == _STACK_TRACE_PATH
+                    else (path, extractor)
+                )
+                for path, extractor in extractors
+            )
+        for path, extractor in extractors:
+            value = extractor(record)
+            if value is not None:
+                fields.append((path, value))
+        if timer is not None:
+            timer.mark("extract")
 
-        # Pull all extras and flatten them to be sent into '_is_field_excluded'
-        # since they can be defined as 'extras={"http": {"method": "GET"}}'
-        extra_keys = set(available).difference(self._LOGRECORD_DICT)
-        extras = flatten_dict({key: available[key] for key in extra_keys})
-        # Merge in any global extra's
-        if self._extra is not None:
-            for field, value in self._extra.items():
-                merge_dicts(de_dot(field, value), extras)
-
-        # Pop all Elastic APM extras and add them
-        # to standard tracing ECS fields.
-        extras.setdefault("span.id", extras.pop("elasticapm_span_id", None))
-        extras.setdefault(
-            "transaction.id", extras.pop("elasticapm_transaction_id", None)
-        )
-        extras.setdefault("trace.id", extras.pop("elasticapm_trace_id", None))
-        extras.setdefault("service.name", extras.pop("elasticapm_service_name", None))
-        extras.setdefault(
-            "service.environment", extras.pop("elasticapm_service_environment", None)
+        extras, apm_fields = self._record_extras(
+            record, message, fields, include_constant
         )
+        if include_constant and bound is not None:
+            bound.add_missing(fields)
+        if timer is not None:
+            timer.mark("extras")
+        if span is not None or apm_fields:
+            if span is None:
+                self._add_apm_fields(fields, extras, apm_fields, bound)
+            elif include_constant:
+                span.add_missing(fields)
+            if timer is not None:
+                timer.mark("apm")
+        if call_sites is not None:
+            self._add_call_site_fields(record, call_sites, fields, extras, span, bound)
+            if timer is not None:
+                timer.mark("extract")
+        return fields
+
+    def _select_extractors(
+        self, include_constant: bool, call_sites: Optional[SharedCache]
+    ) -> Tuple[Tuple[FieldPath, Callable[[logging.LogRecord], Any]], ...]:
+        if call_sites is not None:
+            if include_constant:
+                return self._site_extractors
+            return self._site_record_extractors
+        return self._extractors if include_constant else self._record_extractors
+
+    def _add_call_site_fields(
+        self,
+        record: logging.LogRecord,
+        call_sites: SharedCache,
+        fields: List[Tuple[FieldPath, Any]],
+        extras: List[Tuple[FieldPath, Any]],
+        span: Optional[ContextFields],
+        bound: Optional[ContextFields],
+    ) -> None:
+        """Adds the call site fields of the record, which are serialized
+        once for each call site. Their values are added instead when other
+        fields are within 'log.origin', so that they're merged with them.
+        """
+        key = (record.name, record.pathname, record.lineno, record.funcName)
+        cached = call_sites.get(key)
+        if cached is None or cached[0] != (self.ensure_ascii, self.json_backend):
+            cached = self._encode_call_site(record)
+            call_sites.set(key, cached)
+        if (
+            _within_origin(extras)
+            or (bound is not None and "log" in bound.keys)
+            or (span is not None and "log" in span.keys)
+        ):
+            fields.extend(cached[1])
+        else:
+            fields.extend(cached[2])
+
+    def _encode_call_site(self, record: logging.LogRecord) -> Tuple[
+        Tuple[bool, str],
+        List[Tuple[FieldPath, Any]],
+        List[Tuple[FieldPath, Any]],
+    ]:
+        """Returns the call site fields of the record, both as values and
+        serialized with the 'log.origin' object as a single value.
+        """
+        items: List[Tuple[FieldPath, Any]] = []
+        for path, extractor in self._call_site_extractors:
+            value = extractor(record)
+            if value is not None:
+                items.append((path, value))
+        encode = _value_encoder(self.json_backend, self.ensure_ascii)
+        encoded: List[Tuple[FieldPath, Any]] = []
+        origin: List[Tuple[FieldPath, Any]] = []
+        size = len(_ORIGIN_PATH)
+        for path, value in items:
+            if path[:size] == _ORIGIN_PATH:
+                origin.append((path[size:], RawJSON(encode(value))))
+            else:
+                encoded.append((path, RawJSON(encode(value))))
+        if origin:
+            origin_json = json_dumps_paths(origin, self.ensure_ascii, self.json_backend)
+            encoded.append((_ORIGIN_PATH, RawJSON(origin_json)))
+        return (self.ensure_ascii, self.json_backend), items, encoded
+
+    def _record_extras(
+        self,
+        record: logging.LogRecord,
+        message: str,
+        fields: List[Tuple[FieldPath, Any]],
+        include_constant: bool,
+    ) -> Tuple[List[Tuple[FieldPath, Any]], Dict[FieldPath, Any]]:
+        """Adds the message and extra fields of the record to 'fields' and
+        returns the extras along with the fields of the Elastic APM agent.
+        """
+
+        # You can't have 2x 'message' keys in the extractors, so
+        # the value is set to 'log.original' in ecs, and this code
+        # block guarantees it still appears as 'message' too.
+        if self._include_log_original:
+            fields.append((("log", "original"), message))
+        if self._include_message:
+            fields.append((("message",), message))
+
+        # The record isn't changed, unlike by 'logging.Formatter' which
+        # sets 'record.message', so that records can be formatted by
+        # several threads without writing to memory they share.
+        available = record.__dict__
 
-        # Merge in any keys that were set within 'extra={...}'
-        for field, value in extras.items():
-            if field.startswith("elasticapm_labels."):
-                continue  # Unconditionally remove, we don't need this info.
-            if value is None or self._is_field_excluded(field):
+        # Pull all extras and expand them into paths, skipping excluded
+        # fields, since they can be defined as dotted or nested keys,
+        # ie 'extras={"http": {"method": "GET"}}'
+        extras: List[Tuple[FieldPath, Any]] = []
+        apm_fields: Dict[FieldPath, Any] = {}
+        for key, value in available.items():
+            if key in self._LOGRECORD_DICT:
                 continue
-            merge_dicts(de_dot(field, value), result)
+            if key in _ELASTICAPM_FIELDS:
+                if value is not None:
+                    apm_fields[_ELASTICAPM_FIELDS[key]] = value
+            elif key != "elasticapm_labels":
+                # Unconditionally remove labels, we don't need this info.
+                add_field_paths(extras, tuple(key.split(".")), value, self._exclude)
+
+        fields.extend(extras)
+        # Merge in any global extra's
+        if include_constant:
+            fields.extend(self._extra_fields)
+        return extras, apm_fields
 
-        # The following is mostly for the ecs format. You can't have 2x
-        # 'message' keys in _WANTED_ATTRS, so we set the value to
-        # 'log.original' in ecs, and this code block guarantees it
-        # still appears as 'message' too.
-        if not self._is_field_excluded("message"):
-            result.setdefault("message", available["message"])
-        return result
+    def _add_apm_fields(
+        self,
+        fields: List[Tuple[FieldPath, Any]],
+        extras: List[Tuple[FieldPath, Any]],
+        apm_fields: Dict[FieldPath, Any],
+        bound: Optional[ContextFields],
+    ) -> None:
+        # Add all Elastic APM extras as standard tracing
+        # ECS fields unless they were already given.
+        given = {path for path, _ in extras}
+        given.update(path for path, _ in self._extra_fields)
+        if bound is not None:
+            given.update(bound.paths)
+        for path, value in apm_fields.items():
+            if path not in given and not self._exclude.matches(path):
+                fields.append((path, value))
+
+    def _format_profiled(
+        self, record: logging.LogRecord, profiler: FormatterProfiler
+    ) -> str:
+        """Same as 'format()' but measures the time spent in each stage"""
+        timer = StageTimer()
+        if self._format_to_ecs_overridden:
+            result = self.format_to_ecs(record)
+            timer.mark("format_to_ecs")
+            output = self._json_dumps_ecs(result)
+            timer.mark("encode")
+        else:
+            output = self._json_dumps_fields(record, timer)
+        profiler.add(timer.stages)
+        return output
 
-    @lru_cache()
     def _is_field_excluded(self, field: str) -> bool:
-        field_path = []
-        for path in field.split("."):
-            field_path.append(path)
-            if ".".join(field_path) in self._exclude_fields:
-                return True
-        return False
+        return self._exclude.matches(field.split("."))
 
     def _record_timestamp(self, record: logging.LogRecord) -> str:
+        if self._cache_timestamps and self.converter is time.gmtime:
+            return format_timestamp(math.floor(record.created), record.msecs)
         return "%s.%03dZ" % (
             self.formatTime(record, datefmt="%Y-%m-%dT%H:%M:%S"),
             record.msecs,
@@ -281,12 +829,31 @@ class StdlibFormatter(logging.Formatter):
             and record.exc_info[2] is not None
             and (self._stack_trace_limit is None or self._stack_trace_limit != 0)
         ):
-            return (
-                "".join(format_tb(record.exc_info[2], limit=self._stack_trace_limit))
-                or None
-            )
+            return self._format_traceback(record.exc_info[2]) or None
         # LogRecord only has 'stack_info' if it's passed via .log(..., stack_info=True)
         stack_info = getattr(record, "stack_info", None)
         if stack_info:
             return str(stack_info)
         return None
+
+    def _format_traceback(self, tb: TracebackType) -> str:
+        cache = self._stack_trace_cache
+        if cache is None:
+            return "".join(format_tb(tb, limit=self._stack_trace_limit))
+
+        # Tracebacks going through the same instructions of the same
+        # code objects render the same, only their frames differ.
+        signature = []
+        current: Optional[TracebackType] = tb
+        while current is not None:
+            signature.append(
+                (current.tb_frame.f_code, current.tb_lineno, current.tb_lasti)
+            )
+            current = current.tb_next
+        key = (self._stack_trace_limit, tuple(signature))
+
+        stack_trace: Optional[str] = cache.get(key)
+        if stack_trace is None:
+            stack_trace = "".join(format_tb(tb, limit=self._stack_trace_limit))
+            cache.set(key, stack_trace)
+        return stack_trace
@@ -15,12 +15,27 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import collections.abc
 import time
-import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+from ._correlation import CorrelationProvider, SpanFieldsCache
 from ._meta import ECS_VERSION
-from ._utils import json_dumps, normalize_dict
+from ._profiling import FormatterProfiler, StageTimer
+from ._utils import (
+    TRUNCATED_FIELD,
+    FieldLimits,
+    FieldMatcher,
+    FieldPath,
+    dict_field_paths,
+    format_unix_timestamp,
+    json_dumps,
+    json_dumps_bytes,
+    json_dumps_paths,
+    normalize_dict,
+    resolve_json_backend,
+    write_into,
+)
 
 
 class StructlogFormatter:
@@ -29,27 +44,160 @@ class StructlogFormatter:
     def __init__(
         self,
         ensure_ascii: bool = True,
+        json_backend: str = "json",
+        exclude_fields: Sequence[str] = (),
+        profiler: Optional[FormatterProfiler] = None,
+        max_bytes: Optional[int] = None,
+        max_field_length: Optional[int] = None,
+        correlation: Optional[CorrelationProvider] = None,
     ) -> None:
+        """Initialize the ECS formatter.
+
+        :param bool ensure_ascii:
+            Specifies whether non-ASCII characters are escaped in the output.
+        :param str json_backend:
+            Specifies the library used to serialize values to JSON, one of
+            ``"json"`` (the default), ``"orjson"``, ``"msgspec"`` or ``"auto"``
+            which picks the fastest installed library and falls back
+            to ``"json"``. The output is the same with every backend, values
+            the library would write differently are serialized by ``json``.
+        :param Sequence[str] exclude_fields:
+            Specifies any fields that should be suppressed from the resulting
+            fields, expressed with dot notation. Like for the ``StdlibFormatter``
+            this includes all fields within excluded prefixes and name parts
+            can contain ``*`` wildcards.
+        :param FormatterProfiler profiler:
+            Specifies a profiler which measures the time spent in each stage
+            of formatting events. It can also be set or removed later with
+            the ``profiler`` attribute.
+        :param int max_bytes:
+            Specifies the maximum size of a UTF-8 encoded event. Events which
+            are larger get their longest string fields truncated until they
+            fit, then their largest fields dropped. The fields ``@timestamp``,
+            ``log.level`` and ``ecs.version`` are never truncated. Defaults
+            to ``None`` for no limit.
+        :param int max_field_length:
+            Specifies the maximum number of characters of string fields,
+            longer strings are cut and end with ``...``. The names of
+            truncated fields are listed in the ``log.truncated`` field.
+            Defaults to ``None`` for no limit.
+        :param CorrelationProvider correlation:
+            Specifies a provider which adds the tracing fields of the active
+            span, ie ``ElasticAPMCorrelation()`` or ``OpenTelemetryCorrelation()``.
+            Fields which are already in the event are kept.
+        """
+        if (
+            not isinstance(exclude_fields, collections.abc.Sequence)
+            or isinstance(exclude_fields, str)
+            or any(not isinstance(item, str) for item in exclude_fields)
+        ):
+            raise TypeError("'exclude_fields' must be a sequence of strings")
+        for name, limit in (
+            ("max_bytes", max_bytes),
+            ("max_field_length", max_field_length),
+        ):
+            if limit is not None and (not isinstance(limit, int) or limit < 1):
+                raise TypeError(f"'{name}' must be None or a positive integer")
+
         self.ensure_ascii = ensure_ascii
+        self.json_backend = resolve_json_backend(json_backend)
+        self._exclude = FieldMatcher(exclude_fields)
+        self.profiler = profiler
+        self._limits = (
+            FieldLimits(
+                max_bytes,
+                max_field_length,
+                mark=not self._exclude.matches(TRUNCATED_FIELD),
+            )
+            if max_bytes is not None or max_field_length is not None
+            else None
+        )
+        self._correlation = (
+            SpanFieldsCache(correlation, self._exclude)
+            if correlation is not None
+            else None
+        )
 
     def __call__(self, _: Any, name: str, event_dict: Dict[str, Any]) -> str:
+        if self.profiler is not None:
+            return self._format_profiled(name, event_dict, self.profiler)
+        event_dict = self._event_dict_to_ecs(name, event_dict)
+        return self._json_dumps(event_dict)
+
+    def format_bytes(self, _: Any, name: str, event_dict: Dict[str, Any]) -> bytes:
+        """Same as calling the formatter but returns UTF-8 encoded bytes. Use
+        this as the last processor together with ``structlog.BytesLoggerFactory``.
+        """
+        if self.profiler is not None:
+            return self._format_profiled(name, event_dict, self.profiler).encode(
+                "utf-8"
+            )
+        event_dict = self._event_dict_to_ecs(name, event_dict)
+        if (
+            self._limits is not None
+            or type(self)._json_dumps is not StructlogFormatter._json_dumps
+        ):
+            return self._json_dumps(event_dict).encode("utf-8")
+        return json_dumps_bytes(
+            event_dict, ensure_ascii=self.ensure_ascii, json_backend=self.json_backend
+        )
+
+    def format_into(
+        self,
+        _: Any,
+        name: str,
+        event_dict: Dict[str, Any],
+        buffer: Union[bytearray, memoryview],
+    ) -> int:
+        """Writes the UTF-8 encoded event into a caller-owned buffer and returns
+        the number of bytes written. A ``bytearray`` is extended, a writable
+        ``memoryview`` is filled from its start. The event is formatted by
+        'format_bytes()' and then copied into the buffer.
+        """
+        return write_into(buffer, self.format_bytes(_, name, event_dict))
 
+    def _event_dict_to_ecs(
+        self,
+        name: str,
+        event_dict: Dict[str, Any],
+        timer: Optional[StageTimer] = None,
+    ) -> Dict[str, Any]:
         # Handle event -> message now so that stuff like `event.dataset` doesn't
         # cause problems down the line
         event_dict["message"] = str(event_dict.pop("event"))
         event_dict = normalize_dict(event_dict)
         event_dict.setdefault("log", {}).setdefault("level", name.lower())
+        self._add_span_fields(event_dict)
+        if timer is not None:
+            timer.mark("normalize")
         event_dict = self.format_to_ecs(event_dict)
-        return self._json_dumps(event_dict)
+        if timer is not None:
+            timer.mark("format_to_ecs")
+        if self._exclude:
+            event_dict = self._exclude.prune(event_dict)
+            if timer is not None:
+                timer.mark("exclude")
+        return event_dict
+
+    def _add_span_fields(self, event_dict: Dict[str, Any]) -> None:
+        if self._correlation is not None:
+            span = self._correlation.current()
+            if span is not None:
+                span.set_defaults(event_dict)
+
+    def _format_profiled(
+        self, name: str, event_dict: Dict[str, Any], profiler: FormatterProfiler
+    ) -> str:
+        """Same as calling the formatter but measures the time spent in each stage"""
+        timer = StageTimer()
+        output = self._json_dumps(self._event_dict_to_ecs(name, event_dict, timer))
+        timer.mark("encode")
+        profiler.add(timer.stages)
+        return output
 
     def format_to_ecs(self, event_dict: Dict[str, Any]) -> Dict[str, Any]:
         if "@timestamp" not in event_dict:
-            event_dict["@timestamp"] = (
-                datetime.datetime.fromtimestamp(
-                    time.time(), tz=datetime.timezone.utc
-                ).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
-                + "Z"
-            )
+            event_dict["@timestamp"] = format_unix_timestamp(time.time())
 
         if "exception" in event_dict:
             stack_trace = event_dict.pop("exception")
@@ -62,4 +210,15 @@ class StructlogFormatter:
         return event_dict
 
     def _json_dumps(self, value: Dict[str, Any]) -> str:
-        return json_dumps(value=value, ensure_ascii=self.ensure_ascii)
+        if self._limits is not None:
+            return self._limits.dumps(
+                dict_field_paths(value), self._json_dumps_paths, self.ensure_ascii
+            )
+        return json_dumps(
+            value=value, ensure_ascii=self.ensure_ascii, json_backend=self.json_backend
+        )
+
+    def _json_dumps_paths(self, items: List[Tuple[FieldPath, Any]]) -> str:
+        return json_dumps_paths(
+            items, ensure_ascii=self.ensure_ascii, json_backend=self.json_backend
+        )
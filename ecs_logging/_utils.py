@@ -15,18 +15,70 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import collections
 import collections.abc
-import json
+import fnmatch
 import functools
-from typing import Any, Dict, Mapping
+import importlib
+import json
+import math
+import re
+import time
+from json.encoder import encode_basestring, encode_basestring_ascii
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 __all__ = [
     "normalize_dict",
     "de_dot",
     "merge_dicts",
     "json_dumps",
+    "json_dumps_bytes",
+    "json_dumps_dotted",
+    "format_timestamp",
 ]
 
+# Names of the supported JSON serialization backends
+JSON_BACKENDS = ("json", "orjson", "msgspec")
+
+# A field name split on its dots, ie "log.origin.function"
+# becomes ("log", "origin", "function")
+FieldPath = Tuple[str, ...]
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _memoize(function: _F) -> _F:
+    """Caches the results of a function with few distinct arguments. Unlike
+    'functools.lru_cache()' a lookup is a plain dict read which doesn't
+    lock, so threads don't contend on it on free-threaded builds. Threads
+    which miss at the same time compute the same result more than once.
+    """
+    results: Dict[Any, Any] = {}
+
+    @functools.wraps(function)
+    def wrapper(*args: Any) -> Any:
+        try:
+            return results[args]
+        except KeyError:
+            result = results[args] = function(*args)
+            return result
+
+    return cast(_F, wrapper)
+
 
 def flatten_dict(value: Mapping[str, Any]) -> Dict[str, Any]:
     """Adds dots to all nested fields in dictionaries.
@@ -52,22 +104,83 @@ def flatten_dict(value: Mapping[str, Any]) -> Dict[str, Any]:
     return top_level
 
 
-def normalize_dict(value: Dict[str, Any]) -> Dict[str, Any]:
-    """Expands all dotted names to nested dictionaries"""
+def normalize_dict(
+    value: Dict[str, Any], max_depth: Optional[int] = None
+) -> Dict[str, Any]:
+    """Expands all dotted names to nested dictionaries, in place. This
+    includes nested dictionaries and dictionaries within lists, down to
+    'max_depth' levels of nesting if given. Deeper values are kept as-is.
+    """
     if not isinstance(value, dict):
         return value
-    keys = list(value.keys())
-    for key in keys:
-        if "." in key:
-            merge_dicts(de_dot(key, value.pop(key)), value)
-    for key, val in value.items():
-        if isinstance(val, dict):
-            normalize_dict(val)
-        elif isinstance(val, list):
-            val[:] = [normalize_dict(x) for x in val]
+    stack = [(value, 0)]
+    while stack:
+        current, depth = stack.pop()
+        dotted = [key for key in current if isinstance(key, str) and "." in key]
+        for key in dotted:
+            _merge_path(current, _split_dotted_key(key), current.pop(key))
+        if max_depth is not None and depth >= max_depth:
+            continue
+        # Only containers can have dotted names below them
+        for val in current.values():
+            if isinstance(val, dict):
+                stack.append((val, depth + 1))
+            elif isinstance(val, list):
+                for item in val:
+                    if isinstance(item, dict):
+                        stack.append((item, depth + 1))
     return value
 
 
+# Split dotted names, which events reuse over and over again. It's a plain
+# dict rather than an LRU cache, so lookups don't reorder or lock anything,
+# and it's cleared once it holds '_DOTTED_KEYS_SIZE' names.
+_dotted_keys: Dict[str, FieldPath] = {}
+_DOTTED_KEYS_SIZE = 1024
+
+
+def _split_dotted_key(key: str) -> FieldPath:
+    path = _dotted_keys.get(key)
+    if path is None:
+        path = tuple(key.split("."))
+        if len(_dotted_keys) >= _DOTTED_KEYS_SIZE:
+            _dotted_keys.clear()
+        _dotted_keys[key] = path
+    return path
+
+
+def _merge_path(into: Dict[Any, Any], path: FieldPath, value: Any) -> None:
+    """Same as ``merge_dicts(de_dot(".".join(path), value), into)`` but
+    without building the intermediate dictionaries first.
+    """
+    node = into
+    for index in range(len(path) - 1):
+        key = path[index]
+        if key not in node:
+            child = node[key] = {}
+        else:
+            child = node[key]
+            if not isinstance(child, dict):
+                if child != {}:
+                    start = index + 1
+                    rest = ".".join(path[start:])
+                    raise _type_mismatch(key, child, de_dot(rest, value))
+                child = node[key] = {}
+        node = child
+
+    key = path[-1]
+    if key not in node:
+        node[key] = value
+        return
+    existing = node[key]
+    if isinstance(value, dict) and isinstance(existing, dict):
+        merge_dicts(value, existing)
+    elif existing != {}:
+        raise _type_mismatch(key, existing, value)
+    else:
+        node[key] = value
+
+
 def de_dot(dot_string: str, msg: Any) -> Dict[str, Any]:
     """Turn value and dotted string key into a nested dictionary"""
     arr = dot_string.split(".")
@@ -86,19 +199,335 @@ def merge_dicts(from_: Dict[Any, Any], into: Dict[Any, Any]) -> Dict[Any, Any]:
         if isinstance(value, dict) and isinstance(into[key], dict):
             merge_dicts(value, into[key])
         elif into[key] != {}:
-            raise TypeError(
-                "Type mismatch at key `{}`: merging dicts would replace value `{}` with `{}`. This is likely due to "
-                "dotted keys in the event dict being turned into nested dictionaries, causing a conflict.".format(
-                    key, into[key], value
-                )
-            )
+            raise _type_mismatch(key, into[key], value)
         else:
             into[key] = value
     return into
 
 
-def json_dumps(value: Dict[str, Any], ensure_ascii: bool = True) -> str:
+def _type_mismatch(key: Any, existing: Any, value: Any) -> TypeError:
+    return TypeError(
+        "Type mismatch at key `{}`: merging dicts would replace value `{}` with `{}`. This is likely due to "
+        "dotted keys in the event dict being turned into nested dictionaries, causing a conflict.".format(
+            key, existing, value
+        )
+    )
+
+
+class _MatcherNode:
+    __slots__ = ("children", "patterns", "matches", "matches_children")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_MatcherNode"] = {}
+        self.patterns: List[Tuple[str, "_MatcherNode"]] = []
+        self.matches = False
+        # Whether a '*' pattern matches all children of this node
+        self.matches_children = False
+
+
+# The nodes of a 'FieldMatcher' that the keys seen so far lead to. It's
+# empty when no field below can match and 'None' when one already did.
+MatcherState = Optional[Tuple[_MatcherNode, ...]]
+
+
+class FieldMatcher:
+    """Prefix trie of dotted field names, which matches a field path if
+    one of the names is the path itself or one of its prefixes. Name parts
+    can contain ``*`` wildcards, ie ``http.request.headers.*`` matches
+    every header but not the ``http.request.headers`` field itself.
+    """
+
+    def __init__(self, fields: Iterable[str]) -> None:
+        self._root = _MatcherNode()
+        self._empty = True
+        for field in fields:
+            node = self._root
+            for part in field.split("."):
+                if "*" in part:
+                    for pattern, child in node.patterns:
+                        if pattern == part:
+                            break
+                    else:
+                        child = _MatcherNode()
+                        node.patterns.append((part, child))
+                else:
+                    child = node.children.setdefault(part, _MatcherNode())
+                parent, node = node, child
+            node.matches = True
+            if part == "*":
+                parent.matches_children = True
+            self._empty = False
+
+    def __bool__(self) -> bool:
+        return not self._empty
+
+    @property
+    def initial_state(self) -> MatcherState:
+        return (self._root,) if not self._empty else ()
+
+    def advance(self, state: MatcherState, keys: Iterable[str]) -> MatcherState:
+        """Returns the state after following 'keys' from 'state'"""
+        for key in keys:
+            if not state:
+                return state
+            nodes: List[_MatcherNode] = []
+            for node in state:
+                child = node.children.get(key)
+                if child is not None:
+                    if child.matches:
+                        return None
+                    nodes.append(child)
+                for pattern, child in node.patterns:
+                    if pattern == "*" or fnmatch.fnmatchcase(key, pattern):
+                        if child.matches:
+                            return None
+                        nodes.append(child)
+            state = tuple(nodes)
+        return state
+
+    def matches(self, path: Iterable[str]) -> bool:
+        return self.advance(self.initial_state, path) is None
+
+    def matches_children(self, state: MatcherState) -> bool:
+        """Returns whether all fields below the state match"""
+        return state is not None and any(node.matches_children for node in state)
 
+    def prune(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a nested dictionary without the matching fields. Nested
+        dictionaries are only copied if fields below them could match, and
+        the ones which only contained matching fields are removed.
+        """
+        if self._empty:
+            return value
+        return self._prune(value, self.initial_state)
+
+    def _prune(self, value: Dict[str, Any], state: MatcherState) -> Dict[str, Any]:
+        result = {}
+        for key, child in value.items():
+            child_state = self.advance(state, str(key).split("."))
+            if child_state is None:
+                continue
+            if child_state and isinstance(child, dict) and child:
+                if self.matches_children(child_state):
+                    continue
+                child = self._prune(child, child_state)
+                if not child:
+                    continue
+            result[key] = child
+        return result
+
+    def select(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a nested dictionary with only the matching fields, the
+        opposite of 'prune()'. Values of matching fields are kept as a
+        whole, dictionaries without matching fields below are removed.
+        """
+        return self._select(value, self.initial_state)
+
+    def _select(self, value: Dict[str, Any], state: MatcherState) -> Dict[str, Any]:
+        result = {}
+        for key, child in value.items():
+            child_state = self.advance(state, str(key).split("."))
+            if child_state is None:
+                result[key] = child
+            elif child_state and isinstance(child, dict) and child:
+                if not self.matches_children(child_state):
+                    child = self._select(child, child_state)
+                if child:
+                    result[key] = child
+        return result
+
+
+def add_field_paths(
+    items: List[Tuple[FieldPath, Any]],
+    path: FieldPath,
+    value: Any,
+    exclude: Optional[FieldMatcher] = None,
+) -> None:
+    """Appends ``(path, value)`` pairs for all leaves of 'value' to 'items'.
+    Nested mappings and dotted keys within them are expanded into
+    their own paths, ``None`` values are skipped. Fields matched
+    by 'exclude' are skipped without expanding them.
+    """
+    if exclude:
+        state = exclude.advance(exclude.initial_state, path)
+        if state is not None:
+            _add_unmatched_field_paths(items, path, value, exclude, state)
+    elif isinstance(value, collections.abc.Mapping):
+        for key, val in value.items():
+            add_field_paths(items, path + tuple(str(key).split(".")), val)
+    elif value is not None:
+        items.append((path, value))
+
+
+def _add_unmatched_field_paths(
+    items: List[Tuple[FieldPath, Any]],
+    path: FieldPath,
+    value: Any,
+    exclude: FieldMatcher,
+    state: MatcherState,
+) -> None:
+    if not state:
+        # Nothing below this path can be excluded
+        add_field_paths(items, path, value)
+    elif isinstance(value, collections.abc.Mapping):
+        if exclude.matches_children(state):
+            return
+        for key, val in value.items():
+            keys = tuple(str(key).split("."))
+            child_state = exclude.advance(state, keys)
+            if child_state is not None:
+                _add_unmatched_field_paths(
+                    items, path + keys, val, exclude, child_state
+                )
+    elif value is not None:
+        items.append((path, value))
+
+
+def dict_field_paths(
+    value: Mapping[str, Any], path: FieldPath = ()
+) -> List[Tuple[FieldPath, Any]]:
+    """Returns the ``(path, value)`` pairs of the leaves of nested dictionaries
+    without splitting their keys, 'json_dumps_paths()' of them serializes the
+    same as 'json_dumps()' of the dictionaries. Empty dictionaries, ones with
+    non-string keys and the fields that go first are kept as values.
+    """
+    items: List[Tuple[FieldPath, Any]] = []
+    for key, val in value.items():
+        child = path + (key,)
+        if (
+            isinstance(val, dict)
+            and val
+            and child not in _ORDERED_FIELDS
+            and all(isinstance(k, str) for k in val)
+        ):
+            items.extend(dict_field_paths(val, child))
+        else:
+            items.append((child, val))
+    return items
+
+
+def nest_field_paths(items: Iterable[Tuple[FieldPath, Any]]) -> Dict[str, Any]:
+    """Builds the nested dictionary for ``(path, value)`` pairs. Raises
+    the same error as 'merge_dicts()' if a path is used more than once
+    or if a value is stored where another path expects an object.
+    """
+    result: Dict[str, Any] = {}
+    for path, value in items:
+        node = result
+        for key in path[:-1]:
+            child = node.setdefault(key, {})
+            if not isinstance(child, dict):
+                raise _type_mismatch(key, child, value)
+            node = child
+        key = path[-1]
+        if key in node:
+            raise _type_mismatch(key, node[key], value)
+        node[key] = value
+    return result
+
+
+class LRUCache:
+    """Bounded mapping which evicts the least recently used entry. Entries
+    may be looked up and added from multiple threads, losing an entry to
+    a concurrent eviction only results in a cache miss.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: "collections.OrderedDict[Any, Any]" = collections.OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        data = self._data
+        try:
+            value = data[key]
+            data.move_to_end(key)
+        except KeyError:
+            return default
+        return value
+
+    def set(self, key: Any, value: Any) -> Optional[Tuple[Any, Any]]:
+        """Adds an entry and returns the one that was evicted, if any"""
+        data = self._data
+        data[key] = value
+        if len(data) > self.maxsize:
+            try:
+                return data.popitem(last=False)
+            except KeyError:
+                pass
+        return None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SharedCache:
+    """Bounded mapping for caches which many threads read from. Lookups
+    never modify the cache, so threads don't contend on them, also not
+    on free-threaded builds. When it's full the oldest entry is evicted.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: Dict[Any, Any] = {}
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def set(self, key: Any, value: Any) -> None:
+        data = self._data
+        data[key] = value
+        if len(data) > self.maxsize:
+            try:
+                data.pop(next(iter(data)), None)
+            except (RuntimeError, StopIteration):
+                # Changed by another thread, which evicts instead
+                pass
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# The last second rendered by 'format_timestamp()' and its formatted
+# '%Y-%m-%dT%H:%M:%S' prefix. The tuple is always replaced as a whole
+# so that threads never see a second paired with another's prefix.
+_timestamp_prefix: Tuple[int, str] = (-1, "")
+
+
+def format_timestamp(seconds: int, milliseconds: float) -> str:
+    """Formats a UTC timestamp as '%Y-%m-%dT%H:%M:%S.%03dZ'. The prefix is
+    cached per second so that only the milliseconds are formatted for
+    most calls.
+    """
+    global _timestamp_prefix
+    cached_seconds, prefix = _timestamp_prefix
+    if cached_seconds != seconds:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+        _timestamp_prefix = (seconds, prefix)
+    return "%s.%03dZ" % (prefix, milliseconds)
+
+
+def format_unix_timestamp(timestamp: float) -> str:
+    """Formats seconds since the epoch with 'format_timestamp()'. Rounds
+    to microseconds first like 'datetime.datetime.fromtimestamp()' does.
+    """
+    fraction, seconds = math.modf(timestamp)
+    microseconds = round(fraction * 1_000_000)
+    if microseconds >= 1_000_000:
+        microseconds -= 1_000_000
+        seconds += 1
+    elif microseconds < 0:
+        microseconds += 1_000_000
+        seconds -= 1
+    return format_timestamp(int(seconds), microseconds // 1000)
+
+
+def _pop_ordered_fields(value: Dict[str, Any]) -> List[Tuple[str, Any]]:
     # Ensure that the first three fields are '@timestamp',
     # 'log.level', and 'message' per ECS spec
     ordered_fields = []
@@ -121,14 +550,14 @@ def json_dumps(value: Dict[str, Any], ensure_ascii: bool = True) -> str:
         ordered_fields.append(("message", value.pop("message")))
     except KeyError:
         pass
+    return ordered_fields
 
-    json_dumps = functools.partial(
-        json.dumps,
-        sort_keys=True,
-        separators=(",", ":"),
-        default=_json_dumps_fallback,
-        ensure_ascii=ensure_ascii,
-    )
+
+def json_dumps(
+    value: Dict[str, Any], ensure_ascii: bool = True, json_backend: str = "json"
+) -> str:
+    ordered_fields = _pop_ordered_fields(value)
+    json_dumps = _document_encoder(json_backend, ensure_ascii)
 
     # Because we want to use 'sorted_keys=True' we manually build
     # the first three keys and then build the rest with json.dumps()
@@ -150,6 +579,45 @@ def json_dumps(value: Dict[str, Any], ensure_ascii: bool = True) -> str:
         return json_dumps(value)
 
 
+def json_dumps_bytes(
+    value: Dict[str, Any], ensure_ascii: bool = True, json_backend: str = "json"
+) -> bytes:
+    """Same as 'json_dumps()' but returns UTF-8 encoded JSON. Backends
+    that serialize to bytes natively don't need to decode their output.
+    """
+    ordered_fields = _pop_ordered_fields(value)
+    json_dumps = _document_bytes_encoder(json_backend, ensure_ascii)
+
+    if ordered_fields:
+        ordered_json = b",".join(
+            b'"%s":%s' % (k.encode("ascii"), json_dumps(v)) for k, v in ordered_fields
+        )
+        if value:
+            return b"{%s,%s" % (ordered_json, json_dumps(value)[1:])
+        else:
+            return b"{%s}" % ordered_json
+    else:
+        return json_dumps(value)
+
+
+def write_into(buffer: Union[bytearray, memoryview], data: bytes) -> int:
+    """Writes 'data' into a caller-owned buffer and returns the number of
+    bytes written. A 'bytearray' is extended, any other writable buffer
+    is filled from its start and must be large enough to hold 'data'.
+    """
+    if isinstance(buffer, bytearray):
+        buffer += data
+        return len(data)
+    view = memoryview(buffer).cast("B")
+    if len(data) > view.nbytes:
+        raise ValueError(
+            f"Buffer is too small, {len(data)} bytes are needed "
+            f"but only {view.nbytes} are available"
+        )
+    view[: len(data)] = data
+    return len(data)
+
+
 def _json_dumps_fallback(value: Any) -> Any:
     """
     Fallback handler for json.dumps to handle objects json doesn't know how to
@@ -160,3 +628,631 @@ def _json_dumps_fallback(value: Any) -> Any:
         return value.__structlog__()
     except AttributeError:
         return repr(value)
+
+
+# Fields that must be the first three keys in every
+# document per the ECS logging spec, in this order.
+_ORDERED_FIELDS: Dict[FieldPath, str] = {
+    ("@timestamp",): '"@timestamp":',
+    ("log", "level"): '"log.level":',
+    ("message",): '"message":',
+}
+_path_of = itemgetter(0)
+
+
+def resolve_json_backend(json_backend: str) -> str:
+    """Validates the name of a JSON backend and resolves ``"auto"``
+    to the fastest one that is installed, falling back to ``"json"``.
+    """
+    if json_backend == "auto":
+        for candidate in ("orjson", "msgspec"):
+            try:
+                importlib.import_module(candidate)
+            except ImportError:
+                continue
+            return candidate
+        return "json"
+    if json_backend not in JSON_BACKENDS:
+        raise ValueError(
+            "'json_backend' must be one of: 'auto', %s"
+            % ", ".join(repr(name) for name in JSON_BACKENDS)
+        )
+    if json_backend != "json":
+        try:
+            importlib.import_module(json_backend)
+        except ImportError:
+            raise ImportError(
+                f"'json_backend={json_backend!r}' requires the "
+                f"'{json_backend}' package to be installed"
+            ) from None
+    return json_backend
+
+
+def _is_plain_json(value: Any) -> bool:
+    """Returns whether a value only consists of types which orjson and
+    msgspec serialize exactly like 'json' does. Other values, ie UUIDs,
+    enums, datetimes, non-finite floats or floats written with exponents,
+    are serialized natively by the backends, but by 'json' through the
+    fallback or with different notation.
+    """
+    value_type = type(value)
+    if value_type is str or value_type is int or value_type is bool or value is None:
+        return True
+    elif value_type is float:
+        # Python writes exponents as 'e+16' and 'e-05', the backends as
+        # 'e16' and 'e-5'. Comparisons with NaN are always false.
+        return value == 0.0 or 1e-4 <= abs(value) < 1e16  # type: ignore[no-any-return]
+    elif value_type is dict:
+        for key, item in value.items():
+            if type(key) is not str or not _is_plain_json(item):
+                return False
+        return True
+    elif value_type is list or value_type is tuple:
+        for item in value:
+            if not _is_plain_json(item):
+                return False
+        return True
+    return False
+
+
+def _escape_non_ascii(match: "re.Match[str]") -> str:
+    # Same escaping as 'json' does with 'ensure_ascii=True'
+    code = ord(match.group())
+    if code < 0x10000:
+        return "\\u%04x" % code
+    code -= 0x10000
+    return "\\u%04x\\u%04x" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+
+
+_NON_ASCII_RE = re.compile("[^\x00-\x7e]")
+
+
+def _backend_encoder(json_backend: str) -> Optional[Callable[[Any], bytes]]:
+    """Returns the function of a backend that serializes values for which
+    '_is_plain_json()' is true to bytes, or ``None`` for the 'json' module.
+    """
+    if json_backend == "json":
+        return None
+
+    if json_backend == "orjson":
+        import orjson
+
+        def encode(value: Any) -> bytes:
+            return orjson.dumps(  # type: ignore[no-any-return]
+                value, option=orjson.OPT_SORT_KEYS
+            )
+
+    elif json_backend == "msgspec":
+        import msgspec
+
+        def encode(value: Any) -> bytes:
+            return msgspec.json.encode(  # type: ignore[no-any-return]
+                value, order="sorted"
+            )
+
+    else:
+        raise ValueError(f"Unknown JSON backend {json_backend!r}")
+    return encode
+
+
+@_memoize
+def _document_encoder(json_backend: str, ensure_ascii: bool) -> Callable[[Any], str]:
+    """Returns a function that serializes any value like 'json.dumps()'
+    with sorted keys and compact separators using the given backend.
+    """
+    if json_backend == "json":
+        return json.JSONEncoder(
+            sort_keys=True,
+            separators=(",", ":"),
+            default=_json_dumps_fallback,
+            ensure_ascii=ensure_ascii,
+        ).encode
+
+    encode_bytes = _document_bytes_encoder(json_backend, ensure_ascii)
+
+    def encode(value: Any) -> str:
+        return encode_bytes(value).decode("utf-8")
+
+    return encode
+
+
+@_memoize
+def _document_bytes_encoder(
+    json_backend: str, ensure_ascii: bool
+) -> Callable[[Any], bytes]:
+    """Same as '_document_encoder()' but returns UTF-8 encoded JSON"""
+    stdlib_encode = _document_encoder("json", ensure_ascii)
+    backend_encode = _backend_encoder(json_backend)
+
+    if backend_encode is None:
+
+        def encode(value: Any) -> bytes:
+            return stdlib_encode(value).encode("utf-8")
+
+        return encode
+
+    def encode_with_backend(value: Any) -> bytes:
+        if not _is_plain_json(value):
+            return stdlib_encode(value).encode("utf-8")
+        try:
+            data = backend_encode(value)  # type: ignore[misc]
+        except (TypeError, ValueError, OverflowError):
+            # Integers beyond 64 bits are left to the 'json' module
+            return stdlib_encode(value).encode("utf-8")
+        # Neither backend escapes non-ASCII characters. Everything that
+        # 'json' escapes below U+007F is escaped by the backends too.
+        if ensure_ascii and (not data.isascii() or b"\x7f" in data):
+            text = _NON_ASCII_RE.sub(_escape_non_ascii, data.decode("utf-8"))
+            return text.encode("ascii")
+        return data
+
+    return encode_with_backend
+
+
+@_memoize
+def _value_encoder(json_backend: str, ensure_ascii: bool) -> Callable[[Any], str]:
+    """Returns a function that encodes a single value exactly like
+    'json_dumps()' would, with shortcuts for the common scalar types.
+    Scalars always use the 'json' module to keep the output identical
+    between backends, the backend is used for containers and objects.
+    """
+    encode_str = encode_basestring_ascii if ensure_ascii else encode_basestring
+    encode_scalar = _document_encoder("json", ensure_ascii)
+    encode_any = _document_encoder(json_backend, ensure_ascii)
+
+    def encode(value: Any) -> str:
+        value_type = type(value)
+        if value_type is str:
+            return encode_str(value)  # type: ignore[no-any-return]
+        elif value_type is RawJSON:
+            return value  # type: ignore[no-any-return]
+        elif value_type is int:
+            return int.__repr__(value)
+        elif value is None:
+            return "null"
+        elif value_type is bool:
+            return "true" if value else "false"
+        elif value_type is float:
+            return encode_scalar(value)
+        return encode_any(value)
+
+    return encode
+
+
+class RawJSON(str):
+    """A value which is already serialized, 'json_dumps_paths()' writes it as-is"""
+
+    __slots__ = ()
+
+
+def _raw_value(value: Any) -> Any:
+    """Returns the value of serialized JSON for error messages"""
+    if type(value) is RawJSON:
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class EncodedFields:
+    """``(path, value)`` pairs which are serialized once and then added to
+    many documents by 'json_dumps_paths()'. The fields of a top-level key
+    are written as a single fragment unless the document has fields under
+    the same key, then they're merged using their serialized values.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[Tuple[FieldPath, Any]],
+        ensure_ascii: bool = True,
+        json_backend: str = "json",
+    ) -> None:
+        self.ensure_ascii = ensure_ascii
+        self.json_backend = json_backend
+
+        encode = _value_encoder(json_backend, ensure_ascii)
+        self.groups: Dict[str, List[Tuple[FieldPath, Any]]] = {}
+        self.paths: Set[FieldPath] = set()
+        for path, value in items:
+            self.paths.add(path)
+            self.groups.setdefault(path[0], []).append((path, RawJSON(encode(value))))
+
+        # Groups with one of the fields that go first are always merged
+        fragments = []
+        self.merged: Set[str] = set()
+        for key, group in self.groups.items():
+            if any(path in _ORDERED_FIELDS for path, _ in group):
+                self.merged.add(key)
+            else:
+                encoded = json_dumps_paths(list(group), ensure_ascii, json_backend)
+                fragments.append((key, encoded[1:-1]))
+        self.fragments = sorted(fragments)
+
+    def with_fields(self, items: Iterable[Tuple[FieldPath, Any]]) -> "EncodedFields":
+        """Returns a copy with more fields, the existing fields
+        aren't serialized again.
+        """
+        fields = [item for group in self.groups.values() for item in group]
+        fields.extend(items)
+        return EncodedFields(fields, self.ensure_ascii, self.json_backend)
+
+
+class ContextFields:
+    """``(path, value)`` pairs of a context, ie the active span or the fields
+    bound with 'bind()', which are added to all records logged in it. They're
+    serialized once along with the fields of each 'EncodedFields'.
+    """
+
+    __slots__ = ("fields", "paths", "keys", "_encoded", "_filtered")
+
+    def __init__(self, fields: List[Tuple[FieldPath, Any]]) -> None:
+        self.fields = fields
+        self.paths = frozenset(path for path, _ in fields)
+        self.keys = frozenset(path[0] for path in self.paths)
+        self._encoded: Dict[EncodedFields, EncodedFields] = {}
+        self._filtered: Dict[FieldMatcher, ContextFields] = {}
+
+    def overlaps(self, items: Iterable[Tuple[FieldPath, Any]]) -> bool:
+        """Returns whether any of the fields are among 'items'"""
+        keys = self.keys
+        paths = self.paths
+        return any(path[0] in keys and path in paths for path, _ in items)
+
+    def add_missing(
+        self, fields: List[Tuple[FieldPath, Any]], given: Iterable[FieldPath] = ()
+    ) -> None:
+        """Adds the fields which aren't in 'fields' or 'given'"""
+        given = set(given)
+        if given or self.overlaps(fields):
+            given.update(path for path, _ in fields)
+            fields.extend(item for item in self.fields if item[0] not in given)
+        else:
+            fields.extend(self.fields)
+
+    def set_defaults(self, event_dict: Dict[str, Any]) -> None:
+        """Adds the fields to a nested event dict unless they're given"""
+        for path, value in self.fields:
+            node = event_dict
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+                if not isinstance(node, dict):
+                    break
+            else:
+                node.setdefault(path[-1], value)
+
+    def encoded(self, base: EncodedFields) -> EncodedFields:
+        """Returns the fields serialized along with the ones of 'base',
+        which take precedence over fields with the same path.
+        """
+        encoded = self._encoded.get(base)
+        if encoded is None:
+            given = base.paths
+            encoded = self._encoded[base] = base.with_fields(
+                item for item in self.fields if item[0] not in given
+            )
+        return encoded
+
+    def filtered(self, exclude: FieldMatcher) -> "ContextFields":
+        """Returns the fields which aren't matched by 'exclude'"""
+        if not exclude:
+            return self
+        filtered = self._filtered.get(exclude)
+        if filtered is None:
+            filtered = ContextFields(
+                [item for item in self.fields if not exclude.matches(item[0])]
+            )
+            self._filtered[exclude] = filtered
+        return filtered
+
+
+def json_dumps_paths(
+    items: List[Tuple[FieldPath, Any]],
+    ensure_ascii: bool = True,
+    json_backend: str = "json",
+    encoded: Optional[EncodedFields] = None,
+) -> str:
+    """Serializes ``(path, value)`` pairs straight into nested JSON without
+    building the intermediate dictionaries. As long as no value is a
+    dictionary, it produces the same output as
+    'json_dumps(nest_field_paths(items))', including the conflict errors.
+    Unlike 'nest_field_paths()' a dictionary value isn't merged with the
+    paths within it, they conflict instead.
+    'items' is sorted in place.
+
+    The fields of 'encoded' are added to the document, it has to be
+    created with the same 'ensure_ascii' and 'json_backend'.
+    """
+    encode = _value_encoder(json_backend, ensure_ascii)
+    encode_key = encode_basestring_ascii if ensure_ascii else encode_basestring
+
+    fragments: List[Tuple[str, str]] = []
+    if encoded is not None:
+        groups = encoded.groups
+        merged = {path[0] for path, _ in items if path[0] in groups}
+        merged.update(encoded.merged)
+        for key in merged:
+            items.extend(groups[key])
+        for key, fragment in encoded.fragments:
+            if key not in merged:
+                fragments.append((key, fragment))
+    fragment_index = 0
+
+    # Sorting the paths gives the same key order as 'sort_keys=True'
+    # and places all paths sharing a prefix next to each other.
+    items.sort(key=_path_of)
+
+    ordered: Dict[FieldPath, str] = {}
+    out: List[str] = []
+    opened: FieldPath = ()  # Objects which are currently open
+    comma = False
+    prev_path: FieldPath = ()
+    prev_size = 0
+    prev_value: Any = None
+
+    for path, value in items:
+        # Sorting places a path right after any of its prefixes, if the
+        # previous path is one then a value would be used as an object.
+        if prev_size and path[:prev_size] == prev_path:
+            raise _type_mismatch(
+                ".".join(prev_path), _raw_value(prev_value), _raw_value(value)
+            )
+        prev_path = path
+        prev_size = len(path)
+        prev_value = value
+
+        if path in _ORDERED_FIELDS:
+            ordered[path] = _ORDERED_FIELDS[path] + encode(value)
+            continue
+
+        # Encoded fragments go between the top-level keys around them
+        while (
+            fragment_index < len(fragments) and fragments[fragment_index][0] < path[0]
+        ):
+            if opened:
+                out.append("}" * len(opened))
+                opened = ()
+            if comma:
+                out.append(",")
+            out.append(fragments[fragment_index][1])
+            fragment_index += 1
+            comma = True
+
+        parent = path[:-1]
+        if parent != opened:
+            # Close the objects that aren't shared with this
+            # path and open the ones that it needs instead.
+            same = 0
+            for opened_key, key in zip(opened, parent):
+                if opened_key != key:
+                    break
+                same += 1
+            if same < len(opened):
+                out.append("}" * (len(opened) - same))
+                comma = True
+            for key in parent[same:]:
+                if comma:
+                    out.append(",")
+                out.append(encode_key(key))
+                out.append(":{")
+                comma = False
+            opened = parent
+
+        if comma:
+            out.append(",")
+        out.append(encode_key(path[-1]))
+        out.append(":")
+        out.append(encode(value))
+        comma = True
+
+    if opened:
+        out.append("}" * len(opened))
+    for _, fragment in fragments[fragment_index:]:
+        if comma:
+            out.append(",")
+        out.append(fragment)
+        comma = True
+
+    head = ",".join(ordered[path] for path in _ORDERED_FIELDS if path in ordered)
+    if head and out:
+        return "{%s,%s}" % (head, "".join(out))
+    return "{%s%s}" % (head, "".join(out))
+
+
+def json_dumps_dotted(
+    fields: Mapping[str, Any], ensure_ascii: bool = True, json_backend: str = "json"
+) -> str:
+    """Serializes a flat mapping of dotted field names into nested JSON,
+    ie ``{"log.logger": "app", "log.origin.function": "f"}`` is written
+    as ``{"log":{"logger":"app","origin":{"function":"f"}}}``.
+
+    This is equivalent to merging 'de_dot()' of every field with
+    'merge_dicts()' and calling 'json_dumps()' on the result.
+    """
+    items: List[Tuple[FieldPath, Any]] = []
+    for field, value in fields.items():
+        add_field_paths(items, tuple(field.split(".")), value)
+    return json_dumps_paths(items, ensure_ascii=ensure_ascii, json_backend=json_backend)
+
+
+# Appended to strings which were cut to fit a size limit
+TRUNCATION_MARKER = "..."
+
+# Lists the names of the fields which were truncated
+TRUNCATED_FIELD: FieldPath = ("log", "truncated")
+
+# Fields which are never truncated to fit a size limit
+_UNLIMITED_FIELDS = frozenset(
+    {("@timestamp",), ("log", "level"), ("ecs.version",), TRUNCATED_FIELD}
+)
+
+# Types which are serialized natively, other values become their fallback
+_NATIVE_TYPES = (str, int, float, list, tuple, dict, type(None))
+
+
+def _truncatable_text(value: Any) -> Optional[str]:
+    """Returns the text that 'value' is serialized as if it can be truncated"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, _NATIVE_TYPES):
+        return None
+    text = _json_dumps_fallback(value)
+    return text if isinstance(text, str) else None
+
+
+def _utf8_size(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+class FieldLimits:
+    """Limits the size of documents serialized from ``(path, value)`` pairs.
+
+    Strings longer than 'max_field_length' characters are cut to that length
+    and end with ``...``. If the UTF-8 encoded document is still larger than
+    'max_bytes', the longest strings are cut to the same length until it
+    fits and other fields which are longer than that are dropped. Objects
+    serialized with their ``repr()`` count as strings. The names of all
+    truncated and dropped fields are listed in the ``log.truncated`` field
+    if 'mark' is set. The fields in 'unlimited' are never truncated, like
+    ``@timestamp``, ``log.level`` and ``ecs.version``.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_field_length: Optional[int] = None,
+        mark: bool = True,
+        unlimited: Iterable[FieldPath] = (),
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_field_length = max_field_length
+        self.mark = mark
+        self._unlimited = _UNLIMITED_FIELDS.union(unlimited)
+
+    def dumps(
+        self,
+        items: List[Tuple[FieldPath, Any]],
+        dumps: Callable[[List[Tuple[FieldPath, Any]]], str],
+        ensure_ascii: bool = True,
+    ) -> str:
+        """Serializes 'items' with 'dumps' within the limits. 'dumps' always
+        gets a new list which it can change, 'ensure_ascii' has to be the same
+        as for 'dumps'.
+        """
+        truncated: Set[FieldPath] = set()
+        limit = self.max_field_length
+        if limit is not None:
+            limited = []
+            for path, value in items:
+                text = _truncatable_text(value)
+                if (
+                    text is not None
+                    and len(text) > limit
+                    and path not in self._unlimited
+                ):
+                    value = text[:limit] + TRUNCATION_MARKER
+                    truncated.add(path)
+                limited.append((path, value))
+            items = limited
+
+        output = self._dumps_marked(items, truncated, dumps)
+        if self.max_bytes is None:
+            return output
+        excess = _utf8_size(output) - self.max_bytes
+        while excess > 0:
+            shrunk = self._shrink(items, excess, truncated, ensure_ascii)
+            if shrunk is None:
+                # Only fields which can't be truncated are left
+                break
+            items = shrunk
+            output = self._dumps_marked(items, truncated, dumps)
+            excess = _utf8_size(output) - self.max_bytes
+        return output
+
+    def _dumps_marked(
+        self,
+        items: List[Tuple[FieldPath, Any]],
+        truncated: Set[FieldPath],
+        dumps: Callable[[List[Tuple[FieldPath, Any]]], str],
+    ) -> str:
+        if not (truncated and self.mark):
+            return dumps(list(items))
+        marked = [item for item in items if item[0] != TRUNCATED_FIELD]
+        marked.append((TRUNCATED_FIELD, sorted(".".join(p) for p in truncated)))
+        return dumps(marked)
+
+    def _shrink(
+        self,
+        items: List[Tuple[FieldPath, Any]],
+        excess: int,
+        truncated: Set[FieldPath],
+        ensure_ascii: bool,
+    ) -> Optional[List[Tuple[FieldPath, Any]]]:
+        """Returns 'items' with at least 'excess' bytes removed, or as many
+        as possible. Strings are cut to the same length and other fields are
+        dropped if they're longer than that. Returns ``None`` if nothing can
+        be removed anymore.
+        """
+        marker_size = len(TRUNCATION_MARKER)
+        encode = _document_encoder("json", ensure_ascii)
+        encode_str = encode_basestring_ascii if ensure_ascii else encode_basestring
+        texts: Dict[int, str] = {}
+        # Average number of bytes per character of every string
+        weights: Dict[int, float] = {}
+        # Sizes of other values and the size saved by dropping them
+        others: Dict[int, Tuple[int, int]] = {}
+        for index, (path, value) in enumerate(items):
+            if path in self._unlimited:
+                continue
+            text = _truncatable_text(value)
+            if text is not None:
+                if len(text) > marker_size:
+                    texts[index] = text
+                    weights[index] = (_utf8_size(encode_str(text)) - 2) / len(text)
+                continue
+            size = _utf8_size(encode(value))
+            saved = size + len(path[-1]) + 4
+            if self.mark and path not in truncated:
+                # Dropped fields are listed in 'log.truncated'
+                saved -= len(".".join(path)) + 3
+            if size > marker_size and saved > 0:
+                others[index] = (size, saved)
+        if not texts and not others:
+            return None
+
+        def removed(keep: int) -> float:
+            total = 0.0
+            for index, text in texts.items():
+                if len(text) > keep + marker_size:
+                    total += (len(text) - keep - marker_size) * weights[index]
+            for size, saved in others.values():
+                if size > keep + marker_size:
+                    total += saved
+            return total
+
+        # The most characters every string can keep while
+        # removing at least 'excess' characters in total.
+        low = 0
+        high = max(
+            [len(text) for text in texts.values()]
+            + [size for size, _ in others.values()]
+        )
+        while low < high:
+            keep = (low + high + 1) // 2
+            if removed(keep) >= excess:
+                low = keep
+            else:
+                high = keep - 1
+
+        shrunk: List[Tuple[FieldPath, Any]] = []
+        for index, (path, value) in enumerate(items):
+            if index in texts:
+                text = texts[index]
+                if len(text) > low + marker_size:
+                    value = text[:low] + TRUNCATION_MARKER
+                    truncated.add(path)
+            elif index in others and others[index][0] > low + marker_size:
+                truncated.add(path)
+                continue
+            shrunk.append((path, value))
+        return shrunk
@@ -15,9 +15,14 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import glob
+import os
+
 import nox
 
-SOURCE_FILES = ("noxfile.py", "tests/", "ecs_logging/")
+SOURCE_FILES = ("noxfile.py", "tests/", "ecs_logging/", "benchmarks/")
+# Benchmark results depend on the machine, so they're not committed
+BENCHMARK_STORAGE = "benchmarks/.baselines"
 
 
 def tests_impl(session):
@@ -60,3 +65,38 @@ def lint(session):
         "--no-warn-unused-ignores",
         "ecs_logging/",
     )
+
+
+@nox.session
+def benchmark(session):
+    """Runs the benchmarks and compares them with the stored baseline, failing
+    if the median of any benchmark regressed by more than 10%. The first run
+    stores the baseline, run 'nox -s benchmark -- --benchmark-save=baseline'
+    on the commit to compare against to replace it.
+    """
+    session.install(".[develop]", "pytest-benchmark")
+    args = [
+        "pytest",
+        "benchmarks/",
+        "--benchmark-only",
+        f"--benchmark-storage={BENCHMARK_STORAGE}",
+        "--benchmark-sort=name",
+        "--benchmark-columns=min,median,mean,stddev,rounds",
+    ]
+    if session.posargs:
+        args.extend(session.posargs)
+    elif glob.glob(os.path.join(BENCHMARK_STORAGE, "*", "*_baseline.json")):
+        args.extend(["--benchmark-compare", "--benchmark-compare-fail=median:10%"])
+    else:
+        session.log("No stored baseline, saving this run as the baseline")
+        args.append("--benchmark-save=baseline")
+    session.run(*args)
+
+
+@nox.session(python=["3.14", "3.14t"])
+def thread_scaling(session):
+    """Measures how the formatters scale when they're shared by threads,
+    compare the results of the free-threaded build with the default one.
+    """
+    session.install(".")
+    session.run("python", "benchmarks/thread_scaling.py", *session.posargs)
@@ -20,10 +20,15 @@ import datetime
 import json
 import logging
 import os
+import random
+import time
+from io import StringIO
 
 import elasticapm
 import pytest
 
+import ecs_logging
+
 
 class ValidationError(Exception):
     pass
@@ -81,6 +86,34 @@ def spec_validator():
     return validator
 
 
+@pytest.fixture(scope="function")
+def logger():
+    logger = logging.getLogger(f"test-logger-{time.time():f}-{random.random():f}")
+    logger.setLevel(logging.DEBUG)
+    yield logger
+    logger.handlers.clear()
+    logger.filters.clear()
+
+
+@pytest.fixture
+def add_handler(logger):
+    """Returns a function which adds a handler with a 'StdlibFormatter' and
+    'filters' to the 'logger' fixture, by default a stream handler which
+    writes to a 'StringIO'. The keyword arguments are the formatter's.
+    """
+
+    def add_handler(handler=None, filters=(), **kwargs):
+        if handler is None:
+            handler = logging.StreamHandler(StringIO())
+        handler.setFormatter(ecs_logging.StdlibFormatter(**kwargs))
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+        logger.addHandler(handler)
+        return handler
+
+    return add_handler
+
+
 @pytest.fixture
 def apm():
     record_factory = logging.getLogRecordFactory()
@@ -0,0 +1,241 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import json
+import logging
+from io import StringIO
+
+import mock
+import pytest
+
+import ecs_logging
+from ecs_logging._utils import EncodedFields
+
+
+@pytest.fixture(autouse=True)
+def unbind_all():
+    yield
+    ecs_logging.unbind()
+
+
+# Fields which change between runs
+EXCLUDE_FIELDS = ["@timestamp", "log", "process"]
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_bind_and_unbind():
+    ecs_logging.bind({"http.request.method": "GET"}, user={"id": "42", "name": None})
+    ecs_logging.bind({"url.path": "/"}, http={"request": {"method": "POST"}})
+    assert ecs_logging.bound_fields() == {
+        "http.request.method": "POST",
+        "url.path": "/",
+        "user.id": "42",
+    }
+
+    # Binding a field replaces the fields within it and the other way round
+    ecs_logging.bind(url="/index")
+    ecs_logging.bind({"user.id.type": "uuid"})
+    assert ecs_logging.bound_fields() == {
+        "http.request.method": "POST",
+        "url": "/index",
+        "user.id.type": "uuid",
+    }
+
+    ecs_logging.unbind("http", "user.id.type", "missing")
+    assert ecs_logging.bound_fields() == {"url": "/index"}
+    ecs_logging.unbind()
+    assert ecs_logging.bound_fields() == {}
+
+
+def test_bind_conflicting_fields():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.bind({"user": "42", "user.id": "42"})
+    assert str(e.value).startswith("Type mismatch at key `user`")
+    assert ecs_logging.bound_fields() == {}
+
+
+def test_bound_fields_are_added_to_records(logger, add_handler):
+    stream = add_handler(exclude_fields=EXCLUDE_FIELDS).stream
+    ecs_logging.bind({"http.request.method": "GET"}, user={"id": "42"})
+
+    with mock.patch.object(
+        EncodedFields, "with_fields", autospec=True, wraps=EncodedFields.with_fields
+    ) as with_fields:
+        logger.info("first")
+        logger.info("second", extra={"http.request.body.bytes": 1})
+        logger.info("third", extra={"user.id": "given"})
+    # The bound fields were serialized once for all records
+    assert with_fields.call_count == 1
+
+    assert lines(stream) == [
+        {
+            "ecs.version": "1.6.0",
+            "http": {"request": {"method": "GET"}},
+            "message": "first",
+            "user": {"id": "42"},
+        },
+        {
+            "ecs.version": "1.6.0",
+            "http": {"request": {"body": {"bytes": 1}, "method": "GET"}},
+            "message": "second",
+            "user": {"id": "42"},
+        },
+        {
+            "ecs.version": "1.6.0",
+            "http": {"request": {"method": "GET"}},
+            "message": "third",
+            "user": {"id": "given"},
+        },
+    ]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_same_output_as_extra(logger, ensure_ascii, add_handler):
+    fields = {"http.request.method": "GET", "url": {"path": "/ü"}, "user.id": 42}
+    stream = add_handler(
+        ensure_ascii=ensure_ascii, extra={"a": "b"}, exclude_fields=EXCLUDE_FIELDS
+    ).stream
+    logger.info("message", extra=fields)
+    ecs_logging.bind(fields)
+    logger.info("message")
+
+    extra, bound = stream.getvalue().splitlines()
+    assert bound == extra
+
+
+def test_exclude_fields_and_format_to_ecs(logger):
+    class Formatter(ecs_logging.StdlibFormatter):
+        def format_to_ecs(self, record):
+            result = super().format_to_ecs(record)
+            result["custom"] = True
+            return result
+
+    stream = StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        Formatter(exclude_fields=["@timestamp", "log", "process", "user.name"])
+    )
+    logger.addHandler(handler)
+    ecs_logging.bind(user={"id": "42", "name": "jane"})
+    logger.info("message")
+    ecs_logging.unbind("user.id")
+    logger.info("message")
+
+    assert lines(stream) == [
+        {
+            "custom": True,
+            "ecs.version": "1.6.0",
+            "message": "message",
+            "user": {"id": "42"},
+        },
+        {"custom": True, "ecs.version": "1.6.0", "message": "message"},
+    ]
+
+
+def test_bound_fields_take_precedence_over_span_fields(logger, add_handler):
+    class Correlation(ecs_logging.CorrelationProvider):
+        def current_key(self):
+            return "span"
+
+        def fields(self):
+            return {"trace.id": "t1", "span.id": "s1"}
+
+    stream = add_handler(
+        correlation=Correlation(), exclude_fields=EXCLUDE_FIELDS
+    ).stream
+    ecs_logging.bind({"trace.id": "bound"})
+    logger.info("message")
+
+    assert lines(stream) == [
+        {
+            "ecs.version": "1.6.0",
+            "message": "message",
+            "span": {"id": "s1"},
+            "trace": {"id": "bound"},
+        }
+    ]
+
+
+def test_global_extra_takes_precedence(logger):
+    formatter = ecs_logging.StdlibFormatter(extra={"service.name": "app"})
+    ecs_logging.bind({"service.name": "other", "service.version": "1.0"})
+    record = logging.LogRecord("name", logging.INFO, __file__, 1, "message", (), None)
+    expected = {"name": "app", "version": "1.0"}
+    assert json.loads(formatter.format(record))["service"] == expected
+    assert formatter.format_to_ecs(record)["service"] == expected
+
+    # Also when the record gives some of the bound fields
+    record.__dict__["service.version"] = "2.0"
+    expected = {"name": "app", "version": "2.0"}
+    assert json.loads(formatter.format(record))["service"] == expected
+    assert formatter.format_to_ecs(record)["service"] == expected
+
+
+def test_conflict_with_global_extra(logger):
+    formatter = ecs_logging.StdlibFormatter(extra={"service.name": "app"})
+    ecs_logging.bind(service="other")
+    record = logging.LogRecord("name", logging.INFO, __file__, 1, "message", (), None)
+    with pytest.raises(TypeError):
+        formatter.format(record)
+    with pytest.raises(TypeError):
+        formatter.format_to_ecs(record)
+
+
+def test_contexts_are_isolated(logger, add_handler):
+    stream = add_handler(exclude_fields=EXCLUDE_FIELDS).stream
+
+    async def handle(request_id):
+        ecs_logging.bind({"http.request.id": request_id})
+        await asyncio.sleep(0)
+        logger.info("request")
+
+    async def main():
+        await asyncio.gather(handle("1"), handle("2"))
+
+    asyncio.run(main())
+    logger.info("outside")
+
+    assert [line.get("http") for line in lines(stream)] == [
+        {"request": {"id": "1"}},
+        {"request": {"id": "2"}},
+        None,
+    ]
+
+
+def test_queue_handler_keeps_bound_fields(logger):
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(
+        ecs_logging.StdlibFormatter(exclude_fields=["@timestamp", "log", "process"])
+    )
+    handler = ecs_logging.QueueHandler(stream_handler)
+    logger.addHandler(handler)
+
+    ecs_logging.bind(user={"id": "42"})
+    logger.info("bound")
+    ecs_logging.unbind()
+    logger.info("unbound")
+    handler.close()
+
+    assert lines(stream) == [
+        {"ecs.version": "1.6.0", "message": "bound", "user": {"id": "42"}},
+        {"ecs.version": "1.6.0", "message": "unbound"},
+    ]
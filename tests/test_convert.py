@@ -0,0 +1,201 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+
+import mock
+import pytest
+
+import ecs_logging
+from ecs_logging import __main__ as cli
+from ecs_logging._convert import LineConverter
+
+PATTERN = r"(?P<time>\S+) (?P<level>[A-Z]+) (?P<message>.*)"
+MAPPING = {"msg": "message", "level": "log.level", "time": "@timestamp"}
+
+
+def test_convert_json_lines():
+    converter = LineConverter(
+        mapping=dict(MAPPING, req="http.request", password=""),
+        extra={"service.name": "app"},
+    )
+    line = json.dumps(
+        {
+            "msg": "handled",
+            "level": "WARN",
+            "time": "2024-05-01 12:00:00,123",
+            "req": {"method": "GET", "headers": {"host": "a"}},
+            "password": "secret",
+            "service.name": "other",
+            "status": 200,
+        }
+    )
+    assert converter.convert(line) == (
+        '{"@timestamp":"2024-05-01T12:00:00.123Z","log.level":"warn",'
+        '"message":"handled","ecs.version":"1.6.0","http":{"request":'
+        '{"headers":{"host":"a"},"method":"GET"}},"service":{"name":"app"},'
+        '"status":200}'
+    )
+
+
+@pytest.mark.parametrize(
+    ["timestamp", "expected"],
+    [
+        (1714521600.5, "2024-05-01T00:00:00.500Z"),
+        (1714521600123, "2024-05-01T00:00:00.123Z"),
+        ("2024-05-01T02:00:00.250+02:00", "2024-05-01T00:00:00.250Z"),
+        ("2024-05-01T00:00:00Z", "2024-05-01T00:00:00.000Z"),
+        ("2024-05-01 00:00:00", "2024-05-01T00:00:00.000Z"),
+    ],
+)
+def test_convert_timestamps(timestamp, expected):
+    converter = LineConverter(mapping=MAPPING)
+    event = json.loads(converter.convert(json.dumps({"time": timestamp})))
+    assert event["@timestamp"] == expected
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [1e30, -1e30, float("inf"), float("-inf"), float("nan"), "not a time", None],
+)
+@mock.patch("time.time", return_value=1714521600.0)
+def test_convert_invalid_timestamps(time, timestamp):
+    converter = LineConverter(mapping=MAPPING)
+    event = json.loads(converter.convert(json.dumps({"msg": "a", "time": timestamp})))
+    assert event["@timestamp"] == "2024-05-01T00:00:00.000Z"
+    assert event["message"] == "a"
+
+
+@mock.patch("time.time", return_value=1714521600.0)
+def test_convert_text_lines(time):
+    converter = LineConverter(mapping=MAPPING, pattern=PATTERN, keep_original=True)
+    assert json.loads(converter.convert("2024-05-01T10:00:00Z ERROR boom")) == {
+        "@timestamp": "2024-05-01T10:00:00.000Z",
+        "log.level": "error",
+        "message": "boom",
+        "ecs.version": "1.6.0",
+        "log": {"original": "2024-05-01T10:00:00Z ERROR boom"},
+    }
+    # Lines which don't match get the current time and the default level
+    for line in ("not matching", '{"a": 1, "a.b": 2}', "{not json"):
+        assert json.loads(converter.convert(line)) == {
+            "@timestamp": "2024-05-01T00:00:00.000Z",
+            "log.level": "info",
+            "message": line,
+            "ecs.version": "1.6.0",
+            "log": {"original": line},
+        }
+
+
+def test_convert_matches_stdlib_formatter():
+    extra = {"service.name": "app"}
+    exclude_fields = ["log.origin", "log.logger", "process", "log.original"]
+    record = logging.LogRecord(
+        "app", logging.INFO, __file__, 1, "hello ü", (), None, "func"
+    )
+    record.created = 1714521600.25
+    record.msecs = 250
+    record.__dict__["http.request.method"] = "GET"
+    for ensure_ascii in (True, False):
+        formatter = ecs_logging.StdlibFormatter(
+            extra=extra, exclude_fields=exclude_fields, ensure_ascii=ensure_ascii
+        )
+        converter = LineConverter(
+            extra=extra, exclude_fields=exclude_fields, ensure_ascii=ensure_ascii
+        )
+        line = json.dumps(
+            {
+                "@timestamp": "2024-05-01T00:00:00.250Z",
+                "log.level": "info",
+                "message": "hello ü",
+                "http": {"request": {"method": "GET"}},
+            }
+        )
+        assert converter.convert(line) == formatter.format(record)
+
+
+def test_convert_lines():
+    converter = LineConverter(exclude_fields=["@timestamp"])
+    assert converter.convert_lines([b"a\r\n", b"\n", b"  \n", b"b\xff"]) == (
+        b'{"log.level":"info","message":"a","ecs.version":"1.6.0"}\n'
+        b'{"log.level":"info","message":"b\\ufffd","ecs.version":"1.6.0"}\n'
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_main(tmp_path, capsys, workers):
+    first = tmp_path / "first.log"
+    first.write_text('{"msg": "one"}\n{"msg": "two"}\n')
+    second = tmp_path / "second.log"
+    second.write_text("2024-05-01T10:00:00Z ERROR three")
+    output = tmp_path / "out.ndjson"
+
+    status = cli.main(
+        [
+            str(first),
+            str(second),
+            f"--output={output}",
+            "--map=msg=message",
+            "--map=level=log.level",
+            "--map=time=@timestamp",
+            f"--pattern={PATTERN}",
+            "--extra=service.name=app",
+            "--exclude-fields=@timestamp,log.level",
+            f"--workers={workers}",
+            "--batch-size=8",
+            "--stats",
+        ]
+    )
+    assert status == 0
+    assert [json.loads(line) for line in output.read_text().splitlines()] == [
+        {"message": message, "ecs.version": "1.6.0", "service": {"name": "app"}}
+        for message in ("one", "two", "three")
+    ]
+    assert capsys.readouterr().err.startswith("ecs_logging: converted 3 lines in ")
+
+
+def test_main_pattern_example(tmp_path, capsys):
+    # The example in the help of '--pattern'
+    logs = tmp_path / "app.log"
+    logs.write_text("WARNING disk almost full\n")
+
+    status = cli.main(
+        [
+            str(logs),
+            r"--pattern=(?P<level>\w+) (?P<message>.*)",
+            "--map=level=log.level",
+            "--exclude-fields=@timestamp",
+        ]
+    )
+    assert status == 0
+    assert json.loads(capsys.readouterr().out) == {
+        "log.level": "warning",
+        "message": "disk almost full",
+        "ecs.version": "1.6.0",
+    }
+
+
+@pytest.mark.parametrize(
+    "args",
+    [["--map=message"], ["--extra==value"], ["--pattern=("], ["--workers=0"]],
+)
+def test_main_invalid_arguments(args, capsys):
+    with pytest.raises(SystemExit) as e:
+        cli.main(args)
+    assert e.value.code == 2
+    assert "error: argument" in capsys.readouterr().err
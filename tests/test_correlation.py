@@ -0,0 +1,250 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+from io import StringIO
+
+import elasticapm
+import mock
+import pytest
+import structlog
+from elasticapm.handlers.logging import LoggingFilter
+
+import ecs_logging
+
+
+class StaticCorrelation(ecs_logging.CorrelationProvider):
+    def __init__(self, key, fields):
+        self.key = key
+        self._fields = fields
+
+    def current_key(self):
+        return self.key
+
+    def fields(self):
+        return dict(self._fields)
+
+
+# Fields which change between runs
+EXCLUDE_FIELDS = ["@timestamp", "log", "process"]
+
+
+def test_elastic_apm_correlation(apm, logger, add_handler):
+    # The provider doesn't need the record factory of the agent
+    logging.setLogRecordFactory(logging.LogRecord)
+    stream = add_handler(
+        correlation=ecs_logging.ElasticAPMCorrelation(), exclude_fields=EXCLUDE_FIELDS
+    ).stream
+
+    logger.info("no transaction")
+    apm.begin_transaction("test-transaction")
+    try:
+        with elasticapm.capture_span("test-span"):
+            span_id = elasticapm.get_span_id()
+            logger.info("in span")
+        logger.info("in transaction")
+        trace_id = elasticapm.get_trace_id()
+        transaction_id = elasticapm.get_transaction_id()
+    finally:
+        apm.end_transaction("test-transaction")
+
+    outside, in_span, in_transaction = [
+        json.loads(line) for line in stream.getvalue().splitlines()
+    ]
+    assert outside == {"ecs.version": "1.6.0", "message": "no transaction"}
+    assert in_span == {
+        "ecs.version": "1.6.0",
+        "message": "in span",
+        "span": {"id": span_id},
+        "trace": {"id": trace_id},
+        "transaction": {"id": transaction_id},
+        "service": {"name": "apm-service", "environment": "dev"},
+    }
+    assert in_transaction == {
+        "ecs.version": "1.6.0",
+        "message": "in transaction",
+        "trace": {"id": trace_id},
+        "transaction": {"id": transaction_id},
+        "service": {"name": "apm-service", "environment": "dev"},
+    }
+
+
+def test_same_output_as_record_attributes(apm, logger, add_handler):
+    stream = add_handler(exclude_fields=EXCLUDE_FIELDS).stream
+    correlated = add_handler(
+        correlation=ecs_logging.ElasticAPMCorrelation(), exclude_fields=EXCLUDE_FIELDS
+    ).stream
+    logger.addFilter(LoggingFilter())
+
+    apm.begin_transaction("test-transaction")
+    try:
+        with elasticapm.capture_span("test-span"):
+            logger.info("in span", extra={"service.version": "1.0"})
+            logger.info("in span", extra={"trace": {"id": "given"}})
+    finally:
+        apm.end_transaction("test-transaction")
+
+    assert "span" in stream.getvalue()
+    assert correlated.getvalue() == stream.getvalue()
+
+
+def test_fields_are_cached_per_span(logger, add_handler):
+    correlation = StaticCorrelation(
+        "span-1", {"trace.id": "t1", "span.id": "s1", "service.name": None}
+    )
+    stream = add_handler(correlation=correlation, exclude_fields=EXCLUDE_FIELDS).stream
+
+    with mock.patch.object(correlation, "fields", wraps=correlation.fields) as fields:
+        logger.info("first")
+        logger.info("second", extra={"service.name": "given"})
+        assert fields.call_count == 1
+        correlation.key = "span-2"
+        correlation._fields["span.id"] = "s2"
+        logger.info("third")
+        assert fields.call_count == 2
+
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [
+        {
+            "ecs.version": "1.6.0",
+            "message": "first",
+            "span": {"id": "s1"},
+            "trace": {"id": "t1"},
+        },
+        {
+            "ecs.version": "1.6.0",
+            "message": "second",
+            "service": {"name": "given"},
+            "span": {"id": "s1"},
+            "trace": {"id": "t1"},
+        },
+        {
+            "ecs.version": "1.6.0",
+            "message": "third",
+            "span": {"id": "s2"},
+            "trace": {"id": "t1"},
+        },
+    ]
+
+
+@pytest.mark.parametrize("formatter_kwargs", [{}, {"ensure_ascii": False}])
+def test_given_fields_are_kept(logger, formatter_kwargs, add_handler):
+    correlation = StaticCorrelation(
+        "span", {"trace.id": "t1", "span.id": "s1", "service.name": "svc"}
+    )
+    stream = add_handler(
+        correlation=correlation,
+        extra={"service.name": "global"},
+        exclude_fields=["@timestamp", "log", "process", "span"],
+        **formatter_kwargs,
+    ).stream
+    logger.info("message", extra={"trace": {"id": "given"}})
+
+    assert json.loads(stream.getvalue()) == {
+        "ecs.version": "1.6.0",
+        "message": "message",
+        "service": {"name": "global"},
+        "trace": {"id": "given"},
+    }
+
+
+def test_format_to_ecs(logger):
+    class Formatter(ecs_logging.StdlibFormatter):
+        def format_to_ecs(self, record):
+            result = super().format_to_ecs(record)
+            result["custom"] = True
+            return result
+
+    stream = StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        Formatter(
+            exclude_fields=["@timestamp", "log", "process"],
+            correlation=StaticCorrelation("span", {"trace.id": "t1"}),
+        )
+    )
+    logger.addHandler(handler)
+    logger.info("message")
+
+    assert json.loads(stream.getvalue()) == {
+        "custom": True,
+        "ecs.version": "1.6.0",
+        "message": "message",
+        "trace": {"id": "t1"},
+    }
+
+
+def test_opentelemetry_correlation(logger, add_handler):
+    resources = pytest.importorskip("opentelemetry.sdk.resources")
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+
+    provider = sdk_trace.TracerProvider(
+        resource=resources.Resource.create(
+            {"service.name": "otel-service", "deployment.environment": "dev"}
+        )
+    )
+    tracer = provider.get_tracer(__name__)
+    stream = add_handler(
+        correlation=ecs_logging.OpenTelemetryCorrelation(),
+        exclude_fields=EXCLUDE_FIELDS,
+    ).stream
+
+    with tracer.start_as_current_span("test-span") as span:
+        context = span.get_span_context()
+        logger.info("in span")
+    logger.info("no span")
+
+    in_span, outside = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert in_span == {
+        "ecs.version": "1.6.0",
+        "message": "in span",
+        "span": {"id": format(context.span_id, "016x")},
+        "trace": {"id": format(context.trace_id, "032x")},
+        "service": {"name": "otel-service", "environment": "dev"},
+    }
+    assert outside == {"ecs.version": "1.6.0", "message": "no span"}
+
+
+def test_structlog_correlation():
+    stream = StringIO()
+    log = structlog.wrap_logger(
+        structlog.PrintLogger(stream),
+        processors=[
+            ecs_logging.StructlogFormatter(
+                exclude_fields=["@timestamp"],
+                correlation=StaticCorrelation(
+                    "span", {"trace.id": "t1", "span.id": "s1", "service.name": "svc"}
+                ),
+            )
+        ],
+    )
+    log.info("message", **{"span.id": "given", "service": "not an object"})
+
+    assert json.loads(stream.getvalue()) == {
+        "ecs.version": "1.6.0",
+        "log.level": "info",
+        "message": "message",
+        "service": "not an object",
+        "span": {"id": "given"},
+        "trace": {"id": "t1"},
+    }
+
+
+def test_invalid_correlation():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StdlibFormatter(correlation=object())
+    assert str(e.value) == "'correlation' must be a CorrelationProvider"
@@ -0,0 +1,277 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import base64
+import gzip
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mock
+import pytest
+
+import ecs_logging
+
+
+class BulkRequestHandler(BaseHTTPRequestHandler):
+    """Stands in for the '_bulk' API of Elasticsearch"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        lines = body.decode("utf-8").splitlines()
+        actions = [json.loads(line) for line in lines[::2]]
+        documents = [json.loads(line) for line in lines[1::2]]
+        self.server.requests.append(
+            {
+                "path": self.path,
+                "headers": self.headers,
+                "actions": actions,
+                "documents": documents,
+                "client": self.client_address,
+            }
+        )
+
+        statuses = self.server.statuses.pop(0) if self.server.statuses else 201
+        if isinstance(statuses, int) and statuses >= 300:
+            status, response = statuses, {"error": "unavailable"}
+        else:
+            if isinstance(statuses, int):
+                statuses = [statuses] * len(documents)
+            status = 200
+            response = {
+                "errors": any(item >= 300 for item in statuses),
+                "items": [{"create": {"status": item}} for item in statuses],
+            }
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BulkRequestHandler)
+    server.requests = []
+    # Responses to the next requests, either the status of the whole
+    # request or the statuses of the documents. Defaults to 201.
+    server.statuses = []
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def sent_messages(server):
+    return [doc["message"] for req in server.requests for doc in req["documents"]]
+
+
+def test_sends_batches_over_one_connection(logger, server, add_handler):
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(
+            server.url, index="logs-app-default", batch_size=2, flush_interval=None
+        )
+    )
+    for i in range(5):
+        logger.info("message %d", i)
+    handler.close()
+
+    assert [len(req["documents"]) for req in server.requests] == [2, 2, 1]
+    assert sent_messages(server) == [f"message {i}" for i in range(5)]
+    for request in server.requests:
+        assert request["path"] == "/_bulk"
+        assert request["headers"]["Content-Type"] == "application/x-ndjson"
+        assert request["headers"]["Content-Encoding"] == "gzip"
+        assert request["actions"] == [{"create": {"_index": "logs-app-default"}}] * len(
+            request["documents"]
+        )
+    # The connection is kept alive between requests
+    assert len({req["client"] for req in server.requests}) == 1
+    assert handler.dropped == handler.failed == 0
+
+
+def test_batch_bytes(logger, server, add_handler):
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(
+            server.url, batch_bytes=1000, flush_interval=None
+        )
+    )
+    for i in range(10):
+        logger.info("message %d", i)
+    handler.close()
+
+    assert len(server.requests) > 2
+    assert sent_messages(server) == [f"message {i}" for i in range(10)]
+
+
+def test_flush_interval(logger, server, add_handler):
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(server.url, flush_interval=0.01)
+    )
+    logger.info("message")
+
+    deadline = time.monotonic() + 5
+    while not server.requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sent_messages(server) == ["message"]
+    handler.close()
+
+
+def test_flush_waits_until_sent(logger, server, add_handler):
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(server.url, flush_interval=None)
+    )
+    for i in range(3):
+        logger.info("message %d", i)
+    handler.flush()
+
+    assert sent_messages(server) == ["message 0", "message 1", "message 2"]
+    handler.close()
+    assert len(server.requests) == 1
+
+
+def test_retries_unavailable_with_backoff(logger, server, add_handler):
+    server.statuses = [503, 429]
+    handler = add_handler(ecs_logging.ElasticsearchHandler(server.url, backoff=0.5))
+    with mock.patch("time.sleep") as sleep:
+        logger.info("message")
+        handler.close()
+
+    assert [call[0][0] for call in sleep.call_args_list] == [0.5, 1.0]
+    assert len(server.requests) == 3
+    assert handler.failed == 0
+
+
+def test_gives_up_after_max_retries(logger, server, add_handler):
+    server.statuses = [503] * 3
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(server.url, max_retries=2, backoff=0)
+    )
+    logger.info("message 0")
+    logger.info("message 1")
+    handler.close()
+
+    assert len(server.requests) == 3
+    assert handler.failed == 2
+
+
+def test_retries_rejected_documents(logger, server, add_handler):
+    server.statuses = [[201, 429, 400]]
+    handler = add_handler(ecs_logging.ElasticsearchHandler(server.url, backoff=0))
+    for i in range(3):
+        logger.info("message %d", i)
+    handler.close()
+
+    assert [len(req["documents"]) for req in server.requests] == [3, 1]
+    assert server.requests[1]["documents"][0]["message"] == "message 1"
+    # The document with status 400 is never retried
+    assert handler.failed == 1
+
+
+def test_retries_unreachable_server(logger, add_handler):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:%d" % sock.getsockname()[1]
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(url, max_retries=1, backoff=0)
+    )
+    logger.info("message")
+    handler.close()
+
+    assert handler.failed == 1
+
+
+def test_drops_records_while_queue_is_full(logger, server, add_handler):
+    handler = add_handler(ecs_logging.ElasticsearchHandler(server.url, maxsize=2))
+    with mock.patch.object(handler, "_start_sender"):
+        for i in range(5):
+            logger.info("message %d", i)
+    assert handler.dropped == 3
+
+    handler.close()
+    logger.info("after close")
+    assert handler.dropped == 4
+
+
+def test_close_gives_up_after_close_timeout(logger, server, add_handler):
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(
+            server.url, batch_size=1, maxsize=1, close_timeout=0.1
+        )
+    )
+    unblock = threading.Event()
+    with mock.patch.object(handler, "_send", side_effect=lambda _: unblock.wait()):
+        for i in range(3):
+            logger.info("message %d", i)
+        start = time.monotonic()
+        handler.close()
+        assert time.monotonic() - start < 5
+        unblock.set()
+
+
+def test_headers_and_path(logger, server, add_handler):
+    host = server.url.split("//")[1]
+    handler = add_handler(
+        ecs_logging.ElasticsearchHandler(
+            f"http://user:p%40ss@{host}/elasticsearch/",
+            compress=False,
+            headers={"X-Opaque-Id": "app"},
+        )
+    )
+    logger.info("message")
+    handler.close()
+
+    (request,) = server.requests
+    assert request["path"] == "/elasticsearch/_bulk"
+    assert "Content-Encoding" not in request["headers"]
+    assert request["headers"]["X-Opaque-Id"] == "app"
+    assert request["headers"]["Authorization"] == "Basic " + (
+        base64.b64encode(b"user:p@ss").decode("ascii")
+    )
+
+    handler = add_handler(ecs_logging.ElasticsearchHandler(server.url, api_key="a2V5"))
+    logger.info("message")
+    handler.close()
+    assert server.requests[1]["headers"]["Authorization"] == "ApiKey a2V5"
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        ({"url": "localhost:9200"}, "'url' must be an http:// or https:// URL"),
+        ({"batch_size": 0}, "'batch_size' must be a positive integer"),
+        ({"maxsize": 0}, "'maxsize' must be a positive integer"),
+        ({"max_retries": -1}, "'max_retries' must be a non-negative integer"),
+    ],
+)
+def test_invalid_arguments(kwargs, message):
+    kwargs.setdefault("url", "http://localhost:9200")
+    with pytest.raises(ValueError) as e:
+        ecs_logging.ElasticsearchHandler(**kwargs)
+    assert str(e.value) == message
@@ -0,0 +1,213 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import json
+import logging
+from io import StringIO
+from unittest import mock
+
+import pytest
+import structlog
+
+import ecs_logging
+
+
+@contextlib.contextmanager
+def frozen_time(seconds):
+    # LogRecord uses 'time.time_ns()' since Python 3.13
+    with mock.patch("time.time", return_value=seconds):
+        with mock.patch("time.time_ns", return_value=seconds * 1_000_000_000):
+            yield
+
+
+def read_ecs(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_filter_passes_limit_per_window(logger, add_handler):
+    stream = add_handler(
+        filters=[ecs_logging.DeduplicationFilter(limit=2, window=10)]
+    ).stream
+
+    def log(i):
+        logger.info("request %d failed", i)
+
+    with frozen_time(1000):
+        for i in range(5):
+            log(i)
+    with frozen_time(1010):
+        log(5)
+        log(6)
+
+    ecs = read_ecs(stream)
+    assert [e["message"] for e in ecs] == [
+        "request 0 failed",
+        "request 1 failed",
+        "request 5 failed",
+        "request 6 failed",
+    ]
+    assert [e["log"].get("repeat") for e in ecs] == [None, None, 3, None]
+
+
+def test_filter_keys_on_call_site_and_error_type(logger, add_handler):
+    stream = add_handler(filters=[ecs_logging.DeduplicationFilter(limit=1)]).stream
+
+    for i in range(3):
+        logger.info("first %d", i)
+        logger.info("second %d", i)
+        for error in (ValueError, KeyError):
+            try:
+                raise error(i)
+            except Exception:
+                logger.exception("failed")
+
+    messages = [
+        (e["message"], e.get("error", {}).get("type")) for e in read_ecs(stream)
+    ]
+    assert messages == [
+        ("first 0", None),
+        ("second 0", None),
+        ("failed", "ValueError"),
+        ("failed", "KeyError"),
+    ]
+
+
+def test_filter_evicts_least_recent_keys(logger, add_handler):
+    dedup = ecs_logging.DeduplicationFilter(limit=1, maxsize=2)
+    stream = add_handler(filters=[dedup]).stream
+
+    for message in ("a", "b", "a", "c", "b", "a"):
+        logger.info(message)
+
+    # 'b' was evicted by 'c', then 'a' by 'b' with a suppressed duplicate
+    ecs = read_ecs(stream)
+    assert [e["message"] for e in ecs] == [
+        "a",
+        "b",
+        "c",
+        "a (1 repeats suppressed)",
+        "b",
+        "a",
+    ]
+    assert ecs[3]["log"]["repeat"] == 1
+
+
+def test_filter_logs_summary_when_burst_ends(logger, add_handler):
+    stream = add_handler(
+        filters=[ecs_logging.DeduplicationFilter(limit=2, window=10)]
+    ).stream
+
+    with frozen_time(1000):
+        for i in range(5):
+            logger.warning("request %d failed", i)
+        logger.info("other")
+    with frozen_time(1010):
+        logger.info("other")
+        logger.info("other")
+
+    ecs = read_ecs(stream)
+    assert [(e["message"], e["log"].get("repeat")) for e in ecs] == [
+        ("request 0 failed", None),
+        ("request 1 failed", None),
+        ("other", None),
+        ("request %d failed (3 repeats suppressed)", 3),
+        ("other", None),
+        ("other", None),
+    ]
+    summary = ecs[3]
+    assert summary["log.level"] == "warning"
+    assert summary["log"]["logger"] == logger.name
+    assert summary["log"]["origin"] == ecs[0]["log"]["origin"]
+
+
+def test_filter_summary_only_reaches_its_handlers(logger, add_handler):
+    dedup = ecs_logging.DeduplicationFilter(limit=1, maxsize=1)
+    stream = add_handler(filters=[dedup]).stream
+    other = StringIO()
+    logger.addHandler(logging.StreamHandler(other))
+
+    for message in ("a", "a", "b"):
+        logger.info(message)
+
+    assert [e["message"] for e in read_ecs(stream)] == [
+        "a",
+        "a (1 repeats suppressed)",
+        "b",
+    ]
+    assert other.getvalue().splitlines() == ["a", "a", "b"]
+
+
+def test_filter_on_logger_logs_summary_with_logger(logger):
+    logger.addFilter(ecs_logging.DeduplicationFilter(limit=1, maxsize=1))
+    streams = [StringIO(), StringIO()]
+    for stream in streams:
+        logger.addHandler(logging.StreamHandler(stream))
+
+    for message in ("a", "a", "b"):
+        logger.info(message)
+
+    for stream in streams:
+        assert stream.getvalue().splitlines() == [
+            "a",
+            "a (1 repeats suppressed)",
+            "b",
+        ]
+
+
+def test_filter_name(logger):
+    dedup = ecs_logging.DeduplicationFilter(name="other", limit=1)
+    assert not dedup.filter(logging.makeLogRecord({"name": logger.name}))
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        ({"limit": 0}, "'limit' must be a positive integer"),
+        ({"window": 0}, "'window' must be a positive number of seconds"),
+    ],
+)
+def test_invalid_arguments(kwargs, message):
+    with pytest.raises(ValueError) as e:
+        ecs_logging.DeduplicationFilter(**kwargs)
+    assert str(e.value) == message
+
+
+def test_structlog_processor():
+    stream = StringIO()
+    logger = structlog.wrap_logger(
+        structlog.PrintLogger(stream),
+        processors=[
+            ecs_logging.DeduplicationProcessor(limit=1, window=10),
+            ecs_logging.StructlogFormatter(),
+        ],
+    )
+
+    with frozen_time(1000):
+        for i in range(3):
+            logger.info("retrying", attempt=i)
+        logger.warning("retrying")
+    with frozen_time(1010):
+        logger.info("retrying", attempt=3)
+
+    ecs = read_ecs(stream)
+    assert [(e["log.level"], e.get("attempt")) for e in ecs] == [
+        ("info", 0),
+        ("warning", None),
+        ("info", 3),
+    ]
+    assert [e.get("log", {}).get("repeat") for e in ecs] == [None, None, 2]
@@ -0,0 +1,277 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+import mock
+import pytest
+
+import ecs_logging
+from ecs_logging import _handlers
+
+
+def read_messages(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["message"] for line in f]
+
+
+def read_gzip_messages(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line)["message"] for line in f]
+
+
+def test_batches_until_batch_size(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(path, batch_size=1000, flush_interval=None)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    logger.info("message 0")
+    assert path.read_bytes() == b""
+
+    for i in range(1, 20):
+        logger.info("message %d", i)
+    written = read_messages(path)
+    assert 0 < len(written) < 20
+
+    handler.close()
+    assert read_messages(path) == [f"message {i}" for i in range(20)]
+
+
+def test_flush_interval(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(path, flush_interval=0.01)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    logger.info("message")
+    deadline = time.monotonic() + 5
+    while not path.read_bytes() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert read_messages(path) == ["message"]
+    handler.close()
+    assert not handler._flusher.is_alive()
+
+
+def test_shutdown_with_running_flusher(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(path, flush_interval=0.01)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+    logger.info("message")
+
+    def shutdown():
+        # The flusher waits for the lock, which 'logging.shutdown()'
+        # holds while it closes the handler.
+        with handler.lock:
+            time.sleep(0.1)
+            logging.shutdown([weakref.ref(handler)])
+
+    thread = threading.Thread(target=shutdown, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not handler._flusher.is_alive()
+    assert read_messages(path) == ["message"]
+
+
+def test_writes_more_chunks_than_iov_max(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(path, flush_interval=None)
+    logger.addHandler(handler)
+
+    with mock.patch.object(_handlers, "_IOV_MAX", 3):
+        for i in range(10):
+            logger.info("message %d", i)
+        handler.close()
+
+    with open(path) as f:
+        assert f.read().splitlines() == [f"message {i}" for i in range(10)]
+
+
+def test_partial_writev_is_completed(tmp_path):
+    def short_writev(fd, buffers):
+        return os.write(fd, b"".join(buffers)[:3])
+
+    path = tmp_path / "app.ndjson"
+    with open(path, "wb") as f:
+        with mock.patch("os.writev", side_effect=short_writev):
+            _handlers._writev(f.fileno(), [b"abcd", b"efgh\n"])
+    assert path.read_bytes() == b"abcdefgh\n"
+
+
+def test_rotates_by_size(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(
+        path, batch_size=1, max_bytes=400, backup_count=2
+    )
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    for i in range(12):
+        logger.info("message %d", i)
+    handler.close()
+
+    rotated = [tmp_path / "app.ndjson.2", tmp_path / "app.ndjson.1", path]
+    messages = [message for file in rotated for message in read_messages(file)]
+    assert all(file.stat().st_size <= 400 for file in rotated)
+    assert not (tmp_path / "app.ndjson.3").exists()
+    assert messages == [f"message {i}" for i in range(12 - len(messages), 12)]
+
+
+def test_rotates_by_interval(logger, tmp_path):
+    path = tmp_path / "app.ndjson"
+    handler = ecs_logging.BatchedFileHandler(
+        path, batch_size=1, rotate_interval=60, backup_count=1
+    )
+    logger.addHandler(handler)
+
+    logger.info("first")
+    logger.info("second")
+    with mock.patch("time.monotonic", return_value=time.monotonic() + 60):
+        logger.info("third")
+    handler.close()
+
+    assert (tmp_path / "app.ndjson.1").read_text() == "first\nsecond\n"
+    assert path.read_text() == "third\n"
+
+
+@pytest.mark.parametrize(
+    "handler_class", [ecs_logging.BatchedFileHandler, ecs_logging.GzipFileHandler]
+)
+def test_doesnt_rotate_without_backup_count(logger, tmp_path, handler_class):
+    path = tmp_path / "app.ndjson.gz"
+    handler = handler_class(path, batch_size=1, max_bytes=100, rotate_interval=60)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    for i in range(5):
+        logger.info("message %d", i)
+    with mock.patch("time.monotonic", return_value=time.monotonic() + 60):
+        logger.info("message 5")
+    handler.close()
+
+    read = (
+        read_gzip_messages
+        if handler_class is ecs_logging.GzipFileHandler
+        else read_messages
+    )
+    assert read(path) == [f"message {i}" for i in range(6)]
+    assert os.listdir(tmp_path) == ["app.ndjson.gz"]
+
+
+@pytest.mark.parametrize(
+    ["policy", "fsyncs"], [("never", 0), ("always", 3), ("rotate", 1)]
+)
+def test_fsync_policy(logger, tmp_path, policy, fsyncs):
+    handler = ecs_logging.BatchedFileHandler(
+        tmp_path / "app.ndjson", batch_size=1, fsync=policy
+    )
+    logger.addHandler(handler)
+
+    with mock.patch("os.fsync") as fsync:
+        for i in range(3):
+            logger.info("message %d", i)
+        handler.close()
+    assert fsync.call_count == fsyncs
+
+
+def test_invalid_arguments(tmp_path):
+    with pytest.raises(ValueError) as e:
+        ecs_logging.BatchedFileHandler(tmp_path / "app.ndjson", fsync="sometimes")
+    assert str(e.value) == "'fsync' must be one of: 'never', 'always', 'rotate'"
+
+    with pytest.raises(ValueError):
+        ecs_logging.BatchedFileHandler(tmp_path / "app.ndjson", batch_size=0)
+
+
+def test_gzip_writes_a_member_per_batch(logger, tmp_path):
+    path = tmp_path / "app.ndjson.gz"
+    handler = ecs_logging.GzipFileHandler(path, batch_size=1000, flush_interval=None)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    for i in range(20):
+        logger.info("message %d", i)
+    # Written members can be read while the handler is open
+    written = read_gzip_messages(path)
+    assert 0 < len(written) < 20
+    handler.close()
+
+    data = path.read_bytes()
+    assert data.count(b"\x1f\x8b\x08") > 1
+    assert read_gzip_messages(path) == [f"message {i}" for i in range(20)]
+
+    # Appending adds members to the existing file
+    handler = ecs_logging.GzipFileHandler(path)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+    logger.info("message 20")
+    handler.close()
+    assert read_gzip_messages(path) == [f"message {i}" for i in range(21)]
+
+
+@pytest.mark.parametrize("compresslevel", [0, 1, 9])
+def test_gzip_compresslevel(logger, tmp_path, compresslevel):
+    path = tmp_path / "app.ndjson.gz"
+    handler = ecs_logging.GzipFileHandler(path, compresslevel=compresslevel)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    for i in range(100):
+        logger.info("message %d", i)
+    handler.close()
+
+    assert read_gzip_messages(path) == [f"message {i}" for i in range(100)]
+    uncompressed = len(gzip.decompress(path.read_bytes()))
+    if compresslevel:
+        assert path.stat().st_size < uncompressed / 5
+    else:
+        assert path.stat().st_size > uncompressed
+
+
+def test_gzip_rotates_by_compressed_size(logger, tmp_path):
+    path = tmp_path / "app.ndjson.gz"
+    handler = ecs_logging.GzipFileHandler(
+        path, batch_size=2000, max_bytes=1000, backup_count=2
+    )
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    for i in range(60):
+        logger.info("message %d", i)
+    handler.close()
+
+    rotated = [tmp_path / "app.ndjson.2.gz", tmp_path / "app.ndjson.1.gz", path]
+    messages = [message for file in rotated for message in read_gzip_messages(file)]
+    assert all(file.stat().st_size <= 1000 for file in rotated)
+    assert not (tmp_path / "app.ndjson.3.gz").exists()
+    assert messages == [f"message {i}" for i in range(60 - len(messages), 60)]
+    # More records fit into the compressed files than into 3000 bytes
+    assert sum(len(gzip.decompress(file.read_bytes())) for file in rotated) > 3000
+
+
+def test_gzip_invalid_compresslevel(tmp_path):
+    with pytest.raises(ValueError) as e:
+        ecs_logging.GzipFileHandler(tmp_path / "app.ndjson.gz", compresslevel=10)
+    assert str(e.value) == "'compresslevel' must be an integer from 0 to 9"
@@ -16,8 +16,25 @@
 # under the License.
 
 import re
+import subprocess
+import sys
+
 from ecs_logging import ECS_VERSION
 
 
 def test_ecs_version_format():
     assert re.match(r"[0-9](?:[.0-9]*[0-9])?", ECS_VERSION)
+
+
+def test_optional_modules_are_imported_on_first_use():
+    code = (
+        "import sys, ecs_logging\n"
+        "lazy = ['ecs_logging._elasticsearch', 'ecs_logging._reader',"
+        " 'ecs_logging._shared_memory', 'http.client', 'mmap']\n"
+        "assert not [name for name in lazy if name in sys.modules], sys.modules\n"
+        "assert ecs_logging.read_events.__module__ == 'ecs_logging._reader'\n"
+        "from ecs_logging import *\n"
+        "assert SharedMemoryRing.__module__ == 'ecs_logging._shared_memory'\n"
+        "assert 'ElasticsearchHandler' in dir(ecs_logging)\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
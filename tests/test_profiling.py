@@ -0,0 +1,158 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import sys
+
+import pytest
+
+import ecs_logging
+
+
+def make_record(**extra):
+    record = logging.LogRecord(
+        name="logger-name",
+        level=logging.DEBUG,
+        pathname="/path/file.py",
+        lineno=10,
+        msg="%d: %s",
+        args=(1, "hello"),
+        func="test_function",
+        exc_info=None,
+    )
+    record.created = 1584713566
+    record.msecs = 123
+    record.__dict__.update(extra)
+    return record
+
+
+def make_exc_record():
+    try:
+        raise ValueError("failed")
+    except ValueError:
+        return make_record(exc_info=sys.exc_info())
+
+
+def test_stage_stats():
+    assert ecs_logging.StageStats(4, 100).mean_ns == 25.0
+    assert ecs_logging.StageStats(0, 0).mean_ns == 0.0
+
+
+def test_profiler_accumulates_stages():
+    profiler = ecs_logging.FormatterProfiler()
+    profiler.add({"message": 10, "encode": 20})
+    profiler.add({"message": 30})
+
+    assert profiler.snapshot() == {
+        "message": ecs_logging.StageStats(2, 40),
+        "encode": ecs_logging.StageStats(1, 20),
+    }
+
+    profiler.reset()
+    assert profiler.snapshot() == {}
+
+
+def test_profiler_callback():
+    calls = []
+    profiler = ecs_logging.FormatterProfiler(callback=calls.append)
+    profiler.add({"message": 10})
+
+    assert calls == [{"message": 10}]
+
+
+@pytest.mark.parametrize(
+    ["record", "stages"],
+    [
+        (make_record(), {"message", "extract", "extras", "encode"}),
+        (
+            make_exc_record(),
+            {"message", "extract", "stack_trace", "extras", "encode"},
+        ),
+        (
+            make_record(elasticapm_trace_id="1", elasticapm_transaction_id="2"),
+            {"message", "extract", "extras", "apm", "encode"},
+        ),
+    ],
+)
+def test_stdlib_formatter_stages(record, stages):
+    profiler = ecs_logging.FormatterProfiler()
+    formatter = ecs_logging.StdlibFormatter(profiler=profiler)
+    expected = ecs_logging.StdlibFormatter().format(record)
+
+    assert formatter.format(record) == expected
+    assert formatter.format_bytes(record) == expected.encode("utf-8")
+
+    snapshot = profiler.snapshot()
+    assert set(snapshot) == stages
+    assert all(stats.calls == 2 for stats in snapshot.values())
+    assert all(stats.total_ns >= 0 for stats in snapshot.values())
+
+
+def test_stdlib_formatter_stages_format_to_ecs_overridden():
+    class CustomFormatter(ecs_logging.StdlibFormatter):
+        def format_to_ecs(self, record):
+            result = super().format_to_ecs(record)
+            result["custom"] = True
+            return result
+
+    profiler = ecs_logging.FormatterProfiler()
+    formatter = CustomFormatter(profiler=profiler)
+
+    assert formatter.format(make_record()) == CustomFormatter().format(make_record())
+    assert set(profiler.snapshot()) == {"format_to_ecs", "encode"}
+
+
+def test_stdlib_formatter_profiler_can_be_removed():
+    profiler = ecs_logging.FormatterProfiler()
+    formatter = ecs_logging.StdlibFormatter(profiler=profiler)
+    formatter.format(make_record())
+    formatter.profiler = None
+    formatter.format(make_record())
+
+    assert profiler.snapshot()["encode"].calls == 1
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "stages"],
+    [
+        ({}, {"normalize", "format_to_ecs", "encode"}),
+        (
+            {"exclude_fields": ["log.logger"]},
+            {"normalize", "format_to_ecs", "exclude", "encode"},
+        ),
+    ],
+)
+def test_structlog_formatter_stages(kwargs, stages):
+    def event_dict():
+        return {
+            "event": "test message",
+            "log.logger": "logger-name",
+            "@timestamp": "2020-03-20T14:12:46.123Z",
+        }
+
+    profiler = ecs_logging.FormatterProfiler()
+    formatter = ecs_logging.StructlogFormatter(profiler=profiler, **kwargs)
+    expected = ecs_logging.StructlogFormatter(**kwargs)(None, "debug", event_dict())
+
+    assert formatter(None, "debug", event_dict()) == expected
+    assert formatter.format_bytes(None, "debug", event_dict()) == expected.encode(
+        "utf-8"
+    )
+
+    snapshot = profiler.snapshot()
+    assert set(snapshot) == stages
+    assert all(stats.calls == 2 for stats in snapshot.values())
@@ -0,0 +1,195 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import json
+import logging
+import threading
+from io import StringIO
+
+import pytest
+import structlog
+
+import ecs_logging
+from ecs_logging._queue import RecordSnapshot
+from .test_stdlib_formatter import make_record
+
+
+def test_snapshot_formats_like_record():
+    record = make_record()
+    record.__dict__.update({"http": {"request": {"method": "GET"}}, "url.path": "/"})
+    formatter = ecs_logging.StdlibFormatter()
+
+    snapshot = RecordSnapshot(record)
+    assert formatter.format(snapshot.to_record()) == formatter.format(record)
+
+
+def test_handler_formats_on_listener_thread(logger):
+    threads = []
+
+    class ThreadFormatter(ecs_logging.StdlibFormatter):
+        def format(self, record):
+            threads.append(threading.current_thread())
+            return super().format(record)
+
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(ThreadFormatter(exclude_fields=["@timestamp"]))
+    handler = ecs_logging.QueueHandler(stream_handler)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    try:
+        raise ValueError("error!")
+    except ValueError:
+        logger.exception("there was %s", "an error", extra={"user.id": "1"})
+    handler.close()
+
+    ecs = json.loads(stream.getvalue())
+    assert threads and threads[0] is not threading.current_thread()
+    assert ecs["message"] == "there was an error"
+    assert ecs["log"]["original"] == "there was an error"
+    assert ecs["user"] == {"id": "1"}
+    assert ecs["error"]["type"] == "ValueError"
+    assert ecs["error"]["message"] == "error!"
+    assert "raise ValueError" in ecs["error"]["stack_trace"]
+    assert ecs["process"]["thread"]["id"] == threading.get_ident()
+
+
+def test_close_flushes_queued_records(logger):
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(ecs_logging.StdlibFormatter())
+    handler = ecs_logging.QueueHandler(stream_handler, maxsize=1000)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    for i in range(500):
+        logger.info("message %d", i)
+    handler.close()
+
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == [
+        f"message {i}" for i in range(500)
+    ]
+
+
+def test_full_queue_drops_records(logger):
+    handler = ecs_logging.QueueHandler(maxsize=2)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    for i in range(5):
+        logger.info("message %d", i)
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(ecs_logging.StdlibFormatter())
+    listener = ecs_logging.QueueListener(handler.queue, stream_handler)
+    listener.start()
+    listener.stop()
+
+    messages = [json.loads(line)["message"] for line in stream.getvalue().splitlines()]
+    assert messages == ["message 0", "message 1"]
+
+
+def test_async_handler_flushes_without_blocking(logger):
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(ecs_logging.StdlibFormatter())
+    handler = ecs_logging.AsyncQueueHandler(stream_handler)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    async def main():
+        for i in range(100):
+            logger.info("message %d", i)
+        await handler.aflush()
+        flushed = stream.getvalue()
+        logger.info("message 100")
+        await handler.aclose()
+        return flushed
+
+    flushed = asyncio.run(main())
+    messages = [json.loads(line)["message"] for line in flushed.splitlines()]
+    assert messages == [f"message {i}" for i in range(100)]
+    assert len(stream.getvalue().splitlines()) == 101
+    assert handler.listener._thread is None
+
+
+def test_async_handler_requires_handlers():
+    with pytest.raises(ValueError):
+        ecs_logging.AsyncQueueHandler()
+
+
+def test_async_handler_with_structlog(logger):
+    threads = []
+
+    def record_thread(_, __, event_dict):
+        threads.append(threading.current_thread())
+        return event_dict
+
+    stream = StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(
+        structlog.stdlib.ProcessorFormatter(
+            processors=[
+                structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                record_thread,
+                ecs_logging.StructlogFormatter(),
+            ]
+        )
+    )
+    handler = ecs_logging.AsyncQueueHandler(stream_handler)
+    listener_thread = handler.listener._thread
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    log = structlog.wrap_logger(
+        logger,
+        processors=[structlog.stdlib.ProcessorFormatter.wrap_for_formatter],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    )
+
+    async def main():
+        await log.ainfo("request handled", http={"response": {"status_code": 200}})
+        await log.awarning("slow request", **{"event.duration": 1500})
+        await handler.aclose()
+
+    asyncio.run(main())
+    ecs = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(e["log.level"], e["message"]) for e in ecs] == [
+        ("info", "request handled"),
+        ("warning", "slow request"),
+    ]
+    assert ecs[0]["http"] == {"response": {"status_code": 200}}
+    assert ecs[1]["event"] == {"duration": 1500}
+    # The events were formatted by the listener
+    assert threads == [listener_thread, listener_thread]
+
+
+def test_snapshot_keeps_event_dict():
+    event_dict = {"event": "message", "user": {"id": 1}}
+    record = make_record()
+    record.msg = event_dict
+    record.args = ()
+
+    snapshot = RecordSnapshot(record)
+    event_dict["event"] = "changed"
+    assert snapshot.to_record().msg == {"event": "message", "user": {"id": 1}}
@@ -0,0 +1,185 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import gzip
+import json
+import logging
+
+import mock
+import pytest
+
+import ecs_logging
+from ecs_logging import _reader
+
+# 2024-05-01T00:00:00Z
+START = 1714521600
+
+
+def make_lines(count=4):
+    formatter = ecs_logging.StdlibFormatter(exclude_fields=["process", "log.origin"])
+    lines = []
+    for i in range(count):
+        record = logging.LogRecord(
+            "app",
+            logging.ERROR if i % 2 else logging.INFO,
+            __file__,
+            i,
+            "event %d",
+            (i,),
+            None,
+        )
+        record.created = START + i * 3600
+        record.msecs = 0
+        record.__dict__["http.response.status_code"] = 200 + i
+        lines.append(formatter.format(record))
+    return lines
+
+
+@pytest.fixture(params=["plain", "gzip"])
+def path(request, tmp_path):
+    data = "".join(line + "\n" for line in make_lines()).encode("utf-8")
+    if request.param == "plain":
+        path = tmp_path / "app.ndjson"
+        path.write_bytes(data)
+    else:
+        path = tmp_path / "app.ndjson.gz"
+        # Every line is its own gzip member like 'GzipFileHandler' writes them
+        path.write_bytes(
+            b"".join(gzip.compress(line) for line in data.splitlines(True))
+        )
+    return path
+
+
+@pytest.mark.parametrize("json_backend", ["json", "orjson", "msgspec"])
+def test_read_events(path, json_backend):
+    events = list(ecs_logging.read_events(path, json_backend=json_backend))
+    assert events == [json.loads(line) for line in make_lines()]
+
+
+def test_read_gzip_file_handler_output(tmp_path):
+    path = tmp_path / "app.ndjson.gz"
+    handler = ecs_logging.GzipFileHandler(path, batch_size=1, flush_interval=None)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger = logging.getLogger("reader-logger")
+    logger.addHandler(handler)
+    try:
+        for i in range(3):
+            logger.warning("event %d", i)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    events = ecs_logging.read_events(path, fields=["message"])
+    assert list(events) == [{"message": f"event {i}"} for i in range(3)]
+
+
+def test_empty_and_blank_lines(tmp_path):
+    path = tmp_path / "app.ndjson"
+    path.write_bytes(b"")
+    assert list(ecs_logging.read_events(path)) == []
+
+    # The last line may not end with a newline
+    path.write_bytes(b'\n{"message":"a"}\r\n\n{"message":"b"}')
+    assert list(ecs_logging.read_events(path)) == [{"message": "a"}, {"message": "b"}]
+
+
+def test_filters(path):
+    events = ecs_logging.read_events(
+        path,
+        levels=["ERROR"],
+        start="2024-05-01T01",
+        end=datetime.datetime(2024, 5, 1, 3, tzinfo=datetime.timezone.utc),
+    )
+    assert [event["message"] for event in events] == ["event 1"]
+
+    events = ecs_logging.read_events(path, start="2024-05-01T02:00:00.000Z")
+    assert [event["message"] for event in events] == ["event 2", "event 3"]
+
+    events = ecs_logging.read_events(path, levels=["info"], end="2024-05-01T02")
+    assert [event["message"] for event in events] == ["event 0"]
+
+
+def test_filters_skip_lines_before_decoding(path):
+    with mock.patch("json.loads", wraps=json.loads) as loads:
+        events = list(ecs_logging.read_events(path, levels=["error"]))
+    assert len(events) == 2
+    assert loads.call_count == 2
+
+
+def test_filters_decode_other_lines(tmp_path):
+    path = tmp_path / "app.ndjson"
+    path.write_text(
+        '{"message": "spaces", "@timestamp": "2024-05-01T00:00:00.000Z", "log.level": "error"}\n'
+        '{"@timestamp":"2024-05-01T00:00:00.000Z","log":{"level":"error"},"message":"nested"}\n'
+        '{"@timestamp":"2024-05-01T00:00:00.000Z","log.level":"info","message":"info"}\n'
+        '{"message":"no fields"}\n'
+    )
+    events = ecs_logging.read_events(path, levels=["error"], start="2024-05-01")
+    assert [event["message"] for event in events] == ["spaces", "nested"]
+
+
+def test_fields_and_layouts(path):
+    fields = ["message", "log.level", "http.response.*"]
+    expected = {
+        "raw": {
+            "http": {"response": {"status_code": 200}},
+            "log.level": "info",
+            "message": "event 0",
+        },
+        "nested": {
+            "http": {"response": {"status_code": 200}},
+            "log": {"level": "info"},
+            "message": "event 0",
+        },
+        "flat": {
+            "http.response.status_code": 200,
+            "log.level": "info",
+            "message": "event 0",
+        },
+    }
+    for layout, event in expected.items():
+        events = ecs_logging.read_events(path, fields=fields, layout=layout)
+        assert next(events) == event
+
+    event = next(ecs_logging.read_events(path, layout="nested"))
+    assert event["log"] == {"level": "info", "logger": "app", "original": "event 0"}
+
+
+def test_pages_are_released(tmp_path):
+    path = tmp_path / "app.ndjson"
+    path.write_bytes(b'{"message":"event"}\n' * 1000)
+    with mock.patch.object(_reader, "_RELEASE_SIZE", 4096), mock.patch.object(
+        _reader, "_release_pages", wraps=_reader._release_pages
+    ) as release_pages:
+        assert len(list(ecs_logging.read_events(path))) == 1000
+    assert release_pages.call_count == 4
+
+
+@pytest.mark.parametrize(
+    ["kwargs", "message"],
+    [
+        ({"layout": "dotted"}, "'layout' must be one of: 'raw', 'nested', 'flat'"),
+        ({"levels": "error"}, "'levels' must be a collection of level names"),
+        ({"start": 1714521600}, "'start' must be a datetime or a string"),
+        ({"json_backend": "yaml"}, "'json_backend' must be one of"),
+    ],
+)
+def test_invalid_arguments(tmp_path, kwargs, message):
+    with pytest.raises(ValueError) as e:
+        ecs_logging.read_events(tmp_path / "app.ndjson", **kwargs)
+    assert str(e.value).startswith(message)
@@ -0,0 +1,126 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import multiprocessing
+import random
+import time
+from io import BytesIO
+
+import pytest
+
+import ecs_logging
+
+
+@pytest.fixture(scope="function")
+def ring():
+    ring = ecs_logging.SharedMemoryRing(size=4096)
+    yield ring
+    ring.close()
+
+
+def test_put_and_get_all_wraps_around(ring):
+    records = [bytes([i % 256]) * random.randint(1, 300) for i in range(200)]
+    received = []
+    unread = 0
+    for record in records:
+        # Reads at random, but before the ring is full
+        needed = 4 + len(record)
+        if unread + needed > ring.capacity or random.random() < 0.2:
+            received.extend(ring.get_all())
+            unread = 0
+        assert ring.put(record)
+        unread += needed
+    received.extend(ring.get_all())
+
+    assert received == records
+    assert ring.get_all() == []
+    assert ring.dropped == 0
+
+
+def test_full_ring_drops_newest_records(ring):
+    record = b"x" * 996
+    assert ring.put(record)
+    assert ring.put(record)
+    assert ring.put(record)
+    assert ring.put(record)
+    assert not ring.put(record)
+    assert not ring.put(b"y" * ring.capacity)
+    assert ring.dropped == 2
+
+    assert ring.get_all() == [record] * 4
+    assert ring.put(record)
+
+
+def test_handler_puts_formatted_lines(ring):
+    logger = logging.getLogger(f"test-logger-{time.time():f}-{random.random():f}")
+    logger.setLevel(logging.DEBUG)
+    handler = ecs_logging.SharedMemoryHandler(ring)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+
+    logger.info("message %d", 1, extra={"user.id": "1"})
+
+    stream = BytesIO()
+    collector = ecs_logging.SharedMemoryCollector(ring, stream)
+    assert collector.drain(stream) == 1
+    assert stream.getvalue().endswith(b"\n")
+    ecs = json.loads(stream.getvalue())
+    assert ecs["message"] == "message 1"
+    assert ecs["user"] == {"id": "1"}
+
+
+def _log_from_worker(ring, worker):
+    logger = logging.getLogger(f"worker-{worker}")
+    logger.setLevel(logging.DEBUG)
+    handler = ecs_logging.SharedMemoryHandler(ring)
+    handler.setFormatter(ecs_logging.StdlibFormatter())
+    logger.addHandler(handler)
+    for i in range(100):
+        logger.info("worker %d message %d", worker, i)
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_collector_drains_worker_processes(tmp_path, start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{start_method!r} isn't supported")
+    context = multiprocessing.get_context(start_method)
+
+    path = tmp_path / "app.ndjson"
+    ring = ecs_logging.SharedMemoryRing(size=1024 * 1024, context=context)
+    collector = ecs_logging.SharedMemoryCollector(ring, path, interval=0.01)
+    collector.start()
+    try:
+        workers = [
+            context.Process(target=_log_from_worker, args=(ring, worker))
+            for worker in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+    finally:
+        collector.stop()
+        ring.close()
+
+    with open(path) as f:
+        messages = sorted(json.loads(line)["message"] for line in f)
+    assert messages == sorted(
+        f"worker {worker} message {i}" for worker in range(4) for i in range(100)
+    )
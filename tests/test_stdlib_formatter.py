@@ -17,18 +17,20 @@
 
 import logging
 import logging.config
+import os
 from unittest import mock
 import pytest
 import json
 import time
-import random
+import sys
+import threading
 import ecs_logging
 from io import StringIO
 
 
-@pytest.fixture(scope="function")
-def logger():
-    return logging.getLogger(f"test-logger-{time.time():f}-{random.random():f}")
+class NotSerializable:
+    def __repr__(self):
+        return "<NotSerializable>"
 
 
 def make_record():
@@ -259,6 +261,53 @@ def test_stack_trace_limit_types_and_values():
     assert str(e.value) == "'stack_trace_limit' must be None or an integer"
 
 
+@pytest.mark.parametrize("stack_trace_cache_size", [256, 0])
+def test_stack_trace_cache(stack_trace_cache_size, logger):
+    def fail(value):
+        if value % 2:
+            raise ValueError(f"odd {value}")
+        raise KeyError(value)
+
+    stream = StringIO()
+    handler = logging.StreamHandler(stream)
+    formatter = ecs_logging.StdlibFormatter(
+        stack_trace_cache_size=stack_trace_cache_size
+    )
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    with mock.patch(
+        "ecs_logging._stdlib.format_tb", wraps=ecs_logging._stdlib.format_tb
+    ) as format_tb:
+        for i in range(10):
+            try:
+                fail(i)
+            except Exception:
+                logger.exception("failed")
+
+    errors = [json.loads(line)["error"] for line in stream.getvalue().splitlines()]
+    assert format_tb.call_count == (2 if stack_trace_cache_size else 10)
+    assert [error["type"] for error in errors] == ["KeyError", "ValueError"] * 5
+    assert [error["message"] for error in errors] == [
+        str(i) if i % 2 == 0 else f"odd {i}" for i in range(10)
+    ]
+    assert "raise KeyError(value)" in errors[0]["stack_trace"]
+    assert 'raise ValueError(f"odd {value}")' in errors[1]["stack_trace"]
+    assert errors[::2] == [
+        dict(errors[0], message=error["message"]) for error in errors[::2]
+    ]
+    assert errors[1::2] == [
+        dict(errors[1], message=error["message"]) for error in errors[1::2]
+    ]
+
+
+def test_stack_trace_cache_size_types_and_values():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StdlibFormatter(stack_trace_cache_size=-1)
+    assert str(e.value) == "'stack_trace_cache_size' must be a non-negative integer"
+
+
 @pytest.mark.parametrize(
     "exclude_fields",
     [
@@ -312,6 +361,59 @@ def test_exclude_fields_empty_json_object():
     assert "ecs" not in ecs
 
 
+def test_exclude_fields_wildcards():
+    record = make_record()
+    record.__dict__.update(
+        {
+            "http": {
+                "request": {
+                    "method": "GET",
+                    "headers": {"accept": "*/*", "x-api-key": "secret"},
+                }
+            },
+            "http.response.headers.x-api-key": "secret",
+            "url": {"path": "/", "query": "q=1"},
+        }
+    )
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["http.*.headers.x-*", "url.q*"]
+    )
+    ecs = formatter.format_to_ecs(record)
+
+    assert ecs["http"] == {"request": {"method": "GET", "headers": {"accept": "*/*"}}}
+    assert ecs["url"] == {"path": "/"}
+
+
+def test_exclude_fields_prunes_extras_before_expanding():
+    class Unreachable(dict):
+        def items(self):
+            raise AssertionError("excluded fields were expanded")
+
+    record = make_record()
+    record.__dict__.update({"http": {"request": {"headers": Unreachable(a=1)}}})
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["http.request.headers.*", "labels"],
+        extra={"labels": Unreachable()},
+    )
+    formatter.format(record)
+
+    formatter = ecs_logging.StdlibFormatter(exclude_fields=["http.request.headers"])
+    assert "http" not in formatter.format_to_ecs(record)
+
+
+def test_exclude_fields_keeps_global_extra():
+    record = make_record()
+    record.__dict__["service.version"] = "1.0"
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["service.name", "service.version", "labels"],
+        extra={"service.name": "app", "labels.env": "dev"},
+    )
+    # Only the top-level name excludes fields of the global extra
+    for ecs in (json.loads(formatter.format(record)), formatter.format_to_ecs(record)):
+        assert ecs["service"] == {"name": "app"}
+        assert "labels" not in ecs
+
+
 def test_exclude_fields_type_and_values():
     with pytest.raises(TypeError) as e:
         ecs_logging.StdlibFormatter(exclude_fields="a")
@@ -478,3 +580,425 @@ def test_ensure_ascii_with_extra_fields():
     parsed = json.loads(result)
     assert parsed["user"] == "用户"
     assert parsed["city"] == "北京"
+
+
+def test_message_rendered_once():
+    record = make_record()
+    formatter = ecs_logging.StdlibFormatter(exclude_fields=["process"])
+
+    with mock.patch.object(
+        record, "getMessage", wraps=record.getMessage
+    ) as get_message:
+        ecs = formatter.format_to_ecs(record)
+
+    assert get_message.call_count == 1
+    assert ecs["message"] == "1: hello"
+    assert ecs["log"]["original"] == "1: hello"
+
+
+def test_format_does_not_change_record(logger):
+    try:
+        raise ValueError("error")
+    except ValueError:
+        record = logger.makeRecord(
+            logger.name, logging.ERROR, __file__, 1, "%d: hello", (1,), sys.exc_info()
+        )
+    attributes = dict(record.__dict__)
+    formatter = ecs_logging.StdlibFormatter()
+    formatter.format(record)
+
+    assert record.__dict__ == attributes
+
+
+def test_format_from_many_threads(logger):
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["@timestamp", "process"], stack_trace_cache_size=2
+    )
+    records = []
+    for i in range(8):
+        try:
+            raise ValueError(i)
+        except ValueError:
+            record = logger.makeRecord(
+                logger.name, logging.ERROR, __file__, i, "%d", (i,), sys.exc_info()
+            )
+        record.__dict__["labels.thread"] = i
+        records.append(record)
+    expected = [formatter.format(record) for record in records]
+
+    barrier = threading.Barrier(len(records))
+    results = [[] for _ in records]
+
+    def run(i):
+        barrier.wait()
+        for _ in range(200):
+            results[i].append(formatter.format(records[i]))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(records))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, result in enumerate(results):
+        assert result == [expected[i]] * 200
+
+
+def test_call_site_fields_are_encoded_once(logger):
+    formatter = ecs_logging.StdlibFormatter()
+    uncached = ecs_logging.StdlibFormatter(call_site_cache_size=0)
+    records = [
+        logger.makeRecord(logger.name, logging.INFO, "/app/ü.py", 1, "a", (), None)
+        for _ in range(3)
+    ]
+    records.append(
+        logger.makeRecord(logger.name, logging.INFO, "/app/ü.py", 2, "b", (), None)
+    )
+
+    with mock.patch.object(
+        formatter, "_encode_call_site", wraps=formatter._encode_call_site
+    ) as encode_call_site:
+        for record in records:
+            assert formatter.format(record) == uncached.format(record)
+        formatter.ensure_ascii = uncached.ensure_ascii = False
+        assert formatter.format(records[0]) == uncached.format(records[0])
+    # Once per line and again after the serialization changed
+    assert encode_call_site.call_count == 3
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"extra": {"log.origin.custom": "x"}},
+        {"exclude_fields": ["log.origin.file"]},
+        {"exclude_fields": ["log.origin", "log.logger"]},
+        {"max_field_length": 10},
+    ],
+)
+def test_call_site_fields_merged_with_other_fields(logger, kwargs):
+    record = logger.makeRecord(
+        logger.name, logging.INFO, __file__, 1, "message", (), None, extra={}
+    )
+    other = logger.makeRecord(
+        logger.name,
+        logging.INFO,
+        __file__,
+        1,
+        "message",
+        (),
+        None,
+        extra={"log.origin.file.mode": "r", "log.original_size": 7},
+    )
+    formatter = ecs_logging.StdlibFormatter(**kwargs)
+    uncached = ecs_logging.StdlibFormatter(call_site_cache_size=0, **kwargs)
+    for _ in range(2):
+        assert formatter.format(record) == uncached.format(record)
+        assert formatter.format(other) == uncached.format(other)
+        ecs_logging.bind({"log.origin.thread": "main"})
+        try:
+            assert formatter.format(record) == uncached.format(record)
+        finally:
+            ecs_logging.unbind()
+
+
+def test_call_site_cache_size_types_and_values():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StdlibFormatter(call_site_cache_size=-1)
+    assert str(e.value) == "'call_site_cache_size' must be a non-negative integer"
+
+
+def test_format_matches_format_to_ecs():
+    record = make_record()
+    record.__dict__.update(
+        {"http": {"request": {"method": "GET"}}, "http.response.status_code": 200}
+    )
+    formatter = ecs_logging.StdlibFormatter(extra={"service.name": "app"})
+
+    assert formatter.format(record) == ecs_logging._utils.json_dumps(
+        formatter.format_to_ecs(record)
+    )
+
+
+@pytest.mark.parametrize(
+    "record_fields",
+    [
+        {},
+        {"service.version": "1.0", "cloud": {"provider": "aws"}},
+        {"aaa": 1, "labels": {"a": "b"}, "zzz": 2},
+    ],
+)
+def test_constant_fields_are_encoded_once(record_fields):
+    extra = {"service.name": "app", "host": {"name": "h"}, "cloud.region": "eu"}
+    formatter = ecs_logging.StdlibFormatter(extra=extra)
+
+    with mock.patch(
+        "ecs_logging._stdlib.EncodedFields", wraps=ecs_logging._utils.EncodedFields
+    ) as encoded_fields:
+        for _ in range(3):
+            record = make_record()
+            record.__dict__.update(record_fields)
+            assert formatter.format(record) == ecs_logging._utils.json_dumps(
+                formatter.format_to_ecs(record)
+            )
+    assert encoded_fields.call_count == 1
+
+
+def test_constant_fields_follow_process():
+    formatter = ecs_logging.StdlibFormatter(extra={"labels.app": "a"})
+    record = make_record()
+    assert json.loads(formatter.format(record))["process"]["pid"] == os.getpid()
+
+    # Records received from another process
+    record.process = 1
+    record.processName = "OtherProcess"
+    ecs = json.loads(formatter.format(record))
+    assert ecs["process"]["pid"] == 1
+    assert ecs["process"]["name"] == "OtherProcess"
+    assert ecs["labels"] == {"app": "a"}
+
+    record = make_record()
+    record.processName = "RenamedProcess"
+    assert json.loads(formatter.format(record))["process"]["name"] == "RenamedProcess"
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork()")
+def test_constant_fields_are_reset_after_fork():
+    formatter = ecs_logging.StdlibFormatter()
+    formatter.format(make_record())
+    assert formatter._encoded is not None
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            reset = formatter._encoded is None
+            ecs = json.loads(formatter.format(make_record()))
+            os.write(write_fd, json.dumps([reset, ecs["process"]["pid"]]).encode())
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.loads(f.read())
+    os.waitpid(pid, 0)
+    assert result == [True, pid]
+
+
+def test_extra_conflicts_with_record_field():
+    record = make_record()
+    record.__dict__["log.logger.name"] = "conflict"
+    formatter = ecs_logging.StdlibFormatter()
+
+    with pytest.raises(TypeError):
+        formatter.format(record)
+
+
+def test_global_extra_message_takes_precedence():
+    record = make_record()
+    formatter = ecs_logging.StdlibFormatter(
+        extra={"message": "global"}, exclude_fields=["process", "log.origin"]
+    )
+    assert json.loads(formatter.format(record))["message"] == "global"
+    assert formatter.format_to_ecs(record)["message"] == "global"
+    assert json.loads(formatter.format(record))["log"]["original"] == "1: hello"
+
+
+def test_global_extra_keeps_dotted_keys_within_values():
+    record = make_record()
+    formatter = ecs_logging.StdlibFormatter(
+        extra={"labels": {"app.name": "a", "none": None, "empty": {}}}
+    )
+    expected = {"app.name": "a", "empty": {}, "none": None}
+    assert json.loads(formatter.format(record))["labels"] == expected
+    assert formatter.format_to_ecs(record)["labels"] == expected
+
+
+def test_conflict_error_has_the_value():
+    record = make_record()
+    record.__dict__["service"] = "other"
+    formatter = ecs_logging.StdlibFormatter(extra={"service.name": "app"})
+    with pytest.raises(TypeError) as e:
+        formatter.format(record)
+    assert "replace value `other` with `app`" in str(e.value)
+
+
+@pytest.mark.parametrize("json_backend", ["auto", "orjson", "msgspec"])
+def test_json_backend(json_backend):
+    if json_backend != "auto":
+        pytest.importorskip(json_backend)
+    record = make_record()
+    record.msg = "Café ☕ %s"
+    record.args = ("世界",)
+    record.__dict__.update({"http": {"request": {"method": "GET"}}, "tags": ["a", 1]})
+
+    for ensure_ascii in (True, False):
+        formatter = ecs_logging.StdlibFormatter(
+            json_backend=json_backend, ensure_ascii=ensure_ascii
+        )
+        expected = ecs_logging.StdlibFormatter(ensure_ascii=ensure_ascii)
+        assert formatter.format(record) == expected.format(record)
+
+
+def test_format_bytes():
+    record = make_record()
+    record.msg = "Hello 世界"
+    record.args = ()
+
+    for ensure_ascii in (True, False):
+        formatter = ecs_logging.StdlibFormatter(ensure_ascii=ensure_ascii)
+        assert formatter.format_bytes(record) == formatter.format(record).encode(
+            "utf-8"
+        )
+
+
+def test_format_into():
+    formatter = ecs_logging.StdlibFormatter(exclude_fields=["process"])
+    expected = formatter.format(make_record()).encode("utf-8")
+
+    buffer = bytearray(b"prefix\n")
+    assert formatter.format_into(make_record(), buffer) == len(expected)
+    assert buffer == b"prefix\n" + expected
+
+    buffer = bytearray(1024)
+    view = memoryview(buffer)
+    assert formatter.format_into(make_record(), view[10:]) == len(expected)
+    assert buffer[10 : 10 + len(expected)] == expected
+
+    with pytest.raises(ValueError):
+        formatter.format_into(make_record(), view[:10])
+
+
+def test_timestamp_cache_matches_format_time():
+    class FormatTimeFormatter(ecs_logging.StdlibFormatter):
+        def formatTime(self, record, datefmt=None):
+            return super().formatTime(record, datefmt)
+
+    cached = ecs_logging.StdlibFormatter()
+    uncached = FormatTimeFormatter()
+    for created in (1584713566.0, 1584713566.9995, 1584713567.5, time.time()):
+        record = make_record()
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        assert cached.format_to_ecs(record)["@timestamp"] == (
+            uncached.format_to_ecs(record)["@timestamp"]
+        )
+
+
+def test_timestamp_with_custom_converter():
+    formatter = ecs_logging.StdlibFormatter()
+    formatter.converter = lambda _: time.gmtime(0)
+
+    assert formatter.format_to_ecs(make_record())["@timestamp"] == (
+        "1970-01-01T00:00:00.123Z"
+    )
+
+
+def test_max_field_length():
+    record = make_record()
+    record.msg = "x" * 100
+    record.args = ()
+    record.payload = NotSerializable()
+    record.count = 12345678
+
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["process"], max_field_length=15
+    )
+    assert formatter.format(record) == (
+        '{"@timestamp":"2020-03-20T14:12:46.123Z","log.level":"debug","message":"xxxxxxxxxxxxxxx...","count":12345678,'
+        '"ecs.version":"1.6.0","log":{"logger":"logger-name","origin":{"file":{"line":10,"name":"file.py"},"function":"test_function"},'
+        '"original":"xxxxxxxxxxxxxxx...","truncated":["log.original","message","payload"]},"payload":"<NotSerializabl..."}'
+    )
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("max_bytes", [350, 400, 500])
+def test_max_bytes(ensure_ascii, max_bytes):
+    record = make_record()
+    record.msg = "é" * 1000
+    record.args = ()
+    record.numbers = list(range(200))
+
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["process"], ensure_ascii=ensure_ascii, max_bytes=max_bytes
+    )
+    output = formatter.format(record)
+    assert max_bytes - 20 < len(output.encode("utf-8")) <= max_bytes
+    assert formatter.format_bytes(record) == output.encode("utf-8")
+
+    ecs = json.loads(output)
+    assert {"log.original", "message", "numbers"} <= set(ecs["log"]["truncated"])
+    assert "numbers" not in ecs
+    assert ecs["message"] == ecs["log"]["original"]
+    assert ecs["message"].endswith("é...")
+    # Short strings are cut to the same length as long ones
+    assert set(ecs["log"]["origin"]) == {"file", "function"}
+
+
+def test_max_bytes_keeps_required_fields():
+    record = make_record()
+    record.msg = "x" * 1000
+    record.args = ()
+
+    formatter = ecs_logging.StdlibFormatter(exclude_fields=["process"], max_bytes=1)
+    ecs = json.loads(formatter.format(record))
+    assert ecs["@timestamp"] == "2020-03-20T14:12:46.123Z"
+    assert ecs["log.level"] == "debug"
+    assert ecs["ecs.version"] == "1.6.0"
+    assert ecs["message"] == "..."
+
+
+@pytest.mark.parametrize("other_process", [False, True])
+def test_max_bytes_keeps_global_extra(other_process):
+    record = make_record()
+    if other_process:
+        # Not serialized once with the process fields
+        record.process = os.getpid() + 1
+
+    formatter = ecs_logging.StdlibFormatter(
+        extra={"service.name": "x" * 1000}, max_bytes=100, max_field_length=10
+    )
+    ecs = json.loads(formatter.format(record))
+    assert ecs["service"]["name"] == "x" * 1000
+    assert ecs["message"] == "..."
+
+
+def test_max_bytes_with_format_to_ecs_overridden():
+    class CustomFormatter(ecs_logging.StdlibFormatter):
+        def format_to_ecs(self, record):
+            result = super().format_to_ecs(record)
+            result["custom"] = {"text": "y" * 1000}
+            return result
+
+    formatter = CustomFormatter(
+        exclude_fields=["process", "log.truncated"], max_bytes=400
+    )
+    output = formatter.format(make_record())
+    assert len(output) <= 400
+    assert formatter.format_bytes(make_record()) == output.encode("utf-8")
+
+    ecs = json.loads(output)
+    assert ecs["custom"]["text"].endswith("y...")
+    assert ecs["message"] == "1: hello"
+    assert "truncated" not in ecs["log"]
+
+
+def test_omit_duplicate_original():
+    formatter = ecs_logging.StdlibFormatter(omit_duplicate_original=True)
+    ecs = formatter.format_to_ecs(make_record())
+    assert ecs["message"] == "1: hello"
+    assert "original" not in ecs["log"]
+
+    # Without 'message' the original isn't a duplicate
+    formatter = ecs_logging.StdlibFormatter(
+        exclude_fields=["message"], omit_duplicate_original=True
+    )
+    assert formatter.format_to_ecs(make_record())["log"]["original"] == "1: hello"
+
+
+@pytest.mark.parametrize("name", ["max_bytes", "max_field_length"])
+@pytest.mark.parametrize("value", [0, -1, 1.5, "10"])
+def test_size_limits_types_and_values(name, value):
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StdlibFormatter(**{name: value})
+    assert str(e.value) == f"'{name}' must be None or a positive integer"
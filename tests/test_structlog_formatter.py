@@ -16,7 +16,7 @@
 # under the License.
 
 import json
-from io import StringIO
+from io import BytesIO, StringIO
 from unittest import mock
 
 import pytest
@@ -206,3 +206,124 @@ def test_ensure_ascii_with_custom_fields(time):
     parsed = json.loads(result)
     assert parsed["user"] == "用户"
     assert parsed["city"] == "北京"
+
+
+@pytest.mark.parametrize("json_backend", ["auto", "orjson", "msgspec"])
+@mock.patch("time.time")
+def test_json_backend(time, json_backend, event_dict):
+    if json_backend != "auto":
+        pytest.importorskip(json_backend)
+    time.return_value = 1584720997.187709
+
+    formatter = ecs_logging.StructlogFormatter(json_backend=json_backend)
+    expected = ecs_logging.StructlogFormatter()
+    assert formatter(None, "debug", dict(event_dict)) == expected(
+        None, "debug", dict(event_dict)
+    )
+
+
+@pytest.mark.parametrize("json_backend", ["json", "orjson"])
+@mock.patch("time.time")
+def test_format_bytes_with_bytes_logger(time, json_backend, spec_validator):
+    pytest.importorskip(json_backend)
+    time.return_value = 1584720997.187709
+
+    stream = BytesIO()
+    structlog.configure(
+        processors=[
+            ecs_logging.StructlogFormatter(
+                ensure_ascii=False, json_backend=json_backend
+            ).format_bytes
+        ],
+        wrapper_class=structlog.BoundLogger,
+        context_class=dict,
+        logger_factory=structlog.BytesLoggerFactory(stream),
+    )
+
+    logger = structlog.get_logger("logger-name")
+    logger.debug("test message 世界", custom="key", **{"dot.ted": 1})
+
+    assert spec_validator(stream.getvalue().decode("utf-8")) == (
+        '{"@timestamp":"2020-03-20T16:16:37.187Z","log.level":"debug",'
+        '"message":"test message 世界","custom":"key","dot":{"ted":1},'
+        '"ecs.version":"1.6.0"}\n'
+    )
+
+
+@mock.patch("time.time")
+def test_format_into(time, event_dict):
+    time.return_value = 1584720997.187709
+
+    formatter = ecs_logging.StructlogFormatter()
+    expected = formatter(None, "debug", dict(event_dict)).encode("utf-8")
+
+    buffer = bytearray()
+    assert formatter.format_into(None, "debug", dict(event_dict), buffer) == len(
+        expected
+    )
+    assert buffer == expected
+
+
+@mock.patch("time.time")
+def test_exclude_fields(time, event_dict):
+    time.return_value = 1584720997.187709
+    event_dict["http"] = {"request": {"headers": {"x-api-key": "secret"}}}
+    event_dict["exception"] = "<stack trace here>"
+
+    formatter = ecs_logging.StructlogFormatter(
+        exclude_fields=["ecs.version", "http.request.headers.*", "error", "log.level"]
+    )
+    assert formatter(None, "debug", event_dict) == (
+        '{"@timestamp":"2020-03-20T16:16:37.187Z",'
+        '"message":"test message",'
+        '"baz":"<NotSerializable>",'
+        '"foo":"bar",'
+        '"log":{"logger":"logger-name"}}'
+    )
+
+
+def test_exclude_fields_type_and_values():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StructlogFormatter(exclude_fields="a")
+    assert str(e.value) == "'exclude_fields' must be a sequence of strings"
+
+
+@mock.patch("time.time")
+def test_max_field_length(time, event_dict):
+    time.return_value = 1584720997.187709
+    event_dict["http"] = {"request": {"body": {"content": "z" * 100}}}
+
+    formatter = ecs_logging.StructlogFormatter(max_field_length=5)
+    assert formatter(None, "debug", event_dict) == (
+        '{"@timestamp":"2020-03-20T16:16:37.187Z","log.level":"debug",'
+        '"message":"test ...",'
+        '"baz":"<NotS...",'
+        '"ecs.version":"1.6.0",'
+        '"foo":"bar",'
+        '"http":{"request":{"body":{"content":"zzzzz..."}}},'
+        '"log":{"logger":"logge...","truncated":["baz","http.request.body.content","log.logger","message"]}}'
+    )
+
+
+@pytest.mark.parametrize("json_backend", ["json", "orjson", "msgspec"])
+@mock.patch("time.time")
+def test_max_bytes(time, event_dict, json_backend):
+    time.return_value = 1584720997.187709
+    event_dict["event"] = "x" * 1000
+    event_dict["items"] = [{"id": i} for i in range(100)]
+
+    formatter = ecs_logging.StructlogFormatter(json_backend=json_backend, max_bytes=300)
+    output = formatter.format_bytes(None, "debug", dict(event_dict))
+    assert len(output) <= 300
+
+    ecs = json.loads(output)
+    assert ecs["log"]["truncated"] == ["items", "message"]
+    assert ecs["message"].endswith("x...")
+    assert ecs["foo"] == "bar"
+    assert formatter(None, "debug", dict(event_dict)) == output.decode("utf-8")
+
+
+def test_size_limits_types_and_values():
+    with pytest.raises(TypeError) as e:
+        ecs_logging.StructlogFormatter(max_bytes=0)
+    assert str(e.value) == "'max_bytes' must be None or a positive integer"
@@ -15,8 +15,36 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import collections
+import copy
+import datetime
+import decimal
+import enum
+import random
+import time
+import uuid
+
 import pytest
-from ecs_logging._utils import flatten_dict, de_dot, normalize_dict, json_dumps
+from ecs_logging._utils import (
+    EncodedFields,
+    FieldLimits,
+    FieldMatcher,
+    LRUCache,
+    SharedCache,
+    add_field_paths,
+    dict_field_paths,
+    flatten_dict,
+    de_dot,
+    format_timestamp,
+    format_unix_timestamp,
+    normalize_dict,
+    json_dumps,
+    json_dumps_bytes,
+    json_dumps_dotted,
+    json_dumps_paths,
+    merge_dicts,
+    resolve_json_backend,
+)
 
 
 def test_flatten_dict():
@@ -49,6 +77,68 @@ def test_normalize_dict_with_array():
     assert normalize_dict({"a": ["1", "2"]}) == {"a": ["1", "2"]}
 
 
+def test_normalize_dict_in_place():
+    items = [{"b.c": 1}, [{"d.e": 2}]]
+    nested = {"x.y": 3}
+    value = {"a": items, "n": nested}
+
+    assert normalize_dict(value) is value
+    assert value["a"] is items
+    assert value["n"] is nested
+    # Only dictionaries directly within lists are normalized
+    assert items == [{"b": {"c": 1}}, [{"d.e": 2}]]
+    assert nested == {"x": {"y": 3}}
+
+
+def test_normalize_dict_max_depth():
+    value = {"a.b": {"c.d": {"e.f": 1}}, "g": [{"h.i": {"j.k": 2}}]}
+    assert normalize_dict(copy.deepcopy(value), max_depth=0) == {
+        "a": {"b": {"c.d": {"e.f": 1}}},
+        "g": [{"h.i": {"j.k": 2}}],
+    }
+    # The depth is counted in the expanded dictionaries
+    assert normalize_dict(copy.deepcopy(value), max_depth=1) == {
+        "a": {"b": {"c.d": {"e.f": 1}}},
+        "g": [{"h": {"i": {"j.k": 2}}}],
+    }
+    assert normalize_dict(copy.deepcopy(value), max_depth=2) == {
+        "a": {"b": {"c": {"d": {"e.f": 1}}}},
+        "g": [{"h": {"i": {"j.k": 2}}}],
+    }
+    assert normalize_dict(copy.deepcopy(value)) == {
+        "a": {"b": {"c": {"d": {"e": {"f": 1}}}}},
+        "g": [{"h": {"i": {"j": {"k": 2}}}}],
+    }
+
+
+def test_normalize_dict_deeply_nested():
+    value = leaf = {}
+    for _ in range(5000):
+        leaf["a.b"] = {}
+        leaf = leaf["a.b"]
+    leaf["c"] = 1
+
+    normalized = normalize_dict(value)
+    for _ in range(5000):
+        normalized = normalized["a"]["b"]
+    assert normalized == {"c": 1}
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"a": 1, "a.b": 2},
+        {"a.b": 1, "a.b.c": 2},
+        {"a.b": 1, "a": {"b": 2}},
+        {"a": {"b": {"c": 1}}, "a.b": 1},
+    ],
+)
+def test_normalize_dict_conflict(value):
+    with pytest.raises(TypeError) as e:
+        normalize_dict(value)
+    assert str(e.value).startswith("Type mismatch at key")
+
+
 @pytest.mark.parametrize(
     ["value", "expected"],
     [
@@ -89,4 +179,316 @@ def test_normalize_dict_with_array():
     ],
 )
 def test_json_dumps(value, expected):
-    assert json_dumps(value) == expected
+    assert json_dumps(copy.deepcopy(value)) == expected
+    assert json_dumps_bytes(value) == expected.encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {},
+        {"log.level": "info"},
+        {"log.level": "info", "log.logger": "app", "message": "hello"},
+        {"@timestamp": "2021-01-01...", "message": ["hello"], "custom": "value"},
+        {"a.b": 1, "a.c.d": True, "a.c.e": None, "b": [{"y": 1, "x": 2}], "a.z": 1.5},
+        {"http": {"request": {"method": "GET"}}, "http.response.status_code": 200},
+        {"ecs": {"version": "1.6.0"}, "x": {"y.z": {"w": "v"}}, "o": object()},
+        {
+            "message": "hello 世界",
+            "log": {"level": "debug", "origin": {"function": "f"}},
+        },
+    ],
+)
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_json_dumps_dotted(fields, ensure_ascii):
+    nested = {}
+    for field, value in flatten_dict(fields).items():
+        if value is not None:
+            merge_dicts(de_dot(field, value), nested)
+    assert json_dumps_dotted(fields, ensure_ascii=ensure_ascii) == json_dumps(
+        nested, ensure_ascii=ensure_ascii
+    )
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"a": 1, "a.b": 2},
+        {"a.b.c": 1, "a.b": 2},
+        {"a": {"b": 1}, "a.b": 2},
+        {"message": "hello", "message.id": 1},
+    ],
+)
+def test_json_dumps_dotted_conflict(fields):
+    with pytest.raises(TypeError) as e:
+        json_dumps_dotted(fields)
+    assert str(e.value).startswith("Type mismatch at key")
+
+
+@pytest.mark.parametrize(
+    ["encoded", "fields"],
+    [
+        ({"service.name": "app", "host.name": "h"}, {"a": 1, "z": 2}),
+        ({"service.name": "app", "host.name": "h"}, {"service.version": "1"}),
+        ({"environment": "dev", "message": "hi"}, {"@timestamp": "t", "b": {"c": 3}}),
+        ({"log.level": "info", "a": None}, {"log.logger": "app"}),
+        ({"b": 1}, {}),
+    ],
+)
+def test_json_dumps_paths_encoded_fields(encoded, fields):
+    encoded_items, items = [], []
+    for field, value in encoded.items():
+        add_field_paths(encoded_items, tuple(field.split(".")), value)
+    for field, value in fields.items():
+        add_field_paths(items, tuple(field.split(".")), value)
+
+    expected = json_dumps_dotted(dict(encoded, **fields))
+    assert json_dumps_paths(list(items), encoded=EncodedFields(encoded_items)) == (
+        expected
+    )
+
+
+def test_json_dumps_paths_encoded_fields_conflict():
+    with pytest.raises(TypeError) as e:
+        json_dumps_paths(
+            [(("a", "b"), 1)], encoded=EncodedFields([(("a", "b", "c"), 2)])
+        )
+    assert str(e.value).startswith("Type mismatch at key")
+
+
+class StructlogValue:
+    def __structlog__(self):
+        return "structlog-value"
+
+
+class NotSerializable:
+    def __repr__(self):
+        return "<NotSerializable>"
+
+
+class Color(enum.IntEnum):
+    RED = 1
+
+
+class Mode(enum.Enum):
+    FAST = "fast"
+    SLOW = 2
+
+
+class Tag(str):
+    pass
+
+
+Point = collections.namedtuple("Point", ["x", "y"])
+
+
+@pytest.mark.parametrize("json_backend", ["orjson", "msgspec"])
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize(
+    "value",
+    [
+        {},
+        {"log": {"level": "info"}, "message": "hello", "@timestamp": "2021-01-01..."},
+        {"message": 'Hello 世界 ☕ 😀 \x7f \x00\x1f \b\f\n\r\t "\\/ \u2028'},
+        {"b": {"d": [1, 2.5, None, True, False], "c": {"z": 1, "a": -1}}, "a": []},
+        {"x": NotSerializable(), "y": StructlogValue(), "z": [NotSerializable()]},
+        {"when": datetime.datetime(2021, 1, 1), "day": datetime.date(2021, 1, 1)},
+        {"tag": Tag("tagged"), "color": Color.RED, "point": Point(1, 2)},
+        {"big": 2**70, "keys": {1: "one", 2: "two"}},
+        {"floats": [float("nan"), float("inf"), -float("inf"), 1e16, 1e-5, -0.0]},
+        {"floats": [0.0001, 1.5, 9999999999999998.0, 1 / 3]},
+        {"id": uuid.UUID(int=1), "mode": Mode.FAST, "shape": [Mode.SLOW]},
+        {"amount": decimal.Decimal("1.5"), "data": b"ab", "ids": {1}},
+        {"deep": {"a": {"b": {"c": {"d": {"e": {"f": ["g", {"h": "i"}]}}}}}}},
+    ],
+)
+def test_json_backend_conformance(json_backend, ensure_ascii, value):
+    pytest.importorskip(json_backend)
+    expected = json_dumps(copy.deepcopy(value), ensure_ascii=ensure_ascii)
+    assert (
+        json_dumps(
+            copy.deepcopy(value), ensure_ascii=ensure_ascii, json_backend=json_backend
+        )
+        == expected
+    )
+    assert json_dumps_bytes(
+        copy.deepcopy(value), ensure_ascii=ensure_ascii, json_backend=json_backend
+    ) == expected.encode("utf-8")
+    if all(isinstance(key, str) for key in flatten_dict(value)):
+        assert json_dumps_dotted(
+            value, ensure_ascii=ensure_ascii, json_backend=json_backend
+        ) == json_dumps_dotted(value, ensure_ascii=ensure_ascii)
+
+
+def test_resolve_json_backend():
+    assert resolve_json_backend("json") == "json"
+    assert resolve_json_backend("auto") in ("json", "orjson", "msgspec")
+
+    with pytest.raises(ValueError) as e:
+        resolve_json_backend("simplejson")
+    assert str(e.value) == (
+        "'json_backend' must be one of: 'auto', 'json', 'orjson', 'msgspec'"
+    )
+
+
+def test_format_timestamp():
+    seconds = 1584713566
+    assert format_timestamp(seconds, 123.0) == "2020-03-20T14:12:46.123Z"
+    assert format_timestamp(seconds, 0) == "2020-03-20T14:12:46.000Z"
+    assert format_timestamp(seconds + 1, 999.9) == "2020-03-20T14:12:47.999Z"
+    assert format_timestamp(seconds, 5.5) == "2020-03-20T14:12:46.005Z"
+
+    for _ in range(1000):
+        seconds = random.randint(0, 2**32)
+        expected = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+        assert format_timestamp(seconds, 42) == expected + ".042Z"
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [0.0, 1584720997.187709, 1584720997.9999996, 1584720997.0004999, 1e9 + 0.5],
+)
+def test_format_unix_timestamp(timestamp):
+    timestamps = [timestamp] + [random.uniform(0, 2**32) for _ in range(1000)]
+    for value in timestamps:
+        expected = (
+            datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f"
+            )[:-3]
+            + "Z"
+        )
+        assert format_unix_timestamp(value) == expected
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    assert cache.set("c", 3) == ("b", 2)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_shared_cache_evicts_oldest():
+    cache = SharedCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Lookups don't change the order of the entries
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") == 3
+    assert cache.get("a", 0) == 0
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize(
+    ["fields", "path", "expected"],
+    [
+        ([], ("a",), False),
+        (["a"], ("a",), True),
+        (["a"], ("a", "b", "c"), True),
+        (["a.b"], ("a",), False),
+        (["a.b"], ("a", "c"), False),
+        (["a.*"], ("a",), False),
+        (["a.*"], ("a", "b"), True),
+        (["*.b"], ("c", "b", "d"), True),
+        (["a.x-*"], ("a", "x-y"), True),
+        (["a.x-*"], ("a", "y"), False),
+        (["a.*.c", "a.b.d"], ("a", "b", "d"), True),
+        (["a.*.c", "a.b.d"], ("a", "b", "c"), True),
+        (["a.*.c", "a.b.d"], ("a", "b", "e"), False),
+    ],
+)
+def test_field_matcher(fields, path, expected):
+    assert FieldMatcher(fields).matches(path) is expected
+
+
+def test_field_matcher_prune():
+    value = {
+        "a": {"b": 1, "c": {"d": 2}},
+        "e.f": 3,
+        "e": {"g": 4},
+        "h": {"i": 5, "j": 6},
+        "k": {"l": 7},
+    }
+    pruned = FieldMatcher(["a.c.*", "e.f", "h.*", "x"]).prune(value)
+    assert pruned == {"a": {"b": 1}, "e": {"g": 4}, "k": {"l": 7}}
+    assert value["a"] == {"b": 1, "c": {"d": 2}}
+    assert pruned["k"] is value["k"]
+
+
+def test_field_matcher_select():
+    value = {
+        "a": {"b": 1, "c": {"d": 2}},
+        "e.f": 3,
+        "e": {"g": 4},
+        "h": {"i": 5, "j": 6},
+        "k": {"l": 7},
+    }
+    selected = FieldMatcher(["a.c.*", "e.f", "h.*", "x"]).select(value)
+    assert selected == {"a": {"c": {"d": 2}}, "e.f": 3, "h": {"i": 5, "j": 6}}
+    assert selected["h"] is value["h"]
+    assert FieldMatcher([]).select(value) == {}
+
+
+def test_add_field_paths_with_exclude():
+    items = []
+    exclude = FieldMatcher(["a.b", "c.*.e"])
+    add_field_paths(items, ("a",), {"b": {"x": 1}, "b.y": 2, "z": 3}, exclude)
+    add_field_paths(items, ("c", "d"), {"e": 4, "f": 5}, exclude)
+    add_field_paths(items, ("c", "d", "e"), 6, exclude)
+    assert items == [(("a", "z"), 3), (("c", "d", "f"), 5)]
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"a": {"b": 1, "c": {"d": None}}, "a.b": [1, {"x": 2}], "e": {}},
+        {"@timestamp": "now", "log": {"level": "info"}, "message": {"a": 1}},
+        {"ecs.version": "1.6.0", "ecs": {"b": 1}, "f": {1: 2}},
+    ],
+)
+def test_dict_field_paths(value):
+    assert json_dumps_paths(dict_field_paths(value)) == json_dumps(copy.deepcopy(value))
+
+
+def test_field_limits_max_field_length():
+    limits = FieldLimits(max_field_length=3)
+    items = [(("message",), "abcdef"), (("a", "b"), "abc"), (("a", "c"), 12345)]
+    assert limits.dumps(items, json_dumps_paths) == (
+        '{"message":"abc...","a":{"b":"abc","c":12345},"log":{"truncated":["message"]}}'
+    )
+    # The items aren't changed
+    assert items[0] == (("message",), "abcdef")
+
+    limits = FieldLimits(max_field_length=3, mark=False)
+    assert limits.dumps(items, json_dumps_paths) == (
+        '{"message":"abc...","a":{"b":"abc","c":12345}}'
+    )
+
+
+def test_field_limits_max_bytes():
+    limits = FieldLimits(max_bytes=70, mark=False)
+    items = [
+        (("@timestamp",), "2020-03-20T16:16:37.187Z"),
+        (("a",), "a" * 40),
+        (("b",), "b" * 10),
+        (("c",), list(range(20))),
+    ]
+    # Strings are cut to the same length and longer values are dropped
+    assert limits.dumps(items, json_dumps_paths) == (
+        '{"@timestamp":"2020-03-20T16:16:37.187Z","a":"aaaa...","b":"bbbb..."}'
+    )
+    assert limits.dumps(items[:1], json_dumps_paths) == (
+        '{"@timestamp":"2020-03-20T16:16:37.187Z"}'
+    )